@@ -0,0 +1,318 @@
+# Adaptive Large Neighborhood Search (Ropke & Pisinger, 2006) driven by a wall-clock budget
+import math
+import time
+
+import numpy as np
+
+from Solution import Solution
+from Assignment import assign_vehicles
+from Insertion import InsertionCache
+from Route import demand_arrays
+
+
+"""
+At every iteration some customers are removed from the current solution by a destroy operator and inserted again by a
+repair operator. The new solution is accepted with the simulated annealing criterion, with a temperature decreasing
+with the elapsed fraction of the time budget, so the search always ends cold at the deadline whatever the budget.
+
+The operators are chosen by roulette wheel. Every segment of iterations their weights are moved towards the average
+score they obtained: SCORE_BEST for a new best solution, SCORE_BETTER for a solution better than the current one and
+SCORE_ACCEPTED for an accepted worse solution.
+
+Insertions respect the capacity of the largest vehicle, and cost the change in fuel cost of the route (or in its cost
+with the arc costs of a CostModel), which takes into account a change of vehicle type (see Solution.cost_change). The
+insertion costs of the pending customers are cached for every route and only the column of the route which received a
+customer is recomputed (see InsertionCache), the greedy repair takes the cheapest insertion from the heap of the
+cache. The availability of
+the fleet is taken into account by the evaluation, through the minimum cost assignment of the routes to the vehicles
+(see Assignment), with a penalty for every route left without vehicle.
+"""
+
+DESTROY = ("random", "worst", "shaw", "route")
+REPAIR = ("greedy", "regret-2", "regret-3")
+REGRET = (1, 2, 3)  # k of every repair operator
+
+SCORE_BEST = 33
+SCORE_BETTER = 9
+SCORE_ACCEPTED = 13
+
+
+class ALNS:
+    """
+    operators, adaptive weights and parameters of a run
+    """
+
+    def __init__(self, nodes, dist, fleet, gas_price, removal=(0.05, 0.3), worst_randomness=3, shaw_randomness=6,
+                 segment=100, reaction=0.1, start_worse=0.05, end_temperature=0.002, penalty=50.0, seed=0,
+                 cost_model=None):
+        """
+        :param nodes: info about customers
+        :param dist: distance between nodes
+        :param fleet: Fleet
+        :param gas_price: price of the fuel
+        :param removal: (min, max) fraction of the customers removed at every iteration
+        :param worst_randomness: the higher, the more worst removal sticks to the worst customers
+        :param shaw_randomness: the higher, the more Shaw removal sticks to the most related customers
+        :param segment: iterations between two updates of the weights
+        :param reaction: how fast the weights follow the scores
+        :param start_worse: a solution start_worse (relative) worse than the initial one is accepted with probability
+            0.5 at the beginning
+        :param end_temperature: final temperature, as a fraction of the initial one
+        :param penalty: cost of every route which cannot be assigned to a vehicle
+        :param seed: seed of the random generator
+        :param cost_model: optional CostModel, replaces the fuel cost in the removals, in the insertions and in the
+            assignment of the solutions to the vehicles
+        """
+        self.nodes = nodes
+        self.dist = dist
+        self.fleet = fleet
+        self.gas_price = gas_price
+        self.cost_model = cost_model
+        self.n = len(nodes) - 1
+        self.removal = (max(1, int(removal[0] * self.n)), max(1, int(removal[1] * self.n)))
+        self.worst_randomness = worst_randomness
+        self.shaw_randomness = shaw_randomness
+        self.segment = segment
+        self.reaction = reaction
+        self.start_worse = start_worse
+        self.end_temperature = end_temperature
+        self.penalty = penalty
+        self.rng = np.random.default_rng(seed)
+
+        self.demand_kg, self.demand_m3 = demand_arrays(nodes)
+        self.max_routes = int(fleet.availability.sum())
+
+        # relatedness of the Shaw removal: distance on the map (lon/lat) and difference of load, both scaled to [0, 1]
+        position = np.array([[nodes[i]["lon"], nodes[i]["lat"]] for i in range(len(nodes))], dtype=float)
+        geo = np.sqrt(((position[:, None, :] - position[None, :, :]) ** 2).sum(axis=2))
+        load = np.abs(self.demand_kg[:, None] - self.demand_kg[None, :])
+        self.relatedness = 9 * geo / max(geo.max(), 1e-9) + 2 * load / max(load.max(), 1e-9)
+
+        self.weights = {"destroy": np.ones(len(DESTROY)), "repair": np.ones(len(REPAIR))}
+
+    # ############################################ EVALUATION ##################################################
+
+    def evaluate(self, routes):
+        """
+        :return: (penalized fuel cost, assignment) of the routes
+        """
+        assignment = assign_vehicles(routes, self.dist, self.nodes, self.fleet, self.gas_price, self.cost_model)
+        return assignment["cost"] + self.penalty * len(assignment["unassigned"]), assignment
+
+    def unit_cost(self, solution, r_id):
+        """
+        :return: fuel consumption per km of the vehicle route r is assigned to, 1 with a cost model (the arc lengths of
+            the solution are costs)
+        """
+        if self.cost_model is not None:
+            return 1.0
+        return self.fleet.consumption[self.fleet.route_type(solution.kg[r_id], solution.m3[r_id])]
+
+    # ############################################# DESTROY ####################################################
+
+    def remove_customers(self, solution, customers):
+        """
+        removes the customers from their routes (the empty routes are kept)
+        """
+        for u in customers:
+            for r_id, route in enumerate(solution):
+                if u in route:
+                    i = route.index(u)
+                    kg = solution.kg[r_id] - self.demand_kg[u]
+                    d = solution.arc_matrix(kg, solution.m3[r_id] - self.demand_m3[u])
+                    change = d[route[i - 1], route[i + 1]] - d[route[i - 1], u] - d[u, route[i + 1]]
+                    solution.remove(r_id, i, change)
+                    break
+
+    def destroy_random(self, solution, q):
+        customers = [c for route in solution for c in route if c != 0]
+        removed = self.rng.choice(customers, q, replace=False).tolist()
+        self.remove_customers(solution, removed)
+        return removed
+
+    def destroy_worst(self, solution, q):
+        """
+        removes, one at a time, customers whose removal saves the most fuel (or cost), with some randomness
+        """
+        removed = list()
+        for _ in range(q):
+            gains = list()
+            for r_id, route in enumerate(solution):
+                d = solution.arc_matrix(solution.kg[r_id], solution.m3[r_id])
+                unit_cost = self.unit_cost(solution, r_id)
+                for i in range(1, len(route) - 1):
+                    gain = d[route[i - 1], route[i]] + d[route[i], route[i + 1]] - d[route[i - 1], route[i + 1]]
+                    gains.append((gain * unit_cost, route[i]))
+            gains.sort(reverse=True)
+            u = gains[int(self.rng.random() ** self.worst_randomness * len(gains))][1]
+            self.remove_customers(solution, [u])
+            removed.append(u)
+        return removed
+
+    def destroy_shaw(self, solution, q):
+        """
+        removes customers related (close on the map, similar load) to the customers already removed
+        """
+        customers = [c for route in solution for c in route if c != 0]
+        removed = [customers[self.rng.integers(len(customers))]]
+        remaining = set(customers) - set(removed)
+        while len(removed) < q:
+            u = removed[self.rng.integers(len(removed))]
+            candidates = sorted(remaining, key=lambda c: self.relatedness[u, c])
+            v = candidates[int(self.rng.random() ** self.shaw_randomness * len(candidates))]
+            removed.append(v)
+            remaining.remove(v)
+        self.remove_customers(solution, removed)
+        return removed
+
+    def destroy_route(self, solution, q):
+        """
+        removes whole random routes until at least q customers are removed
+        """
+        removed = list()
+        for r_id in self.rng.permutation(len(solution)):
+            if len(removed) >= q:
+                break
+            removed += solution[r_id][1:-1]
+        self.remove_customers(solution, removed)
+        return removed
+
+    # ############################################## REPAIR ####################################################
+
+    def repair(self, solution, removed, k):
+        """
+        inserts the removed customers, at every step the one with the largest regret (difference between the cost
+        of its best insertion and of its best insertion in the k-1 next routes), k = 1 is the greedy insertion.
+        Raises ValueError if a customer fits in no vehicle type, no route could ever take it
+        """
+        oversized = [u for u in removed if self.fleet.smallest_type(self.demand_kg[u], self.demand_m3[u]) == -1]
+        if oversized:
+            raise ValueError(f"customers {oversized} exceed the capacity of every vehicle")
+
+        # an empty route is always available, as long as vehicles are left
+        if all(len(route) > 2 for route in solution) and len(solution) < self.max_routes:
+            solution.add_route()
+
+        pending = np.array(removed, dtype=int)
+        cache = InsertionCache(solution, self.dist, self.nodes, pending, upgrade=True)
+        left = np.ones(len(pending), dtype=bool)
+
+        while left.any():
+            if k == 1:
+                move = cache.cheapest(set(pending[left].tolist()))
+                if move is None:
+                    # no route can take a customer: open a route even if the vehicles are finished
+                    solution.add_route()
+                    continue
+                _, u, r_id, j = move
+            else:
+                cache.refresh()
+                customers = pending[left]
+                cost = cache.delta[customers]
+
+                if np.isinf(cost.min(axis=1)).any():
+                    # no route can take a customer: open a route even if the vehicles are finished
+                    solution.add_route()
+                    continue
+
+                ordered = np.sort(cost, axis=1)
+                if cost.shape[1] > 1:
+                    regret = (np.where(np.isinf(ordered[:, 1:k]), 1e9, ordered[:, 1:k]) - ordered[:, :1]).sum(axis=1)
+                    a = int(np.lexsort((ordered[:, 0], -regret))[0])
+                else:
+                    a = 0
+                u = int(customers[a])
+                r_id = int(np.argmin(cost[a]))
+                j = int(cache.position[u, r_id])
+
+            route = solution[r_id]
+            d = solution.arc_matrix(solution.kg[r_id] + self.demand_kg[u], solution.m3[r_id] + self.demand_m3[u])
+            solution.insert(r_id, j, u, d[route[j - 1], u] + d[u, route[j]] - d[route[j - 1], route[j]])
+            left[pending == u] = False
+
+            if len(route) == 2 and len(solution) < self.max_routes:
+                # the empty route has been used, open a new one
+                solution.add_route()
+
+        return [route for route in solution.routes if len(route) > 2]
+
+    # ############################################### SEARCH ###################################################
+
+    def select(self, kind):
+        weights = self.weights[kind]
+        return int(self.rng.choice(len(weights), p=weights / weights.sum()))
+
+    def run(self, routes, time_limit=10.0, max_iterations=None):
+        """
+        :param routes: initial solution
+        :param time_limit: wall-clock budget in seconds
+        :param max_iterations: optional limit on the number of iterations
+        :return: dictionary with the best routes, their vehicle types, cost and feasibility, the history of the best
+            cost (seconds, iteration, cost), the number of iterations and the final weights of the operators
+        """
+        start = time.perf_counter()
+        current = [list(route) for route in routes]
+        current_cost, assignment = self.evaluate(current)
+        best, best_cost, best_assignment = current, current_cost, assignment
+        history = [(0.0, 0, best_cost)]
+
+        start_temperature = -self.start_worse * current_cost / math.log(0.5)
+        scores = {kind: np.zeros(len(self.weights[kind])) for kind in self.weights}
+        uses = {kind: np.zeros(len(self.weights[kind])) for kind in self.weights}
+
+        iteration = 0
+        while max_iterations is None or iteration < max_iterations:
+            elapsed = time.perf_counter() - start
+            if elapsed >= time_limit:
+                break
+            iteration += 1
+            temperature = start_temperature * self.end_temperature ** (elapsed / time_limit)
+
+            destroy = self.select("destroy")
+            repair = self.select("repair")
+            q = int(self.rng.integers(self.removal[0], self.removal[1] + 1))
+
+            solution = Solution(current, self.dist, self.nodes, self.fleet, gas_price=self.gas_price,
+                                cost_model=self.cost_model)
+            removed = getattr(self, "destroy_" + DESTROY[destroy])(solution, q)
+            candidate = self.repair(solution, removed, REGRET[repair])
+            cost, assignment = self.evaluate(candidate)
+
+            score = 0
+            if cost < best_cost - 0.000001:
+                best, best_cost, best_assignment = candidate, cost, assignment
+                history.append((time.perf_counter() - start, iteration, cost))
+                score = SCORE_BEST
+            if cost < current_cost - 0.000001:
+                score = max(score, SCORE_BETTER)
+                current, current_cost = candidate, cost
+            elif self.rng.random() < math.exp(-(cost - current_cost) / max(temperature, 1e-12)):
+                score = max(score, SCORE_ACCEPTED)
+                current, current_cost = candidate, cost
+
+            for kind, operator in (("destroy", destroy), ("repair", repair)):
+                scores[kind][operator] += score
+                uses[kind][operator] += 1
+
+            if iteration % self.segment == 0:
+                for kind in self.weights:
+                    used = uses[kind] > 0
+                    self.weights[kind][used] = (1 - self.reaction) * self.weights[kind][used] + \
+                        self.reaction * scores[kind][used] / uses[kind][used]
+                    self.weights[kind] = np.maximum(self.weights[kind], 0.01)
+                    scores[kind][:] = 0
+                    uses[kind][:] = 0
+
+        return {"routes": best, "types": best_assignment["types"], "cost": best_cost,
+                "feasible": best_assignment["feasible"], "history": history, "iterations": iteration,
+                "weights": {kind: dict(zip(DESTROY if kind == "destroy" else REPAIR, self.weights[kind].tolist()))
+                            for kind in self.weights}}
+
+
+def alns(nodes, dist, fleet, gas_price, routes, time_limit=10.0, max_iterations=None, seed=0, **parameters):
+    """
+    improves the routes with the adaptive large neighborhood search until the time budget is over.
+    :param parameters: see ALNS
+    :return: see ALNS.run
+    """
+    return ALNS(nodes, dist, fleet, gas_price, seed=seed, **parameters).run(routes, time_limit, max_iterations)
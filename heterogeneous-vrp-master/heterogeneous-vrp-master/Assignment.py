@@ -0,0 +1,246 @@
+# Assignment of the routes of a solution to the vehicles of the fleet
+import heapq
+
+import numpy as np
+
+from Evaluation import Evaluator, RouteBatch
+
+
+"""
+Every route has to be driven by a vehicle whose type can carry its load and volume, at a fuel cost of
+distance * consumption * gas_price (or at the cost given by a CostModel), and no more than availability[t] routes can
+use type t. This is a transportation problem (routes -> vehicle types) solved as a min cost flow with successive
+shortest paths.
+
+A route is inserted on its cheapest type if a vehicle of that type is still free, otherwise it is inserted on a type
+and a chain of already assigned routes is moved to other types until a type with a free vehicle is reached. Since the
+chain passes every type at most once, the cheapest chain is found with Bellman-Ford on the graph of the vehicle types,
+where the arc (a, b) costs the cheapest move of a route from a to b.
+
+If all the routes can be assigned, the order in which they are inserted does not matter and they are inserted one by
+one, each in O(T^3 + T log R) (see TypeMoves): hundreds of routes take a few milliseconds. Otherwise, to leave out
+the routes which are the most expensive to serve, the routes are inserted in order of cheapest chain. The chains are
+searched backwards, from the types with a free vehicle, so one Bellman-Ford gives the cheapest chain of every route and
+this insertion also takes O(T^3 + T log R) per route.
+"""
+
+
+def route_type_costs(routes, dist, nodes, fleet, gas_price, cost_model=None):
+    """
+    :param cost_model: optional CostModel, replaces the fuel cost
+    :return: R x T matrix with the fuel cost of every route on every vehicle type, inf where the route does not fit
+    """
+    evaluation = Evaluator(dist, nodes, fleet, gas_price, cost_model).evaluate(RouteBatch.from_routes(routes))
+    kg = evaluation["kg"]
+    m3 = evaluation["m3"]
+
+    fits = (kg[:, None] <= fleet.capacity_kg[None, :]) & (m3[:, None] <= fleet.capacity_m3[None, :])
+    return np.where(fits, evaluation["type costs"], np.inf)
+
+
+class TypeMoves:
+    """
+    Cheapest move of an assigned route between every pair of vehicle types. For every pair (a, b) the routes assigned
+    to a are kept in a heap by cost of the move to b; a route which leaves a is removed lazily, when it reaches the top
+    of the heap. Adding a route takes O(T log R) and reading the T x T matrix of the moves O(T^2) (amortized).
+    """
+
+    def __init__(self, costs):
+        self.costs = costs
+        self.n_types = costs.shape[1]
+        self.heaps = [[list() for b in range(self.n_types)] for a in range(self.n_types)]
+
+    def add(self, r, a):
+        """
+        registers route r as assigned to type a
+        """
+        for b in range(self.n_types):
+            if b != a and self.costs[r, b] != np.inf:
+                heapq.heappush(self.heaps[a][b], (self.costs[r, b] - self.costs[r, a], r))
+
+    def matrix(self, assigned):
+        """
+        :return: (move, mover) where move[a, b] is the cost of the cheapest move of a route assigned to type a to type
+            b and mover[a, b] that route (inf and -1 if there is none)
+        """
+        move = np.full((self.n_types, self.n_types), np.inf)
+        mover = np.full((self.n_types, self.n_types), -1)
+        for a in range(self.n_types):
+            for b in range(self.n_types):
+                heap = self.heaps[a][b]
+                while heap and assigned[heap[0][1]] != a:
+                    heapq.heappop(heap)
+                if heap:
+                    move[a, b], mover[a, b] = heap[0]
+        return move, mover
+
+
+def cheapest_chains(move, free):
+    """
+    Bellman-Ford on the vehicle types, backwards from the types with a free vehicle.
+    :param move: T x T costs of the moves between types, see TypeMoves
+    :param free: True for the types with a free vehicle
+    :return: (label, succ) cost of the cheapest chain of moves from every type to a free type and next type in the
+        chain (-1 for the free type where it ends)
+    """
+    n_types = len(free)
+    label = np.where(free, 0.0, np.inf)
+    succ = np.full(n_types, -1)
+    for _ in range(n_types - 1):
+        candidate = move + label[None, :]
+        b = np.argmin(candidate, axis=1)
+        best = candidate[np.arange(n_types), b]
+        better = best < label - 1e-9
+        if not better.any():
+            break
+        label = np.where(better, best, label)
+        succ = np.where(better, b, succ)
+    return label, succ
+
+
+def apply_chain(assigned, used, moves, r, start, succ, mover):
+    """
+    inserts route r on type start and moves the routes of the chain which leaves it, up to a free type
+    """
+    assigned[r] = start
+    moves.add(r, start)
+    a = start
+    while succ[a] != -1:
+        b = succ[a]
+        assigned[mover[a, b]] = b
+        moves.add(mover[a, b], b)
+        a = b
+    used[a] += 1
+
+
+def insert_routes(costs, availability):
+    """
+    inserts the routes one by one, in their order. The result is optimal if every route gets a vehicle.
+    :return: (assigned, unassigned, used), see assign_types
+    """
+    assigned = np.full(len(costs), -1)
+    used = np.zeros(costs.shape[1], dtype=int)
+    moves = TypeMoves(costs)
+    unassigned = list()
+
+    for r in range(len(costs)):
+        free = used < availability
+        cheapest = int(np.argmin(costs[r]))
+
+        if costs[r, cheapest] == np.inf:
+            # the route is larger than every vehicle
+            unassigned.append(r)
+            continue
+
+        if free[cheapest]:
+            # no chain can be cheaper than a free vehicle of the cheapest type
+            assigned[r] = cheapest
+            moves.add(r, cheapest)
+            used[cheapest] += 1
+            continue
+
+        move, mover = moves.matrix(assigned)
+        label, succ = cheapest_chains(move, free)
+        reachable = costs[r] + label
+        start = int(np.argmin(reachable))
+        if reachable[start] == np.inf:
+            unassigned.append(r)
+            continue
+
+        apply_chain(assigned, used, moves, r, start, succ, mover)
+
+    return assigned, unassigned, used
+
+
+def insert_cheapest_routes(costs, availability):
+    """
+    inserts at every step the route with the cheapest chain, among all the routes not assigned yet. This is the
+    successive shortest path algorithm, so the assigned routes are served at minimum cost also when some routes are
+    left without vehicle. The chains only depend on the types, so they are computed once per insertion for all the
+    routes, and the routes not assigned yet are kept in a heap for every type by their cost on it: an insertion takes
+    O(T^3 + T log R).
+    :return: (assigned, unassigned, used), see assign_types
+    """
+    assigned = np.full(len(costs), -1)
+    used = np.zeros(costs.shape[1], dtype=int)
+    moves = TypeMoves(costs)
+    pending = [[(costs[r, t], r) for r in np.flatnonzero(np.isfinite(costs[:, t])).tolist()]
+               for t in range(costs.shape[1])]
+    for heap in pending:
+        heapq.heapify(heap)
+
+    while True:
+        free = used < availability
+        move, mover = moves.matrix(assigned)
+        label, succ = cheapest_chains(move, free)
+
+        # cheapest route not assigned yet on every type, the assigned ones are removed lazily
+        reachable = np.full(costs.shape[1], np.inf)
+        for t, heap in enumerate(pending):
+            while heap and assigned[heap[0][1]] != -1:
+                heapq.heappop(heap)
+            if heap:
+                reachable[t] = heap[0][0] + label[t]
+        start = int(np.argmin(reachable))
+        if reachable[start] == np.inf:
+            break
+
+        apply_chain(assigned, used, moves, pending[start][0][1], start, succ, mover)
+
+    return assigned, np.flatnonzero(assigned == -1).tolist(), used
+
+
+def assign_types(costs, availability):
+    """
+    solves the transportation problem routes -> vehicle types: the maximum number of routes is assigned, at minimum
+    cost.
+    :param costs: R x T costs of the routes on the vehicle types, inf where a route does not fit
+    :param availability: number of vehicles of every type
+    :return: (type of every route with -1 for the routes left without vehicle, list of these routes, vehicles used of
+        every type)
+    """
+    if np.isfinite(costs).any(axis=1).sum() > np.sum(availability):
+        # more routes fit in a vehicle than there are vehicles, some are left out for sure
+        return insert_cheapest_routes(costs, availability)
+    assigned, unassigned, used = insert_routes(costs, availability)
+    if any(np.isfinite(costs[r]).any() for r in unassigned):
+        # routes which fit in a vehicle are left out, choose them by cost
+        assigned, unassigned, used = insert_cheapest_routes(costs, availability)
+    return assigned, unassigned, used
+
+
+def assign_vehicles(routes, dist, nodes, fleet, gas_price, cost_model=None):
+    """
+    assigns every route to a vehicle type minimizing the total fuel cost under the availability of the fleet.
+    :param routes: list of routes
+    :param dist: distance between nodes
+    :param nodes: info about customers
+    :param fleet: Fleet
+    :param gas_price: price of the fuel
+    :param cost_model: optional CostModel, the routes are assigned at minimum cost of the model instead of fuel cost
+    :return: dictionary with
+        "types": vehicle type of every route, -1 for the routes which could not be assigned
+        "cost": fuel cost (or cost of the model) of the assigned routes
+        "feasible": True if every route got a vehicle
+        "unassigned": routes without a vehicle, because they fit in no vehicle type or the vehicles are finished
+        "used": number of vehicles used of every type
+    """
+    costs = route_type_costs(routes, dist, nodes, fleet, gas_price, cost_model)
+    assigned, unassigned, used = assign_types(costs, fleet.availability)
+
+    cost = float(costs[assigned >= 0, assigned[assigned >= 0]].sum())
+    return {"types": assigned.tolist(), "cost": cost, "feasible": not unassigned, "unassigned": unassigned,
+            "used": used.tolist()}
+
+
+def assignment_report(assignment, fleet):
+    """
+    :return: readable summary of an assignment, listing the feasibility violations
+    """
+    lines = [f"fuel cost {assignment['cost']:.2f}"]
+    for t in range(len(fleet)):
+        lines.append(f"{fleet.names[t]}: {assignment['used'][t]} of {fleet.availability[t]} vehicles")
+    if not assignment["feasible"]:
+        lines.append(f"INFEASIBLE: {len(assignment['unassigned'])} routes without vehicle "
+                     f"{assignment['unassigned']}")
+    return "\n".join(lines)
@@ -1,4 +1,5 @@
-from Utils import calculate_kg_required, calculate_m3_required
+from Savings import SavingsRoutes, compute_savings
+from Split import split
 
 """
 Below three heuristics are presented, being idea_2 the cheapest and idea_3 the most expensive. 
@@ -6,46 +7,59 @@ idea_1 results in a set of routes which would require more vehicle than we have.
 
 ROOM FOR IMPROVEMENT IN THE HEURISTICS:
 
-. All the algorithms are written for two-vehicle fleets and need to be generalized.
-. In idea_2 the routes to split could be selected randomly and not just as the last ones
-. In idea_3 the selections of vehicles for dividing the giga-tour could be randomized 
+. All the algorithms take a Fleet with any number of vehicle types, used from the largest to the smallest one
+. In idea_2 the routes to split can be selected randomly (rng) and not just as the last ones
+. In idea_3 the giga-tour could be randomized, its split is already optimal
 . All the construction heuristics could be made feasible through a relocate operator
 
 """
 
-def naive_solution(vehicles, nodes):
+def naive_solution(fleet, nodes, time_windows=None):
     """
     create routes by assigning customers to an active route as long as the capacity constraint is not violated,
     otherwise the active route is closed and a new route is created with the customer assigned to it.
 
+    :param fleet: Fleet, the vehicles are used from the largest to the smallest type
     :param customer nodes
+    :param time_windows: optional TimeWindows, a route is also closed when the customer would violate them
     :return: list of routes
     """
+    route_types = vehicle_sequence(fleet)
     routes = list()
-    a = 1
-    v = vehicles[a]
+    a = 0
+    v = fleet.models[route_types[a]]
     routes.append([0])
     load = 0
     volume = 0
+    depot = time_windows.node(0) if time_windows is not None else None
+    times = depot  # time summary of the active route
     for n in range(1, len(nodes)):
 
         q = nodes[n]["demand_kg"]
         m3 = nodes[n]["demand_m3"]
-        # if the capacity would be exceeded
-        if volume + m3 > v["vol capacity"] or load + q > v["max load"]:
+        late = False
+        if time_windows is not None:
+            extended = time_windows.concatenate(times, time_windows.node(n))
+            late = len(routes[-1]) > 1 and not time_windows.feasible(time_windows.concatenate(extended, depot))
+
+        # if the capacity would be exceeded or the time windows violated
+        if volume + m3 > v["vol capacity"] or load + q > v["max load"] or late:
             # close active route
             routes[-1].append(0)
             # open new route
             routes.append([0])
             a += 1
-            v = vehicles[a]
+            v = fleet.models[route_types[min(a, len(route_types) - 1)]]
             load = 0
             volume = 0
+            times = depot
 
         # assign customer to route
         routes[-1].append(n)
         load += q
         volume += m3
+        if time_windows is not None:
+            times = time_windows.concatenate(times, time_windows.node(n))
 
     # close active route
     routes[-1].append(0)
@@ -53,7 +67,14 @@ def naive_solution(vehicles, nodes):
     return routes
 
 
-def idea_1(vehicles, nodes, dist, availability):
+def vehicle_sequence(fleet):
+    """
+    :return: vehicle type of every available vehicle, from the largest to the smallest type
+    """
+    return [t for t in fleet.types_by_capacity(descending=True) for _ in range(fleet.availability[t])]
+
+
+def idea_1(fleet, nodes, dist, neighbors=None, rng=None, noise=0.0, time_windows=None, lazy=False):
     """
     Performs the parallel version of the Clark & Wright Savings Heuristic (Clark & Wright, 1964) to construct a
     solution. First, the savings value  is calculated for all pair of customers (s_ij = c_i0 + c_0j - c_ij).
@@ -66,12 +87,19 @@ def idea_1(vehicles, nodes, dist, availability):
 
     step by step explanation is provided in the code
 
+    :param fleet: Fleet, the vehicle types are used from the largest to the smallest one
+    :param neighbors: if given, only the savings of each customer with its neighbors nearest customers are considered
+    :param rng: numpy random Generator, randomizes the order of the savings (see Savings.compute_savings)
+    :param noise: relative perturbation of the savings used with rng
+    :param lazy: if True the savings are streamed from a heap (see Savings.iter_savings) instead of a sorted list
+    :param time_windows: optional TimeWindows, two routes are only merged if the result respects them
     :return: list of routes
     """
-    #  availability of vehicles
-    v = [8, 12]
-    capacity_kg = 2800
-    capacity_vol = 34.80 * 1000
+    #  vehicle types, from the largest, and their availability
+    types = fleet.types_by_capacity(descending=True)
+    v = [fleet.availability[t] for t in types]
+    capacity_kg, capacity_vol = fleet.capacity(types[0])
+    smallest_kg, smallest_vol = fleet.capacity(types[-1])
     capacity_over = 0
     min_demand_kg = min(nodes[i]["demand_m3"] for i in nodes)
     min_demand_m3 = min(nodes[i]["demand_kg"] for i in nodes)
@@ -84,45 +112,44 @@ def idea_1(vehicles, nodes, dist, availability):
     p = 1
     high_demand_kg = (p*min_demand_kg + (1-p)*max_demand_kg)
     high_demand_m3 = (p*min_demand_m3 + (1-p)*max_demand_m3)
-    savings = list()
-    full_routes = []
 
     # CALCULATION OF THE SAVINGS AND SORTING OF BEST PAIRINGS (BY DESCENDING SAVING)
 
-    for i in range(1, len(nodes)):
-        for j in range(1, len(nodes)):
-            if i != j:
-                s_ij = dist[(i, 0)]["tot"] + dist[(0, j)]["tot"] - dist[(i, j)]["tot"]
-                savings.append((i, j, s_ij))
-
-    savings.sort(key=lambda s: -s[2])
+    savings = compute_savings(dist, k=neighbors, rng=rng, noise=noise, lazy=lazy)
 
     # CREATE ONE ROUTE FOR EVERY CUSTOMER
 
-    routes = list()
-    for i in range(1, len(nodes)):
-        routes.append([i])
+    routes = SavingsRoutes(range(1, len(nodes)), nodes, time_windows)
+    full_routes = set()
+
+    # routes which are not full but are bigger than the capacity of the smallest vehicle, with their total demand
+    # (kept up to date at every merge instead of scanning all the routes)
+
+    filled = set()
+    not_assigned_kg = 0
+    not_assigned_m3 = 0
+    for r in routes.ids():
+        if routes.m3[r] > smallest_vol and routes.kg[r] > smallest_kg:
+            filled.add(r)
+            not_assigned_kg += routes.kg[r]
+            not_assigned_m3 += routes.m3[r]
 
     # STARTING FROM THE HIGHEST SAVING YOU WOULD GET BY MERGING i AND j, MERGE THE ROUTE THAT STARTS WITH j WITH THE
     # ONE ENDING WITH i IF THE CAPACITY IS ENOUGH
 
     for (i, j, s_ij) in savings:
-        r_i = -1  # route with i at the end
-        r_j = -1  # route with j in the beginning
-        for r in routes:
-            if r[-1] == i:
-                r_i = r
-            if r[0] == j:
-                r_j = r
+        r_i = routes.route_ending_with(i)  # route with i at the end
+        r_j = routes.route_starting_with(j)  # route with j in the beginning
 
         # METHOD TO UPDATE THE ROUTE CAPACITY
 
         if len(v):
             if capacity_over == v[0]:   # if we exceed capacity #(available vehicles of type we are using) times
                 capacity_over = 0       # reset the count
-                capacity_kg = 883       # update the capacities
-                capacity_vol = 5.80 * 1000
                 v.pop(0)                # remove the availability for vehicle type we just used
+                types.pop(0)
+                if types:               # update the capacities
+                    capacity_kg, capacity_vol = fleet.capacity(types[0])
 
         # check whether there are routes ending with i and starting with j, whether they are not the same route and they
         # are not in the already completed routes (view next steps)
@@ -131,35 +158,38 @@ def idea_1(vehicles, nodes, dist, availability):
 
             # if the capacity is enough
 
-            if calculate_kg_required(r_i, nodes) + calculate_kg_required(r_j, nodes) <= capacity_kg\
-                    and calculate_m3_required(r_i, nodes) + calculate_m3_required(r_j, nodes) <= capacity_vol:
+            if routes.fits(r_i, r_j, capacity_kg, capacity_vol):
+
+                for r in (r_i, r_j):
+                    if r in filled:
+                        filled.remove(r)
+                        not_assigned_kg -= routes.kg[r]
+                        not_assigned_m3 -= routes.m3[r]
 
                 # combine them
-                r_i.extend(r_j)
-                routes.remove(r_j)
-                # print(routes)
+                routes.merge(r_i, r_j)
+
+                if routes.m3[r_i] > smallest_vol and routes.kg[r_i] > smallest_kg:
+                    filled.add(r_i)
+                    not_assigned_kg += routes.kg[r_i]
+                    not_assigned_m3 += routes.m3[r_i]
 
             else:
 
                 # check if the routes that cannot be merged can be considered full
 
-                if r_i not in full_routes and (calculate_kg_required(r_i, nodes) >= capacity_kg - high_demand_kg
-                                               or calculate_m3_required(r_i, nodes) >= capacity_vol - high_demand_m3):
+                for r in (r_i, r_j):
+                    if r not in full_routes and (routes.kg[r] >= capacity_kg - high_demand_kg
+                                                 or routes.m3[r] >= capacity_vol - high_demand_m3):
 
-                    # append the route to the full routes list
+                        # append the route to the full routes list
 
-                    full_routes.append(r_i)
-                    capacity_over += 1
-                    # print("capacity", capacity_over, "i", r_i, "routes", full_routes)
-                    # print(capacity_vol, capacity_kg)
-
-                if r_j not in full_routes and (calculate_kg_required(r_j, nodes) >= capacity_kg - high_demand_kg
-                                               or calculate_m3_required(r_j, nodes) >= capacity_vol - high_demand_m3):
-
-                    full_routes.append(r_j)
-                    capacity_over += 1
-                    # print("capacity", capacity_over, "j", r_j, "routes", full_routes)
-                    # print(capacity_vol, capacity_kg)
+                        full_routes.add(r)
+                        capacity_over += 1
+                        if r in filled:
+                            filled.remove(r)
+                            not_assigned_kg -= routes.kg[r]
+                            not_assigned_m3 -= routes.m3[r]
 
             # if we have more than one vehicle type left
 
@@ -168,23 +198,6 @@ def idea_1(vehicles, nodes, dist, availability):
 
             # check if we are leaving behind unfilled routes which would exceed the capacity if performed with the
             # lowest capacity vehicles (which we use last)
-
-            filled = []
-            not_assigned_kg = 0
-            not_assigned_m3 = 0
-
-            # sum the demand of the routes which are not full but are bigger than the capacity of the smallest vehicle
-
-            for r in routes:
-                if r not in full_routes and calculate_m3_required(r, nodes) > 5.80 * 1000\
-                        and calculate_kg_required(r, nodes) > 883:
-
-                    filled.append(r)
-
-            for r in filled:
-                not_assigned_kg += calculate_kg_required(r, nodes)
-                not_assigned_m3 += calculate_m3_required(r, nodes)
-
             # calculate how many vehicles would be needed to cover those routes if put together
             # idea: cane we merge those unfilled routes we left behind with the remaining vehicles?
 
@@ -192,193 +205,127 @@ def idea_1(vehicles, nodes, dist, availability):
 
             # if total vehicles required is bigger than availability -1 --> switch to next vehicle type
 
-            if capacity_over + not_assigned_routes > 7:  # parameter needs to be updated
+            if capacity_over + not_assigned_routes > v[0] - 1:
 
                 # print("Capacity for vehicle type finished, change type", filled, capacity_over)
-                capacity_over = 8
+                capacity_over = v[0]
 
     # add the depot node at the beginning and end of the final routes
 
-    for route in routes:
-        route.insert(0, 0)
-        route.append(0)
-
-    return routes
+    return [[0] + route + [0] for route in routes.routes()]
 
 
-def idea_2(vehicles, nodes, dist, availability):
+def idea_2(fleet, nodes, dist, neighbors=None, rng=None, noise=0.0, time_windows=None, lazy=False):
     """
     Variation of idea 1.
-    All the routes are calculated with the capacity of the first vehicle. Afterwards, all the routes not assignable to
-    a vehicle are split in single nodes and the procedure is repeated for the next vehicle type.
-
+    All the routes are calculated with the capacity of the first (largest) vehicle type. Afterwards, all the routes
+    not assignable to a vehicle are split in single nodes and the procedure is repeated for the next vehicle type.
+
+    :param fleet: Fleet, the vehicle types are used from the largest to the smallest one
+    :param neighbors: if given, only the savings of each customer with its neighbors nearest customers are considered
+    :param rng: numpy random Generator, randomizes the order of the savings (see Savings.compute_savings) and
+        the selection of the routes to split
+    :param noise: relative perturbation of the savings used with rng
+    :param lazy: if True the savings are streamed from a heap (see Savings.iter_savings) instead of a sorted list
+    :param time_windows: optional TimeWindows, two routes are only merged if the result respects them
     :return: list of routes
     """
-    v = 1
-    savings = list()
-    # s_ij = c_i0 + c_0j - c_ij
-    for i in range(1, len(nodes)):
-        for j in range(1, len(nodes)):
-            if i != j:
-                s_ij = dist[(i, 0)]["tot"] + dist[(0, j)]["tot"] - dist[(i, j)]["tot"]
-                savings.append((i, j, s_ij))
+    types = fleet.types_by_capacity(descending=True)
+    customers = list(range(1, len(nodes)))
+    final_routes = list()
 
-    savings.sort(key=lambda s: -s[2])
+    for phase, t in enumerate(types):
+        capacity_kg, capacity_m3 = fleet.capacity(t)
 
-    routes = list()
-    for i in range(1, len(nodes)):
-        routes.append([i])
+        # s_ij = c_i0 + c_0j - c_ij
+        savings = compute_savings(dist, sorted(customers), k=neighbors, rng=rng, noise=noise, lazy=lazy)
 
-    for (i, j, s_ij) in savings:
-        r_i = -1  # route with i at the end
-        r_j = -1  # route with j in the beginning
-        for r in routes:
-            if r[-1] == i:
-                r_i = r
-            if r[0] == j:
-                r_j = r
-
-        # check whether there are routes ending with i and starting with j, and they are not the same route
-        if r_i != -1 and r_j != -1 and r_i != r_j:
-
-            # check capacity constraint
-
-            if calculate_kg_required(r_i, nodes) + calculate_kg_required(r_j, nodes) <= vehicles[1]["max load"]\
-                    and calculate_m3_required(r_i, nodes) + calculate_m3_required(r_j, nodes) <= vehicles[1]["vol capacity"]:
-
-                r_i.extend(r_j)
-                routes.remove(r_j)
-                # print(routes)
-    # """
-    #  ##################################### CAPACITY CHECKING --- NEW ##########################################
-
-    # print(routes, "starting solution")
-
-    # checking fleet capacity, we can do it just at the end as only now we know how many routes we have
-
-    if len(routes) > availability[0]:  # if more routes than t1 availability
-        over_capacity = routes[-(len(routes)-availability[0]):]  # the undeliverable route is removed
-        routes = routes[:(availability[0]-1)]
-        over_capacity = [item for items in over_capacity for item in items]  # routes are uncombined
-        # print(over_capacity, "not deliverable with t1 vehicles")
-
-        for i in over_capacity:  # recalculating route with t2 capacity
-            routes.append([i])
-        # print(routes, "before recalculating for vehicle t2")
+        routes = SavingsRoutes(customers, nodes, time_windows)
 
         for (i, j, s_ij) in savings:
-            if i not in over_capacity:
-                continue
-            if j not in over_capacity:
-                continue
-            # print(i, j, s_ij)
-
-            r_i = -1  # route with i at the end
-            r_j = -1  # route with j in the beginning
-            for r in routes:
-                if r[-1] == i:
-                    r_i = r
-                if r[0] == j:
-                    r_j = r
+            r_i = routes.route_ending_with(i)  # route with i at the end
+            r_j = routes.route_starting_with(j)  # route with j in the beginning
 
             # check whether there are routes ending with i and starting with j, and they are not the same route
             if r_i != -1 and r_j != -1 and r_i != r_j:
+
                 # check capacity constraint
-                # print(r_i, r_j)
 
-                if calculate_kg_required(r_i, nodes) + calculate_kg_required(r_j, nodes) <= vehicles[9]["max load"] \
-                        and calculate_m3_required(r_i, nodes) + calculate_m3_required(r_j, nodes) <= vehicles[9]["vol capacity"]:   # vehicle number 9 is the first t2
+                if routes.fits(r_i, r_j, capacity_kg, capacity_m3):
 
-                    r_i.extend(r_j)
-                    routes.remove(r_j)
+                    routes.merge(r_i, r_j)
                     # print(routes)
-                else:
-                    kgc = vehicles[9]["max load"]
-                    volc = vehicles[9]["vol capacity"]
 
-                    # print(f" tot weight {calculate_kg_required(r_i, nodes) + calculate_kg_required(r_j, nodes)} "
-                    #      f"capacity {kgc}"f" tot vol "
-                    #      f"{calculate_m3_required(r_i, nodes) + calculate_m3_required(r_j, nodes)} capacity {volc} ")
+        #  ##################################### CAPACITY CHECKING --- NEW ##########################################
 
-    # """
+        routes = routes.routes()
+        # print(routes, "starting solution")
 
-    # add the depot node at the beginning and end of the final routes
-    for route in routes:
-        route.insert(0, 0)
-        route.append(0)
+        # checking fleet capacity, we can do it just at the end as only now we know how many routes we have
 
-    return routes
+        availability = fleet.availability[t]
+        if phase == len(types) - 1 or len(routes) <= availability:
+            final_routes += routes
+            break
 
+        # more routes than the availability of this vehicle type
+        if rng is not None:
+            # the routes to split are selected randomly instead of being the last ones
+            order = rng.permutation(len(routes))
+            routes = [routes[r] for r in sorted(order[:availability])] + \
+                     [routes[r] for r in sorted(order[availability:])]
+        over_capacity = routes[availability:]  # the undeliverable route is removed
+        final_routes += routes[:availability]
 
-def idea_3(vehicles, nodes, dist, availability):
-    """
-    Giga-tour: one single route is created without capacity constraints. The giga-tour is then divided assigning
-    sequentially its customers to a vehicle until the capacity is reached, then to the next and so on.
+        # routes are uncombined and recalculated with the capacity of the next vehicle type
+        customers = [item for items in over_capacity for item in items]
+        # print(customers, "not deliverable with", fleet.names[t], "vehicles")
+
+    # add the depot node at the beginning and end of the final routes
+    return [[0] + route + [0] for route in final_routes]
 
+
+def idea_3(fleet, nodes, dist, neighbors=None, rng=None, noise=0.0, time_windows=None, lazy=False):
+    """
+    Giga-tour: one single route is created without capacity constraints. The giga-tour is then cut into the routes
+    with the minimum fuel consumption for the available vehicles, see Split.split.
+
+    :param fleet: Fleet
+    :param neighbors: if given, only the savings of each customer with its neighbors nearest customers are considered
+    :param rng: numpy random Generator, randomizes the order of the savings (see Savings.compute_savings)
+    :param noise: relative perturbation of the savings used with rng
+    :param lazy: if True the savings are streamed from a heap (see Savings.iter_savings) instead of a sorted list
+    :param time_windows: optional TimeWindows the routes of the split have to respect (the giga-tour ignores them)
     :return: list of routes
     """
-    v = 1
-    savings = list()
     # s_ij = c_i0 + c_0j - c_ij
-    for i in range(1, len(nodes)):
-        for j in range(1, len(nodes)):
-            if i != j:
-                s_ij = dist[(i, 0)]["tot"] + dist[(0, j)]["tot"] - dist[(i, j)]["tot"]
-                savings.append((i, j, s_ij))
+    savings = compute_savings(dist, k=neighbors, rng=rng, noise=noise, lazy=lazy)
 
-    savings.sort(key=lambda s: -s[2])
-
-    routes = list()
-    for i in range(1, len(nodes)):
-        routes.append([i])
+    routes = SavingsRoutes(range(1, len(nodes)), nodes)
 
     for (i, j, s_ij) in savings:
-        r_i = -1  # route with i at the end
-        r_j = -1  # route with j in the beginning
-        for r in routes:
-            if r[-1] == i:
-                r_i = r
-            if r[0] == j:
-                r_j = r
+        r_i = routes.route_ending_with(i)  # route with i at the end
+        r_j = routes.route_starting_with(j)  # route with j in the beginning
 
         # check whether there are routes ending with i and starting with j, and they are not the same route
 
         if r_i != -1 and r_j != -1 and r_i != r_j:
 
-            r_i.extend(r_j)
-            routes.remove(r_j)
-
-    # print(routes)
-
-    # ############################# DIVIDE GIGA-TOUR FOR AVAILABLE VEHICLES #########################################
-
-    routes_divided = [[0]]
-    count = 0
-    # kg_cap = 883
-    # vol_cap = 5.80 * 1000
-    kg_cap = 2800
-    vol_cap = 34.80 * 1000
-
-    for x in routes[0]:
-
-        a = routes_divided[count].copy()
-        a.append(x)
+            routes.merge(r_i, r_j)
 
-        if count == 8:
-            # kg_cap = 2800
-            # vol_cap = 34.80 * 1000
-            kg_cap = 883
-            vol_cap = 5.80 * 1000
+    # with pruned savings some merges may be missing, the remaining routes are chained into the giga-tour
+    giga_tour = [x for route in routes.routes() for x in route]
+    # print(giga_tour)
 
-        if calculate_kg_required(a, nodes) <= kg_cap and calculate_m3_required(a, nodes) <= vol_cap:
-            routes_divided[count].append(x)
+    # ############################# SPLIT GIGA-TOUR FOR AVAILABLE VEHICLES ##########################################
 
-        else:
-            count += 1
-            routes_divided.append([0])
-            routes_divided[count].append(x)
+    # optimal cut points for the available vehicles (see Split). If the tour cannot be served by the fleet, the
+    # availability is ignored and the routes are assigned to vehicles afterwards (see Assignment)
 
-    for route in routes_divided:
-        route.append(0)
+    result = split(giga_tour, dist, nodes, fleet, time_windows=time_windows) or \
+        split(giga_tour, dist, nodes, fleet, limited=False, time_windows=time_windows)
+    if result is None:
+        raise ValueError("a customer exceeds the capacity of every vehicle or cannot be served within its time window")
 
+    routes_divided, route_types, consumption = result
     return routes_divided
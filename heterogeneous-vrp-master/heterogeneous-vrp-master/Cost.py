@@ -0,0 +1,61 @@
+# Operating cost of the arcs for every vehicle type
+import numpy as np
+
+
+"""
+The cost of driving arc (i, j) with a vehicle of type t is a linear combination of the kilometres driven inside and
+outside the congestion zone and of the driving time:
+
+    cost[t][i, j] = per_km_inside[t] * inside[i, j] + per_km_outside[t] * outside[i, j] + per_second[t] * duration[i, j]
+
+The combination is computed once into one n x n matrix per vehicle type, so evaluating a move still takes a single
+array lookup per arc, whatever the terms of the model. With per_km_inside = per_km_outside = consumption * gas_price
+and no time cost (see CostModel.fuel without the optional terms) the model is the fuel cost used so far.
+"""
+
+
+class CostModel:
+    """
+    arc cost matrices of every vehicle type
+    """
+
+    def __init__(self, dist, fleet, per_km_inside, per_km_outside, per_second=0.0):
+        """
+        :param dist: distance between nodes, with the "inside", "outside" and "duration" metrics
+        :param fleet: Fleet
+        :param per_km_inside: cost of a kilometre inside the zone, one value for every vehicle type or a single value
+        :param per_km_outside: cost of a kilometre outside the zone, one value for every vehicle type or a single value
+        :param per_second: cost of a second of driving, one value for every vehicle type or a single value
+        """
+        n_types = len(fleet)
+        self.per_km_inside = np.broadcast_to(np.asarray(per_km_inside, dtype=float), (n_types,)).copy()
+        self.per_km_outside = np.broadcast_to(np.asarray(per_km_outside, dtype=float), (n_types,)).copy()
+        self.per_second = np.broadcast_to(np.asarray(per_second, dtype=float), (n_types,)).copy()
+
+        self.matrices = np.empty((n_types, dist.n, dist.n))
+        for t in range(n_types):
+            self.matrices[t] = self.per_km_inside[t] * dist.inside + self.per_km_outside[t] * dist.outside + \
+                self.per_second[t] * dist.duration
+
+    def __len__(self):
+        return len(self.matrices)
+
+    @classmethod
+    def fuel(cls, dist, fleet, gas_price, inside_consumption=1.0, zone_charge=0.0, cost_per_hour=0.0):
+        """
+        fuel cost, optionally with a different consumption inside the zone, a congestion charge and a time cost.
+        :param dist: distance between nodes
+        :param fleet: Fleet, gives the consumption of every type
+        :param gas_price: price of the fuel
+        :param inside_consumption: factor of the consumption inside the zone (e.g. 1.3 in congested traffic)
+        :param zone_charge: charge for every kilometre driven inside the zone
+        :param cost_per_hour: cost of an hour of driving (e.g. driver wages)
+        """
+        fuel = fleet.consumption * gas_price
+        return cls(dist, fleet, fuel * inside_consumption + zone_charge, fuel, cost_per_hour / 3600)
+
+    def matrix(self, t):
+        """
+        :return: n x n arc cost matrix of vehicle type t
+        """
+        return self.matrices[t]
@@ -0,0 +1,335 @@
+# Cluster-first decomposition: geographic clusters of customers solved as independent subproblems in parallel processes
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import Instancereader
+from Multistart import CONSTRUCTIONS
+from Improvement import vnd, granular_neighbors
+from Fleet import Fleet
+from Assignment import assign_vehicles
+from Distances import DistanceMatrix, METRICS
+from Route import demand_arrays
+from Split import split
+
+
+"""
+The customers are partitioned into clusters by their position (lon, lat) around the depot, either by a sweep of the
+polar angle or by k-means, both balancing the demand of the clusters and capping their number of customers, so the
+work of a cluster is bounded. Every cluster with the depot is a subinstance
+of its own: the customers are renumbered 1..k, the distance matrices are the k+1 x k+1 submatrices, and it is solved
+by the heuristic pipeline (construction followed by the granular VND) or, for small clusters, also by the exact model
+warm-started with the heuristic routes (see VRP.polish). The work of a cluster only depends on its size.
+
+The clusters run in a pool of processes which load the instance from the binary cache (memory-mapped, as in
+Multistart), so a task is only the list of its customers. The fleet is shared: every cluster gets a share of the
+available vehicles of every type, proportional to its demand (see share_fleet), so the routes of the clusters together
+never ask for more vehicles than there are. The routes are then stitched together, improved by a last granular VND on
+the whole instance which moves customers across the borders of the clusters, and assigned to the full fleet. If a
+cluster could not be served by its share, the stitched routes are chained in sweep order into a giga-tour and cut
+again by the split for the whole fleet (see Split), before the last VND.
+"""
+
+
+# ############################################### CLUSTERING ########################################################
+
+def coordinates(nodes):
+    """
+    :return: n x 2 array with the position of every node in km-like units: the longitude is scaled by the cosine of
+        the latitude of the depot, so that distances around the depot are not stretched
+    """
+    lon = np.array([nodes[i]["lon"] for i in range(len(nodes))], dtype=float)
+    lat = np.array([nodes[i]["lat"] for i in range(len(nodes))], dtype=float)
+    return np.column_stack((lon * np.cos(np.radians(lat[0])), lat))
+
+
+def demand_weights(nodes):
+    """
+    :return: share of the total load plus share of the total volume of every node, the measure balanced across the
+        clusters
+    """
+    demand_kg, demand_m3 = demand_arrays(nodes)
+    weights = np.zeros(len(nodes))
+    for demand in (demand_kg, demand_m3):
+        if demand.sum() > 0:
+            weights += demand / demand.sum()
+    return weights
+
+
+def size_limit(n_customers, n_clusters, slack):
+    """
+    :return: maximum number of customers of a cluster, (1 + slack) times the average and never less than the
+        average rounded up, so that the clusters can hold all the customers
+    """
+    return max(np.ceil(n_customers / n_clusters), (1 + slack) * n_customers / n_clusters)
+
+
+def sweep_clusters(nodes, n_clusters, slack=0.1):
+    """
+    sweep: the customers are sorted by polar angle around the depot, starting after the widest empty sector, and
+    the sorted sequence is cut into n_clusters pieces of about the same demand. A piece is also cut when it reaches
+    the size limit (see size_limit), and it is not cut by demand while the next pieces could not hold the remaining
+    customers.
+    :param nodes: info about customers
+    :param n_clusters: number of clusters
+    :param slack: a cluster holds at most (1 + slack) times the average number of customers
+    :return: list of clusters, every cluster a sorted list of customers
+    """
+    position = coordinates(nodes)
+    customers = np.arange(1, len(nodes))
+    relative = position[1:] - position[0]
+    angle = np.arctan2(relative[:, 1], relative[:, 0])
+
+    order = np.argsort(angle, kind="stable")
+    gaps = np.diff(np.concatenate((angle[order], [angle[order[0]] + 2 * np.pi])))
+    order = np.roll(order, -(int(np.argmax(gaps)) + 1))
+
+    weights = demand_weights(nodes)[customers[order]]
+    if weights.sum() == 0:
+        weights = np.ones(len(order))
+    limit_n = size_limit(len(order), n_clusters, slack)
+
+    # cut when the demand of the piece crosses its share of the remaining demand, or at the size limit
+    clusters = [[]]
+    load = 0.0
+    remaining = weights.sum()
+    for left, (u, weight) in enumerate(zip(customers[order].tolist(), weights)):
+        share = remaining / max(1, n_clusters - len(clusters) + 1)
+        room = (n_clusters - len(clusters)) * np.floor(limit_n)
+        by_demand = load + weight / 2 > share and len(order) - left <= room
+        if clusters[-1] and (by_demand or len(clusters[-1]) + 1 > limit_n):
+            clusters.append([])
+            remaining -= load
+            load = 0.0
+        clusters[-1].append(u)
+        load += weight
+    return [sorted(cluster) for cluster in clusters]
+
+
+def kmeans_clusters(nodes, n_clusters, iterations=50, slack=0.1):
+    """
+    k-means with capacity balancing: in every iteration the customers are assigned to the nearest centre which still
+    has room for their demand and for one more customer, the customers with the highest regret (distance to the second
+    nearest centre minus distance to the nearest) first. The centres start from the sweep clusters, so the result is
+    deterministic.
+    :param nodes: info about customers
+    :param n_clusters: number of clusters
+    :param iterations: maximum number of iterations
+    :param slack: a cluster holds at most (1 + slack) times its share of the total demand, and at most (1 + slack)
+        times the average number of customers (see size_limit)
+    :return: list of clusters, every cluster a sorted list of customers
+    """
+    position = coordinates(nodes)[1:]
+    weights = demand_weights(nodes)[1:]
+    limit = (1 + slack) * weights.sum() / n_clusters
+    limit_n = size_limit(len(position), n_clusters, slack)
+
+    labels = np.empty(len(position), dtype=int)
+    for k, cluster in enumerate(sweep_clusters(nodes, n_clusters, slack)):
+        labels[np.array(cluster) - 1] = k
+    n_clusters = int(labels.max()) + 1
+
+    for iteration in range(iterations):
+        centres = np.array([position[labels == k].mean(axis=0) for k in range(n_clusters)])
+        distance = np.linalg.norm(position[:, None, :] - centres[None, :, :], axis=2)
+        nearest = np.sort(distance, axis=1)
+        regret = nearest[:, 1] - nearest[:, 0] if n_clusters > 1 else np.zeros(len(position))
+
+        new_labels = np.empty(len(position), dtype=int)
+        load = np.zeros(n_clusters)
+        size = np.zeros(n_clusters, dtype=int)
+        for a in np.argsort(-regret, kind="stable"):
+            candidates = np.argsort(distance[a], kind="stable")
+            # the nearest centre with room, else the least loaded one which can take one more customer
+            k = next((k for k in candidates if load[k] + weights[a] <= limit and size[k] + 1 <= limit_n),
+                     int(np.argmin(np.where(size + 1 <= limit_n, load, np.inf))))
+            new_labels[a] = k
+            load[k] += weights[a]
+            size[k] += 1
+
+        if np.array_equal(new_labels, labels) or any(not (new_labels == k).any() for k in range(n_clusters)):
+            break
+        labels = new_labels
+
+    return [sorted((np.flatnonzero(labels == k) + 1).tolist()) for k in range(n_clusters)]
+
+
+CLUSTERINGS = {"sweep": sweep_clusters, "kmeans": kmeans_clusters}
+
+
+# ############################################### SUBPROBLEMS #######################################################
+
+def subinstance(nodes, dist, customers):
+    """
+    instance made of the depot and some customers, renumbered 1..len(customers) in the given order.
+    :return: (nodes, dist) of the subinstance
+    """
+    ids = np.concatenate(([0], customers)).astype(int)
+    sub_nodes = {k: dict(nodes[int(i)]) for k, i in enumerate(ids)}
+    sub_dist = DistanceMatrix(*(dist.metric(metric)[np.ix_(ids, ids)] for metric in METRICS))
+    return sub_nodes, sub_dist
+
+
+def share_fleet(fleet, clusters, nodes):
+    """
+    shares the available vehicles of every type among the clusters, proportionally to their demand (largest
+    remainder method), so that the shares add up to the availability of the fleet.
+    :return: list with the availability of every vehicle type in every cluster
+    """
+    weights = demand_weights(nodes)
+    demand = np.array([weights[cluster].sum() for cluster in clusters])
+    share = demand / demand.sum() if demand.sum() > 0 else np.full(len(clusters), 1 / len(clusters))
+
+    availability = np.zeros((len(clusters), len(fleet)), dtype=int)
+    for t in range(len(fleet)):
+        quota = share * fleet.availability[t]
+        availability[:, t] = np.floor(quota)
+        remainder = int(fleet.availability[t] - availability[:, t].sum())
+        availability[np.argsort(-(quota - availability[:, t]), kind="stable")[:remainder], t] += 1
+    return availability.tolist()
+
+
+def resplit(routes, dist, nodes, fleet):
+    """
+    chains the routes, sorted by the polar angle of their centre around the depot, into a giga-tour and splits it for
+    the whole fleet.
+    :return: routes of the split, the given routes if the giga-tour cannot be served by the fleet
+    """
+    position = coordinates(nodes)
+    relative = np.array([position[route[1:-1]].mean(axis=0) for route in routes]) - position[0]
+    order = np.argsort(np.arctan2(relative[:, 1], relative[:, 0]), kind="stable")
+    tour = [c for r in order for c in routes[r] if c != 0]
+
+    result = split(tour, dist, nodes, fleet)
+    return routes if result is None else result[0]
+
+
+# instance and parameters of the worker process, set once by init_worker
+_worker = dict()
+
+
+def init_worker(cache, models, gas_price, construction, neighbors, exact_time_limit):
+    """
+    initializer of the worker processes, the instance is loaded from the binary cache with the distance matrices
+    memory-mapped read-only (see Multistart.init_worker).
+    """
+    data = Instancereader.load_cache(cache)
+    _worker["nodes"] = data["nodes"]
+    _worker["dist"] = data["dist"]
+    _worker["models"] = models
+    _worker["gas_price"] = gas_price
+    _worker["construction"] = construction
+    _worker["neighbors"] = neighbors
+    _worker["exact_time_limit"] = exact_time_limit
+
+
+def solve_cluster(task):
+    """
+    solves one cluster: construction followed by the VND on the subinstance and, if exact, the exact model started
+    from these routes.
+    :param task: (index, customers, availability of every vehicle type in the cluster, exact)
+    :return: dictionary with the routes (numbered as in the whole instance) and the statistics of the cluster
+    """
+    index, customers, availability, exact = task
+    start = time.perf_counter()
+
+    nodes, dist = subinstance(_worker["nodes"], _worker["dist"], customers)
+    fleet = Fleet(_worker["models"], availability)
+    gas_price = _worker["gas_price"]
+
+    routes = CONSTRUCTIONS[_worker["construction"]](fleet, nodes, dist)
+    neighbors = granular_neighbors(dist, _worker["neighbors"]) if _worker["neighbors"] else None
+    routes = vnd(routes, dist, nodes, fleet, neighbors, dont_look_bits=True, gas_price=gas_price)
+
+    if exact:
+        # gurobi is only needed for the clusters solved by the exact model
+        import VRP
+        routes = VRP.polish(nodes, dist, fleet, gas_price, routes, time_limit=_worker["exact_time_limit"],
+                            neighbors=None)["routes"]
+
+    assignment = assign_vehicles(routes, dist, nodes, fleet, gas_price)
+    ids = [0] + list(customers)
+    return {"index": index, "routes": [[ids[i] for i in route] for route in routes], "types": assignment["types"],
+            "cost": assignment["cost"], "feasible": assignment["feasible"], "customers": len(customers),
+            "exact": exact, "time": time.perf_counter() - start}
+
+
+def decompose(instance, models, availability, gas_price, n_clusters=None, cluster_size=50, clustering="kmeans",
+              construction="idea_2", neighbors=20, exact_size=0, exact_time_limit=30.0, final_search=True,
+              workers=None):
+    """
+    solves the instance cluster by cluster in a pool of processes and stitches the routes together.
+    :param instance: workbook of the instance, its binary cache is created if needed and shared by the workers
+    :param models: list of vehicle types
+    :param availability: number of available vehicles of every type, shared by the clusters (see share_fleet)
+    :param gas_price: price of the fuel
+    :param n_clusters: number of clusters, by default enough clusters of at most about cluster_size customers
+    :param cluster_size: number of customers per cluster if n_clusters is not given
+    :param clustering: "sweep" or "kmeans" (keys of CLUSTERINGS)
+    :param construction: construction heuristic of the clusters (key of Multistart.CONSTRUCTIONS)
+    :param neighbors: size of the candidate lists of the granular VND, None for the full neighborhoods
+    :param exact_size: clusters with at most this many customers are also solved by the exact model (needs gurobi),
+        0 to only use the heuristic
+    :param exact_time_limit: time limit of the exact model of a cluster in seconds
+    :param final_search: if True the stitched routes are improved by a granular VND on the whole instance
+    :param workers: number of processes, all the cores by default
+    :return: dictionary with
+        "routes", "types", "cost", "feasible": routes of the whole instance and their assignment to the fleet
+        "clusters": customers of every cluster
+        "cluster results": statistics of every cluster, see solve_cluster
+        "time clusters", "time search": time of the parallel subproblems and of the final VND
+    """
+    data = Instancereader.read_instance(instance)
+    nodes = data["nodes"]
+    dist = data["dist"]
+    fleet = Fleet(models, availability)
+
+    if n_clusters is None:
+        n_clusters = max(1, int(np.ceil((len(nodes) - 1) / cluster_size)))
+    clusters = CLUSTERINGS[clustering](nodes, n_clusters)
+    shares = share_fleet(fleet, clusters, nodes)
+
+    # the largest clusters first, so that the last tasks of the pool are the short ones
+    tasks = [(k, cluster, shares[k], len(cluster) <= exact_size) for k, cluster in enumerate(clusters)]
+    tasks.sort(key=lambda task: -len(task[1]))
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                             initargs=(data["cache"], models, gas_price, construction, neighbors,
+                                       exact_time_limit)) as pool:
+        results = sorted(pool.map(solve_cluster, tasks), key=lambda result: result["index"])
+    time_clusters = time.perf_counter() - start
+
+    routes = [route for result in results for route in result["routes"]]
+
+    start = time.perf_counter()
+    if not all(result["feasible"] for result in results):
+        routes = resplit(routes, dist, nodes, fleet)
+    if final_search:
+        candidates = granular_neighbors(dist, neighbors) if neighbors else None
+        routes = vnd(routes, dist, nodes, fleet, candidates, dont_look_bits=True, gas_price=gas_price)
+    time_search = time.perf_counter() - start
+
+    assignment = assign_vehicles(routes, dist, nodes, fleet, gas_price)
+    return {"routes": routes, "types": assignment["types"], "cost": assignment["cost"],
+            "feasible": assignment["feasible"], "clusters": clusters, "cluster results": results,
+            "time clusters": time_clusters, "time search": time_search}
+
+
+if __name__ == "__main__":
+    gas_price = 0.63
+    t1 = {"model": "t1", "vol capacity": 34.80 * 1000, "max load": 2800, "consumption": 0.175}
+    t2 = {"model": "t2", "vol capacity": 5.80 * 1000, "max load": 883, "consumption": 0.08}
+
+    for clustering in CLUSTERINGS:
+        start = time.perf_counter()
+        result = decompose("NYC.xlsx", [t1, t2], [8, 12], gas_price, clustering=clustering)
+        elapsed = time.perf_counter() - start
+
+        print(f"\n{clustering}: {len(result['clusters'])} clusters")
+        for r in result["cluster results"]:
+            print(f" cluster {r['index']:<3} customers {r['customers']:<4} cost {r['cost']:8.2f} time {r['time']:.3f}s")
+        feasible = "" if result["feasible"] else " infeasible"
+        print(f" cost {result['cost']:.2f}{feasible} routes {len(result['routes'])} clusters "
+              f"{result['time clusters']:.2f}s final search {result['time search']:.2f}s total {elapsed:.2f}s")
@@ -0,0 +1,50 @@
+import numpy as np
+
+# metrics available for every arc (i, j)
+METRICS = ("tot", "inside", "outside", "duration")
+
+
+class DistanceMatrix:
+    """
+    Dense distance matrix of an instance. Every metric ("tot", "inside", "outside" in km and "duration" in seconds)
+    is stored as one contiguous n x n float array, so that dist.tot[i, j] replaces the former dist[(i, j)]["tot"].
+
+    Indexing with an arc, dist[(i, j)], still returns a dictionary with the four values of the arc. This is only
+    meant to keep old code working during the migration and should not be used in hot loops.
+    """
+
+    def __init__(self, tot, inside, outside, duration):
+        self.tot = np.ascontiguousarray(tot, dtype=float)
+        self.inside = np.ascontiguousarray(inside, dtype=float)
+        self.outside = np.ascontiguousarray(outside, dtype=float)
+        self.duration = np.ascontiguousarray(duration, dtype=float)
+        self.n = self.tot.shape[0]
+
+    def __getitem__(self, arc):
+        i, j = arc
+        return {"tot": float(self.tot[i, j]), "inside": float(self.inside[i, j]),
+                "outside": float(self.outside[i, j]), "duration": float(self.duration[i, j])}
+
+    def __len__(self):
+        return self.n
+
+    def metric(self, name):
+        """
+        :param name: one of METRICS
+        :return: the n x n matrix of the metric
+        """
+        if name not in METRICS:
+            raise KeyError(f"unknown metric {name}, expected one of {METRICS}")
+        return getattr(self, name)
+
+    def route_length(self, route, metric="tot"):
+        """
+        sum of the metric over all the arcs of the route, evaluated with a single fancy indexing operation.
+        :param route: sequence of nodes, e.g. [0, 3, 1, 0]
+        :param metric: one of METRICS
+        :return: length of the route
+        """
+        if len(route) < 2:
+            return 0.0
+        route = np.asarray(route)
+        return float(self.metric(metric)[route[:-1], route[1:]].sum())
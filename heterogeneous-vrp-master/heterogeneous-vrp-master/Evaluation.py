@@ -0,0 +1,157 @@
+# Batched evaluation of the routes of many solutions at once
+import numpy as np
+
+from Route import demand_arrays
+
+
+"""
+The routes of any number of solutions are encoded like a sparse matrix in CSR format:
+
+    nodes: the nodes of all the routes, one after the other (every route starts and ends at the depot)
+    offsets: route r is nodes[offsets[r]..offsets[r + 1]-1], offsets has one entry more than there are routes
+    solution: solution of every route
+
+Example: the solutions [[0,1,2,0],[0,3,0]] and [[0,2,1,3,0]] are encoded as
+    nodes = [0,1,2,0, 0,3,0, 0,2,1,3,0], offsets = [0,4,7,12], solution = [0,0,1]
+
+The arcs of all the routes are the pairs of consecutive entries of nodes, without the pairs across two routes. The
+distance of every arc is read with one fancy indexing of the distance matrix, the sums per route (distance, load,
+volume, cost) are bincounts weighted by these values and the sums per solution bincounts of the sums per route. One
+call evaluates the whole batch, Python only loops over the vehicle types.
+"""
+
+
+class RouteBatch:
+    """
+    routes of several solutions in CSR encoding
+    """
+
+    def __init__(self, nodes, offsets, solution=None, n_solutions=None):
+        """
+        :param nodes: nodes of all the routes, one after the other
+        :param offsets: route r is nodes[offsets[r]..offsets[r + 1]-1]
+        :param solution: solution of every route, all the routes belong to solution 0 by default
+        :param n_solutions: number of solutions, solutions without routes included. By default one more than the
+            largest solution of a route
+        """
+        self.nodes = np.asarray(nodes, dtype=int)
+        self.offsets = np.asarray(offsets, dtype=int)
+        self.solution = np.zeros(len(self.offsets) - 1, dtype=int) if solution is None else \
+            np.asarray(solution, dtype=int)
+        if n_solutions is None:
+            n_solutions = int(self.solution.max()) + 1 if len(self.solution) else 1
+        self.n_solutions = n_solutions
+
+        # route of every node, an arc (nodes[k], nodes[k + 1]) belongs to a route if both nodes do
+        self.route = np.repeat(np.arange(len(self)), np.diff(self.offsets))
+        arcs = self.route[:-1] == self.route[1:]
+        self.a = self.nodes[:-1][arcs]
+        self.b = self.nodes[1:][arcs]
+        self.arc_route = self.route[:-1][arcs]
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @classmethod
+    def from_routes(cls, routes):
+        """
+        :param routes: list of routes of one solution
+        """
+        return cls.from_solutions([routes])
+
+    @classmethod
+    def from_solutions(cls, solutions):
+        """
+        :param solutions: list of solutions, every solution a list of routes
+        """
+        routes = [route for routes in solutions for route in routes]
+        lengths = [len(route) for route in routes]
+        nodes = np.fromiter((c for route in routes for c in route), dtype=int, count=sum(lengths))
+        offsets = np.concatenate(([0], np.cumsum(lengths, dtype=int)))
+        solution = np.repeat(np.arange(len(solutions)), [len(routes) for routes in solutions])
+        return cls(nodes, offsets, solution, len(solutions))
+
+    @classmethod
+    def from_padded(cls, padded, solution=None, pad=-1):
+        """
+        :param padded: R x L array with one route per row, the entries after the end of the route are set to pad. An
+            S x R x L array holds R routes of every one of S solutions
+        :param solution: solution of every row of an R x L array
+        :param pad: value of the padding entries
+        """
+        padded = np.asarray(padded, dtype=int)
+        n_solutions = None
+        if padded.ndim == 3:
+            n_solutions = padded.shape[0]
+            solution = np.repeat(np.arange(n_solutions), padded.shape[1])
+            padded = padded.reshape(-1, padded.shape[2])
+        used = padded != pad
+        offsets = np.concatenate(([0], np.cumsum(used.sum(axis=1))))
+        return cls(padded[used], offsets, solution, n_solutions)
+
+    def routes(self):
+        """
+        :return: the routes as lists of nodes
+        """
+        return [self.nodes[self.offsets[r]:self.offsets[r + 1]].tolist() for r in range(len(self))]
+
+
+class Evaluator:
+    """
+    evaluates batches of routes: distance, load, volume, vehicle type and cost of every route and cost of every
+    solution
+    """
+
+    def __init__(self, dist, nodes, fleet, gas_price, cost_model=None):
+        """
+        :param dist: distance between nodes
+        :param nodes: info about customers
+        :param fleet: Fleet
+        :param gas_price: price of the fuel
+        :param cost_model: optional CostModel, replaces the fuel cost
+        """
+        self.d = dist.tot
+        self.demand_kg, self.demand_m3 = demand_arrays(nodes)
+        self.fleet = fleet
+        self.gas_price = gas_price
+        self.cost_model = cost_model
+
+    def evaluate(self, batch):
+        """
+        :param batch: RouteBatch
+        :return: dictionary with
+            "distance", "kg", "m3": distance, load and volume of every route
+            "type": vehicle type of every route, the smallest one it fits in (the largest type if it fits in none,
+                as divide_routes)
+            "fits": True for the routes which fit in a vehicle type
+            "cost": cost of every route, driven by its type
+            "type costs": R x T matrix with the cost of every route driven by every vehicle type
+            "solution distance", "solution cost": sums over the routes of every solution
+        """
+        n_routes = len(batch)
+        distance = np.bincount(batch.arc_route, self.d[batch.a, batch.b], minlength=n_routes)
+        kg = np.bincount(batch.route, self.demand_kg[batch.nodes], minlength=n_routes)
+        m3 = np.bincount(batch.route, self.demand_m3[batch.nodes], minlength=n_routes)
+
+        types = self.fleet.route_types(kg, m3)
+        fits = types != -1
+        types = np.where(fits, types, self.fleet.largest_type())
+
+        if self.cost_model is None:
+            type_costs = distance[:, None] * self.fleet.consumption[None, :] * self.gas_price
+        else:
+            type_costs = np.column_stack([np.bincount(batch.arc_route, matrix[batch.a, batch.b], minlength=n_routes)
+                                          for matrix in self.cost_model.matrices])
+        cost = type_costs[np.arange(n_routes), types]
+
+        return {"distance": distance, "kg": kg, "m3": m3, "type": types, "fits": fits, "cost": cost,
+                "type costs": type_costs,
+                "solution distance": np.bincount(batch.solution, distance, minlength=batch.n_solutions),
+                "solution cost": np.bincount(batch.solution, cost, minlength=batch.n_solutions)}
+
+    def evaluate_solutions(self, solutions):
+        """
+        :param solutions: list of solutions, every solution a list of routes
+        :return: see evaluate
+        """
+        return self.evaluate(RouteBatch.from_solutions(solutions))
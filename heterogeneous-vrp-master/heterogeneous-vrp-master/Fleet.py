@@ -0,0 +1,153 @@
+from bisect import bisect_left
+
+import numpy as np
+
+
+class Fleet:
+    """
+    Heterogeneous fleet. Every vehicle type has a capacity in kg and in m3, a consumption and a number of available
+    vehicles; the attributes are held as arrays indexed by type, in the order the types are given.
+
+    The types are also sorted by capacity, so that the smallest type able to carry a load (kg, m3) is found with a
+    binary search (see smallest_type). This is the lookup every module uses to decide which vehicle a route needs.
+    """
+
+    def __init__(self, models, availability):
+        """
+        :param models: list of vehicle types, e.g. {"model": "t1", "vol capacity": 34800, "max load": 2800,
+            "consumption": 0.175}
+        :param availability: number of available vehicles of every type
+        """
+        if len(models) != len(availability):
+            raise ValueError("one availability is required for every vehicle type")
+
+        self.models = [dict(model) for model in models]
+        self.names = [model["model"] for model in models]
+        self.capacity_kg = np.array([model["max load"] for model in models], dtype=float)
+        self.capacity_m3 = np.array([model["vol capacity"] for model in models], dtype=float)
+        self.consumption = np.array([model["consumption"] for model in models], dtype=float)
+        self.availability = np.array(availability, dtype=int)
+
+        # types sorted by capacity (kg, then m3), smallest first
+        self.by_capacity = np.lexsort((self.capacity_m3, self.capacity_kg))
+        self._order = self.by_capacity.tolist()
+        self._sorted_kg = self.capacity_kg[self.by_capacity].tolist()
+        self._sorted_m3 = self.capacity_m3[self.by_capacity].tolist()
+
+        # if the capacities are nested (a larger kg capacity never comes with a smaller volume) the two dimensions can
+        # be searched independently, otherwise the lookup falls back to a scan of the sorted types
+        self._nested = all(a <= b for a, b in zip(self._sorted_m3, self._sorted_m3[1:]))
+
+    def __len__(self):
+        return len(self.names)
+
+    @classmethod
+    def from_vehicles(cls, vehicles):
+        """
+        builds the fleet from the dictionary with one entry for every vehicle (see Utils.create_vehicles)
+        """
+        models = list()
+        availability = list()
+        for vehicle in vehicles.values():
+            if models and vehicle["model"] == models[-1]["model"]:
+                availability[-1] += 1
+            else:
+                models.append(vehicle)
+                availability.append(1)
+        return cls(models, availability)
+
+    def vehicles(self):
+        """
+        :return: dictionary with one entry for every vehicle (ids start from 1), as used by VRP.solve_VRP
+        """
+        vehicles = dict()
+        id = 1
+        for t in range(len(self)):
+            for j in range(self.availability[t]):
+                vehicles[id] = self.models[t].copy()
+                id += 1
+        return vehicles
+
+    def smallest_type(self, kg, m3):
+        """
+        :return: index of the smallest vehicle type which can carry the load, -1 if no vehicle is large enough
+        """
+        position = bisect_left(self._sorted_kg, kg)
+        if self._nested:
+            m3_position = bisect_left(self._sorted_m3, m3)
+            if m3_position > position:
+                position = m3_position
+        else:
+            while position < len(self._order) and self._sorted_m3[position] < m3:
+                position += 1
+        if position == len(self._order):
+            return -1
+        return self._order[position]
+
+    def route_type(self, kg, m3):
+        """
+        :return: vehicle type a route with the given load is assigned to: the smallest one it fits in, the largest
+            type if it does not fit in any
+        """
+        t = self.smallest_type(kg, m3)
+        return t if t != -1 else self._order[-1]
+
+    def route_types(self, kg, m3):
+        """
+        vectorized smallest_type
+        :param kg: array of loads
+        :param m3: array of volumes
+        :return: array with the smallest vehicle type able to carry every load, -1 where no vehicle is large enough
+        """
+        kg = np.asarray(kg, dtype=float)
+        m3 = np.asarray(m3, dtype=float)
+        types = np.full(kg.shape, -1)
+        for t in self.by_capacity[::-1]:
+            fits = (kg <= self.capacity_kg[t]) & (m3 <= self.capacity_m3[t])
+            types[fits] = t
+        return types
+
+    def fits(self, kg, m3):
+        """
+        vectorized smallest_type(kg, m3) != -1: with nested capacities only the largest type is checked
+        :return: boolean array, True where the load fits in some vehicle type
+        """
+        if not self._nested:
+            return self.route_types(kg, m3) != -1
+        t = self._order[-1]
+        return (np.asarray(kg) <= self.capacity_kg[t]) & (np.asarray(m3) <= self.capacity_m3[t])
+
+    def lower_bounds(self, t):
+        """
+        :return: (kg, m3) such that a load of type t with more kg or more m3 does not fit any smaller type, i.e. the
+            capacity of the next smaller type. (-1, -1) for the smallest type, (inf, inf) if the capacities are not
+            nested and there is no such bound
+        """
+        position = self._order.index(t)
+        if position == 0:
+            return -1.0, -1.0
+        if not self._nested:
+            return np.inf, np.inf
+        return self._sorted_kg[position - 1], self._sorted_m3[position - 1]
+
+    def largest_type(self):
+        return self._order[-1]
+
+    def capacity(self, t):
+        """
+        :return: (capacity kg, capacity m3) of vehicle type t
+        """
+        return self.capacity_kg[t], self.capacity_m3[t]
+
+    def route_capacity(self, kg, m3):
+        """
+        :return: (capacity kg, capacity m3) of the vehicle a route with the given load is assigned to
+        """
+        return self.capacity(self.route_type(kg, m3))
+
+    def types_by_capacity(self, descending=False):
+        """
+        :return: list of the vehicle types sorted by capacity
+        """
+        order = self.by_capacity.tolist()
+        return order[::-1] if descending else order
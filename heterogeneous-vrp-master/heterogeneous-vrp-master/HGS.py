@@ -0,0 +1,282 @@
+# Hybrid genetic search (Vidal et al., 2012) on giga-tour chromosomes
+import time
+
+import numpy as np
+
+from Split import split
+from Improvement import vnd, granular_neighbors
+from Assignment import assign_vehicles
+
+
+"""
+Every individual is a giga-tour (all the customers, no depot), decoded into routes by the optimal split for the
+fleet and improved by the VND (the education). The routes of the educated solution, chained again, give back the
+chromosome, so good route segments are inherited by the offspring.
+
+Offspring are created by order crossover (OX) of two parents chosen by binary tournament on the biased fitness, which
+ranks the individuals both by cost and by their contribution to the diversity of the population (average broken pairs
+distance to the closest individuals). When the population exceeds mu + lambda individuals, clones first and then the
+individuals with the worst biased fitness are removed until mu are left. The random giga-tours of the initial
+population (and of the restarts) are educated by the full VND, so they only take a share of the budget: the population
+then grows by the offspring.
+
+The cost of an individual is the fuel cost of the routes assigned to the fleet at minimum cost (see Assignment), plus
+a penalty for every route which cannot be assigned because the vehicles are finished. With a cost model its arc costs
+replace the fuel cost in the split, in the education and in the assignment.
+"""
+
+
+class Individual:
+    """
+    giga-tour, routes of the educated solution and their evaluation
+    """
+
+    def __init__(self, tour, routes, assignment, penalty, n_nodes):
+        self.tour = tour
+        self.routes = routes
+        self.types = assignment["types"]
+        self.feasible = assignment["feasible"]
+        self.cost = assignment["cost"] + penalty * len(assignment["unassigned"])
+        self.fitness = 0.0
+
+        # successor and predecessor of every customer in the routes (0 is the depot), for the broken pairs distance
+        self.succ = np.zeros(n_nodes, dtype=int)
+        self.pred = np.zeros(n_nodes, dtype=int)
+        for route in routes:
+            r = np.asarray(route)
+            self.succ[r[1:-1]] = r[2:]
+            self.pred[r[1:-1]] = r[:-2]
+
+
+def broken_pairs_distance(a, b):
+    """
+    :return: fraction of the customers whose neighbours in a are not neighbours in b
+    """
+    broken = (a.succ[1:] != b.succ[1:]) & (a.succ[1:] != b.pred[1:])
+    return broken.sum() / len(broken)
+
+
+def order_crossover(tour_1, tour_2, rng):
+    """
+    OX: the child copies a random slice of tour_1 and the other customers in the order of tour_2, starting after the
+    slice
+    """
+    n = len(tour_1)
+    i, j = np.sort(rng.choice(n, 2, replace=False))
+    child = np.empty(n, dtype=int)
+    child[i:j + 1] = tour_1[i:j + 1]
+
+    copied = np.zeros(max(tour_1) + 1, dtype=bool)
+    copied[tour_1[i:j + 1]] = True
+    order = np.roll(tour_2, -(j + 1))
+    rest = order[~copied[order]]
+    child[(j + 1 + np.arange(len(rest))) % n] = rest
+    return child
+
+
+class HGS:
+    """
+    population, parameters and statistics of a run
+    """
+
+    def __init__(self, nodes, dist, fleet, gas_price, mu=25, lambda_=40, n_elite=4, n_closest=5, neighbors=20,
+                 penalty=50.0, seed=0, time_windows=None, cost_model=None, init_share=0.2):
+        """
+        :param nodes: info about customers
+        :param dist: distance between nodes
+        :param fleet: Fleet
+        :param gas_price: price of the fuel
+        :param mu: minimum size of the population
+        :param lambda_: number of offspring before the survivors selection
+        :param n_elite: number of individuals whose rank by cost is kept in the biased fitness regardless of diversity
+        :param n_closest: number of closest individuals in the diversity contribution
+        :param neighbors: size of the candidate lists of the granular VND used as education
+        :param penalty: cost of every route which cannot be assigned to a vehicle
+        :param seed: seed of the random generator
+        :param time_windows: optional TimeWindows, respected by the split and by the education
+        :param cost_model: optional CostModel, replaces the fuel cost in the split, in the education and in the
+            assignment of the individuals to the vehicles
+        :param init_share: share of the wall-clock budget the random individuals of an initialization can take, once
+            the population has two individuals
+        """
+        self.nodes = nodes
+        self.dist = dist
+        self.fleet = fleet
+        self.gas_price = gas_price
+        self.cost_model = cost_model
+        self.mu = mu
+        self.lambda_ = lambda_
+        self.n_elite = n_elite
+        self.n_closest = n_closest
+        self.neighbors = granular_neighbors(dist, neighbors)
+        self.penalty = penalty
+        self.rng = np.random.default_rng(seed)
+        self.time_windows = time_windows
+        self.init_share = init_share
+
+        self.population = list()
+        self.distances = dict()  # individual -> {individual: broken pairs distance}
+        self.best = None
+        self.deadline = None  # end of the wall-clock budget of run, None for no limit
+        self.time_limit = None  # wall-clock budget of run in seconds, None for no limit
+        self.history = list()  # (seconds, iteration, best cost) at every improvement of the best individual
+
+    def individual(self, tour):
+        """
+        decodes a giga-tour, educates the solution and evaluates it
+        """
+        result = split(tour, self.dist, self.nodes, self.fleet, time_windows=self.time_windows,
+                       cost_model=self.cost_model) or \
+            split(tour, self.dist, self.nodes, self.fleet, limited=False, time_windows=self.time_windows,
+                  cost_model=self.cost_model)
+        if result is None:
+            raise ValueError("a customer exceeds the capacity of every vehicle or cannot be served within its time window")
+        routes = vnd(result[0], self.dist, self.nodes, self.fleet, self.neighbors, dont_look_bits=True,
+                     time_windows=self.time_windows, gas_price=self.gas_price, cost_model=self.cost_model)
+        tour = np.array([c for route in routes for c in route if c != 0])
+        assignment = assign_vehicles(routes, self.dist, self.nodes, self.fleet, self.gas_price, self.cost_model)
+        return Individual(tour, routes, assignment, self.penalty, len(self.nodes))
+
+    def insert(self, individual):
+        self.distances[individual] = dict()
+        for other in self.population:
+            d = broken_pairs_distance(individual, other)
+            self.distances[individual][other] = d
+            self.distances[other][individual] = d
+        self.population.append(individual)
+
+        if len(self.population) >= self.mu + self.lambda_:
+            self.select_survivors()
+
+    def remove(self, individual):
+        self.population.remove(individual)
+        for other in self.distances.pop(individual):
+            del self.distances[other][individual]
+
+    def update_fitness(self):
+        """
+        biased fitness: rank by cost + (1 - n_elite / size) * rank by diversity contribution, both scaled to [0, 1]
+        """
+        size = len(self.population)
+        if size == 1:
+            self.population[0].fitness = 0.0
+            return
+
+        cost = np.array([individual.cost for individual in self.population])
+        diversity = np.array([np.mean(sorted(self.distances[individual].values())[:self.n_closest])
+                              for individual in self.population])
+
+        rank_cost = np.empty(size)
+        rank_cost[np.argsort(cost, kind="stable")] = np.arange(size) / (size - 1)
+        rank_diversity = np.empty(size)
+        rank_diversity[np.argsort(-diversity, kind="stable")] = np.arange(size) / (size - 1)
+
+        fitness = rank_cost + (1 - self.n_elite / size) * rank_diversity
+        for individual, f in zip(self.population, fitness):
+            individual.fitness = f
+
+    def select_survivors(self):
+        while len(self.population) > self.mu:
+            clones = [individual for individual in self.population
+                      if any(d == 0 for d in self.distances[individual].values())]
+            if clones:
+                worst = max(clones, key=lambda individual: individual.cost)
+            else:
+                self.update_fitness()
+                worst = max(self.population, key=lambda individual: individual.fitness)
+            self.remove(worst)
+
+    def select_parent(self):
+        """
+        binary tournament on the biased fitness, the only individual of a population of one
+        """
+        if len(self.population) == 1:
+            return self.population[0]
+        a, b = self.rng.choice(len(self.population), 2, replace=False)
+        a, b = self.population[a], self.population[b]
+        return a if a.fitness <= b.fitness else b
+
+    def expired(self):
+        """
+        :return: True if the wall-clock budget is spent
+        """
+        return self.deadline is not None and time.perf_counter() >= self.deadline
+
+    def initialize(self, tours=()):
+        """
+        fills the population with the given giga-tours and random ones, up to mu individuals. Once the budget is spent
+        no more individuals are added (the population keeps at least one), and the random ones stop once init_share of
+        the budget is spent and the population has two individuals, the parents of the first offspring
+        """
+        customers = np.arange(1, len(self.nodes))
+        seeding_deadline = None if self.time_limit is None else \
+            time.perf_counter() + self.init_share * self.time_limit
+        for tour in tours:
+            if self.population and self.expired():
+                return
+            self.consider(self.individual(np.asarray(tour)), 0)
+        while len(self.population) < self.mu and not (self.population and self.expired()):
+            if len(self.population) >= 2 and seeding_deadline is not None and time.perf_counter() >= seeding_deadline:
+                return
+            self.consider(self.individual(self.rng.permutation(customers)), 0)
+
+    def consider(self, individual, iteration):
+        """
+        inserts the individual and updates the best solution
+        :return: True if the individual is the new best solution
+        """
+        self.insert(individual)
+        improved = self.best is None or individual.cost < self.best.cost - 0.000001
+        if improved:
+            self.best = individual
+            self.history.append((time.perf_counter() - self.start, iteration, individual.cost))
+        return improved
+
+    def run(self, time_limit=10.0, max_iterations=None, restart_after=2000, tours=()):
+        """
+        :param time_limit: wall-clock budget in seconds, None for no limit
+        :param max_iterations: number of offspring, None for no limit
+        :param restart_after: iterations without improvement after which the population is replaced by a new one
+            (the best solution is kept)
+        :param tours: giga-tours of the initial population, e.g. the routes of the construction heuristics chained
+        :return: dictionary with the best routes, their vehicle types, cost and feasibility, and the history of the
+            best cost (seconds, iteration, cost)
+        """
+        self.start = time.perf_counter()
+        self.time_limit = time_limit
+        self.deadline = None if time_limit is None else self.start + time_limit
+        self.initialize(tours)
+        self.update_fitness()
+
+        iteration = 0
+        no_improvement = 0
+        while (max_iterations is None or iteration < max_iterations) and not self.expired():
+            iteration += 1
+            child = order_crossover(self.select_parent().tour, self.select_parent().tour, self.rng)
+            if self.consider(self.individual(child), iteration):
+                no_improvement = 0
+            else:
+                no_improvement += 1
+
+            if no_improvement == restart_after and not self.expired():
+                for individual in list(self.population):
+                    self.remove(individual)
+                self.initialize()
+                no_improvement = 0
+
+            self.update_fitness()
+
+        return {"routes": self.best.routes, "types": self.best.types, "cost": self.best.cost,
+                "feasible": self.best.feasible, "history": self.history, "iterations": iteration,
+                "time": time.perf_counter() - self.start}
+
+
+def hgs(nodes, dist, fleet, gas_price, time_limit=10.0, max_iterations=None, initial_routes=(), seed=0, **parameters):
+    """
+    runs the hybrid genetic search.
+    :param initial_routes: solutions (lists of routes) added to the initial population, e.g. from Construction
+    :param parameters: population parameters, see HGS
+    :return: see HGS.run
+    """
+    tours = [[c for route in routes for c in route if c != 0] for routes in initial_routes]
+    return HGS(nodes, dist, fleet, gas_price, seed=seed, **parameters).run(time_limit, max_iterations, tours=tours)
@@ -1,26 +1,41 @@
 # Procedures to improve complete solutions
-from Utils import *
+from concurrent.futures import ThreadPoolExecutor
 
+import numpy as np
 
-def hillclimbing(solution, dist, nodes):
+from Solution import Solution
+from Insertion import InsertionCache
+
+
+def hillclimbing(solution, dist, nodes, fleet, dont_look_bits=False, time_windows=None, arc_cost=None,
+                 gas_price=None, cost_model=None):
     """
     simple improvement procedure which tries to find a (local) optima by continuously calling
     find_first_improvement_2Opt(solution, instance) until no further improvements are found.
     :param solution: list of routes to improve
     :param dist: distance between nodes
     :param nodes: info about customers
+    :param fleet: Fleet the routes are assigned to
+    :param dont_look_bits: if True only routes changed since their last unsuccessful scan are searched again
+    :param time_windows: optional TimeWindows, only moves which respect them are applied
+    :param arc_cost: optional n x n matrix minimized instead of the distance, the same for all the vehicle types
+    :param gas_price: if given, the fuel cost is minimized, see vnd
+    :param cost_model: optional CostModel minimized instead of the fuel cost, see vnd
     :return: the provided solution or an improved solution
     """
+    solution = Solution(solution, dist, nodes, fleet, dont_look_bits, time_windows, arc_cost, gas_price, cost_model)
+
     improved = True
     while improved:
         improved, solution = find_first_improvement_2Opt(solution, dist)
         # improved, solution = find_first_improvement_relocate(solution, dist, nodes)
         # improved, solution = find_first_improvement_exchange(solution, dist, nodes)
 
-    return solution
+    return solution.routes
 
 
-def vnd(solution, dist, nodes):
+def vnd(solution, dist, nodes, fleet, neighbors=None, dont_look_bits=False, workers=None, segments=False,
+        time_windows=None, arc_cost=None, gas_price=None, cost_model=None):
     """
     Variable Neighborhood Decent procedure, searching three neighborhoods (2opt, relocate, exchange) in a structured
     way. Neighborhoods are ordered, if an improvement was found, the search continues from the first neighborhood.
@@ -28,73 +43,170 @@ def vnd(solution, dist, nodes):
     :param solution: list of routes to improve
     :param dist: distance between nodes
     :param nodes: info about customers
+    :param fleet: Fleet, gives the capacity of the vehicle every route is assigned to
+    :param neighbors: candidate lists (see granular_neighbors). If given, relocate and exchange are replaced by their
+        granular versions and the 2-opt* neighborhood is searched as well
+    :param dont_look_bits: if True every neighborhood only scans the customers touched by a move since they were
+        last scanned without improvement (see Solution), instead of restarting from the first route
+    :param workers: if given (and neighbors is None), relocate and exchange are evaluated completely by this many
+        threads and the best move is applied, see find_best_improvement_parallel
+    :param segments: if True the Or-opt, 2-opt* and CROSS-exchange neighborhoods are searched after the others, see
+        SEGMENT NEIGHBORHOODS
+    :param time_windows: optional TimeWindows (time windows and route duration limit), only moves which respect them
+        are applied. Not supported with workers
+    :param arc_cost: optional n x n matrix minimized instead of the distance, the same for all the vehicle types. The
+        candidate lists stay the nearest customers by distance. Raises ValueError together with gas_price or
+        cost_model
+    :param gas_price: if given, the fuel cost is minimized instead of the distance: every route is charged with the
+        consumption of the smallest vehicle type it fits in, including the moves which change that type (see
+        Solution.cost_change)
+    :param cost_model: optional CostModel, its cost is minimized instead of the fuel cost: the arcs of every route are
+        priced by the matrix of the smallest vehicle type it fits in (CostModel.matrix(t)), including the moves which
+        change that type
     :return: the provided solution or an improved solution
     """
+    if time_windows is not None and neighbors is None and workers:
+        raise ValueError("time windows are not supported by the parallel neighborhood evaluation")
+
+    # load, volume and distance of the routes are kept up to date by the moves instead of being recomputed
+    solution = Solution(solution, dist, nodes, fleet, dont_look_bits, time_windows, arc_cost, gas_price, cost_model)
+
+    pool = None
+    if neighbors is None and workers:
+        pool = ThreadPoolExecutor(max_workers=workers)
+        neighborhoods = [lambda s: find_best_improvement_parallel(s, dist, nodes, "relocate", pool, workers),
+                         lambda s: find_best_improvement_parallel(s, dist, nodes, "exchange", pool, workers)]
+    elif neighbors is None:
+        # the best insertions of the relocate neighborhood are only recomputed for the routes changed by a move
+        cache = InsertionCache(solution, dist, nodes)
+        neighborhoods = [lambda s: find_first_improvement_relocate(s, dist, nodes, cache),
+                         lambda s: find_first_improvement_exchange(s, dist, nodes)]
+    else:
+        neighborhoods = [lambda s: find_first_improvement_granular_relocate(s, dist, nodes, neighbors),
+                         lambda s: find_first_improvement_granular_exchange(s, dist, nodes, neighbors),
+                         lambda s: find_first_improvement_granular_2OptStar(s, dist, nodes, neighbors)]
+
+    if segments:
+        neighborhoods += [lambda s: find_first_improvement_or_opt(s, dist, nodes),
+                          lambda s: find_first_improvement_2OptStar(s, dist, nodes),
+                          lambda s: find_first_improvement_cross(s, dist, nodes)]
+
     improved = True
     while improved:
         improved, solution = find_first_improvement_2Opt(solution, dist)
-        if not improved:
-            improved, solution = find_first_improvement_relocate(solution, dist, nodes)
-            if not improved:
-                improved, solution = find_first_improvement_exchange(solution, dist, nodes)
+        for neighborhood in neighborhoods:
+            if improved:
+                break
+            improved, solution = neighborhood(solution)
 
-    return solution
+    if pool is not None:
+        pool.shutdown()
 
+    # granular and segment moves can empty a route
+    return [route for route in solution.routes if len(route) > 2]
 
-def find_first_improvement_relocate(solution, dist, nodes):
+
+def find_first_improvement_relocate(solution, dist, nodes, cache=None):
     """
     search for the first improving relocate
     Example: [[0,1,2,0],[0,3,4,5,0]] => [[0,1,3,2,0],[0,4,5,0]]
         A relocate move could be to move customer 3 between 1 and 2.
-    :param solution: list of routes to improve
+
+    The change in distance is evaluated from the removed and added arcs only, for all the insertion positions of a
+    route at once, and the capacity check uses the load and volume cached in the solution. The capacity of a route
+    is the one of the vehicle type it is assigned to (see Solution.capacity). Every route is evaluated with the arc
+    lengths of the type it has after the move (see Solution.arc_type).
+
+    With an insertion cache the best insertion of the customer in every other route is read from the cache, which
+    only recomputes the routes changed by the last moves, and the customer is moved to the first route where its best
+    insertion improves the solution. With time windows, a route whose best insertion violates them is searched for
+    another improving position.
+
+    :param solution: Solution to improve
     :param dist: distance between nodes
     :param nodes: info about customers
+    :param cache: optional InsertionCache of the solution
     :return: (True, S') if an improvement was found alongside the improved solution S'.
         Otherwise (False, S), with the original solution S.
     """
 
     # TODO: apply improvements from the exchange neighborhood here as well
 
+    matrices = solution.matrices
+    if cache is not None:
+        cache.refresh()
+
     for r1_id, route1 in enumerate(solution):
-        current_distance_r1 = compute_distance(route1, dist)
         for i in range(1, len(route1) - 2):
+            u = route1[i]
+            if not solution.is_active("relocate", u):
+                continue
 
-            for r2_id, route2 in enumerate(solution):
+            # r1: remove: (i-1,i),(i,i+1), add: (i-1,i+1)
+            kg_1 = solution.kg[r1_id] - nodes[u]["demand_kg"]
+            m3_1 = solution.m3[r1_id] - nodes[u]["demand_m3"]
+            d = matrices[solution.arc_type(kg_1, m3_1)]
+            change_in_r1 = d[route1[i - 1], route1[i + 1]] - d[route1[i - 1], u] - d[u, route1[i + 1]]
+            cost_in_r1 = solution.cost_change(r1_id, change_in_r1, kg_1, m3_1)
 
-                # checking the capacity for the route - to make scalable
+            if cache is not None:
+                change_in_r2, position = cache.best(u)
+                cost_in_r2 = solution.cost_change(np.arange(len(solution)), change_in_r2,
+                                                  np.asarray(solution.kg) + nodes[u]["demand_kg"],
+                                                  np.asarray(solution.m3) + nodes[u]["demand_m3"])
+                for r2_id in np.flatnonzero(cost_in_r1 + cost_in_r2 < -0.000001).tolist():
+                    if solution.relocate_time_feasible(r1_id, i, r2_id, int(position[r2_id])):
+                        solution.relocate(r1_id, i, r2_id, int(position[r2_id]), change_in_r1, change_in_r2[r2_id])
+                        return True, solution
 
-                if calculate_m3_required(route2, nodes) > 5.80 * 1000 or calculate_kg_required(route2, nodes) > 883:
-                    capacity_kg = 2800
-                    capacity_m3 = 34.80 * 1000
-                else:
-                    capacity_kg = 883
-                    capacity_m3 = 5.80 * 1000
+                    # the best insertion in r2 violates the time windows, the other positions may not
+                    r2 = np.asarray(solution[r2_id])
+                    kg_2 = solution.kg[r2_id] + nodes[u]["demand_kg"]
+                    m3_2 = solution.m3[r2_id] + nodes[u]["demand_m3"]
+                    d = matrices[solution.arc_type(kg_2, m3_2)]
+                    change_at = d[r2[:-1], u] + d[u, r2[1:]] - d[r2[:-1], r2[1:]]
+                    cost_at = solution.cost_change(r2_id, change_at, kg_2, m3_2)
+                    j = improving_move(cost_in_r1 + cost_at,
+                                       lambda j: solution.relocate_time_feasible(r1_id, i, r2_id, j + 1))
+                    if j is not None:
+                        solution.relocate(r1_id, i, r2_id, j + 1, change_in_r1, change_at[j])
+                        return True, solution
+
+                solution.deactivate("relocate", u)
+                continue
+
+            for r2_id, route2 in enumerate(solution):
 
                 if r1_id == r2_id:
                     # no intra route optimization
                     # TODO: implement case for intra route optimization
                     continue
 
-                current_distance_r2 = compute_distance(route2, dist)
-
-                for j in range(1, len(route2) - 1):
-                    # check capacity constraint for r2
-                    if calculate_m3_required(route2, nodes) + nodes[route1[i]]["demand_m3"] > capacity_m3 and \
-                            calculate_kg_required(route2, nodes) + nodes[route1[i]]["demand_kg"] > capacity_kg:
+                # check capacity constraint for r2, it does not depend on the insertion position
+                capacity_kg, capacity_m3 = solution.capacity(r2_id)
+                if solution.m3[r2_id] + nodes[u]["demand_m3"] > capacity_m3 or \
+                        solution.kg[r2_id] + nodes[u]["demand_kg"] > capacity_kg:
 
-                        # this move lead to an infeasible solution, just continue
-                        continue
+                    # this move lead to an infeasible solution, just continue
+                    continue
 
-                    new_r1 = route1[:i] + route1[i + 1:]
-                    new_r2 = route2[:j] + [route1[i]] + route2[j:]
+                # r2: remove: (j-1,j), add: (j-1,i),(i,j) for every position j in 1..len(route2)-2
+                r2 = np.asarray(route2)
+                before = r2[:-2]
+                after = r2[1:-1]
+                kg_2 = solution.kg[r2_id] + nodes[u]["demand_kg"]
+                m3_2 = solution.m3[r2_id] + nodes[u]["demand_m3"]
+                d = matrices[solution.arc_type(kg_2, m3_2)]
+                change_in_r2 = d[before, u] + d[u, after] - d[before, after]
+                cost_in_r2 = solution.cost_change(r2_id, change_in_r2, kg_2, m3_2)
 
-                    change_in_r1 = compute_distance(new_r1, dist) - current_distance_r1
-                    change_in_r2 = compute_distance(new_r2, dist) - current_distance_r2
+                j = improving_move(cost_in_r1 + cost_in_r2,
+                                   lambda j: solution.relocate_time_feasible(r1_id, i, r2_id, j + 1))
+                if j is not None:
+                    solution.relocate(r1_id, i, r2_id, j + 1, change_in_r1, change_in_r2[j])
+                    return True, solution
 
-                    if change_in_r1 + change_in_r2 < -0.000001:
-                        solution[r1_id] = new_r1
-                        solution[r2_id] = new_r2
-                        return True, solution
+            solution.deactivate("relocate", u)
 
     return False, solution
 
@@ -104,41 +216,33 @@ def find_first_improvement_exchange(solution, dist, nodes):
     search for the first improving exchange
     Example: [[0,1,2,0],[0,3,4,5,0]] => [[0,4,2,0],[0,3,1,5,0]]
         A exchange move could be to swap customer 4 between 1.
-    :param solution: list of routes to improve
+    :param solution: Solution to improve
     :param dist: distance between nodes
     :param nodes: info about customers
     :return: (True, S') if an improvement was found alongside the improved solution S'.
         Otherwise (False, S), with the original solution S.
     """
 
-    current_demand_kg = [0] * len(solution)
-    current_demand_m3 = [0] * len(solution)
-    for r_id, route in enumerate(solution):
-
-        current_demand_kg[r_id] = calculate_kg_required(route, nodes)
-        current_demand_m3[r_id] = calculate_m3_required(route, nodes)
+    # load and volume of the routes are cached in the solution
+    typed = solution.typed  # the changes in distance are turned into changes in cost
+    modelled = solution.cost_model is not None  # every route is evaluated with the arcs of its new type
+    d_1 = d_2 = solution.d
+    current_demand_kg = solution.kg
+    current_demand_m3 = solution.m3
 
     for r1_id, route1 in enumerate(solution):
 
-        if current_demand_m3[r1_id] > 5.80 * 1000 or current_demand_kg[r1_id] > 883:
-            capacity_kg_1 = 2800
-            capacity_m3_1 = 34.80 * 1000
-        else:
-            capacity_kg_1 = 883
-            capacity_m3_1 = 5.80 * 1000
+        capacity_kg_1, capacity_m3_1 = solution.capacity(r1_id)
 
         for i in range(1, len(route1) - 2):
+            if not solution.is_active("exchange", route1[i]):
+                continue
 
             # TODO: remove symmetry in the neighborhood - each pair exchange is tested twice!
 
             for r2_id, route2 in enumerate(solution):
 
-                if current_demand_m3[r2_id] > 5.80 * 1000 or current_demand_kg[r2_id] > 883:
-                    capacity_kg_2 = 2800
-                    capacity_m3_2 = 34.80 * 1000
-                else:
-                    capacity_kg_2 = 883
-                    capacity_m3_2 = 5.80 * 1000
+                capacity_kg_2, capacity_m3_2 = solution.capacity(r2_id)
 
                 if r1_id == r2_id:
                     # no intra route optimization for now
@@ -146,75 +250,871 @@ def find_first_improvement_exchange(solution, dist, nodes):
                     continue
 
                 for j in range(1, len(route2) - 2):
-                    # check capacity constraint for r2
-                    if current_demand_kg[r1_id] - nodes[route1[i]]["demand_kg"] + nodes[route2[j]]["demand_kg"] > capacity_kg_1 or \
-                            current_demand_m3[r1_id] - nodes[route1[i]]["demand_m3"] + nodes[route2[j]]["demand_m3"] > capacity_m3_1:
+                    # check capacity constraint for r1
+                    kg_1 = current_demand_kg[r1_id] - nodes[route1[i]]["demand_kg"] + nodes[route2[j]]["demand_kg"]
+                    m3_1 = current_demand_m3[r1_id] - nodes[route1[i]]["demand_m3"] + nodes[route2[j]]["demand_m3"]
+                    if kg_1 > capacity_kg_1 or m3_1 > capacity_m3_1:
 
                         # this move lead to an infeasible solution, just continue
                         continue
 
                     # check capacity constraint for r2
-                    if current_demand_kg[r2_id] - nodes[route2[j]]["demand_kg"] + nodes[route1[i]]["demand_kg"] > capacity_kg_2 or \
-                            current_demand_m3[r2_id] - nodes[route2[j]]["demand_m3"] + nodes[route1[i]]["demand_m3"] > capacity_m3_2:
+                    kg_2 = current_demand_kg[r2_id] - nodes[route2[j]]["demand_kg"] + nodes[route1[i]]["demand_kg"]
+                    m3_2 = current_demand_m3[r2_id] - nodes[route2[j]]["demand_m3"] + nodes[route1[i]]["demand_m3"]
+                    if kg_2 > capacity_kg_2 or m3_2 > capacity_m3_2:
                         # this move lead to an infeasible solution, just continue
                         continue
 
+                    if modelled:
+                        d_1 = solution.matrices[solution.arc_type(kg_1, m3_1)]
+                        d_2 = solution.matrices[solution.arc_type(kg_2, m3_2)]
+
                     # Example:
                     # i=1 v       j=3 v
                     # [[0,1,2,0],[0,3,4,5,0]] => [[0,4,2,0],[0,3,1,5,0]]
                     # r1: remove: (0,1),(1,2), add: (0,4),(4,2)
-                    change_in_r1 = - dist[(route1[i - 1], route1[i])]["tot"] \
-                                   - dist[(route1[i], route1[i + 1])]["tot"] \
-                                   + dist[(route1[i - 1], route2[j])]["tot"] \
-                                   + dist[(route2[j], route1[i + 1])]["tot"]
+                    change_in_r1 = - d_1[route1[i - 1], route1[i]] \
+                                   - d_1[route1[i], route1[i + 1]] \
+                                   + d_1[route1[i - 1], route2[j]] \
+                                   + d_1[route2[j], route1[i + 1]]
                     # r2: remove: (3,4),(4,5), add: (3,1),(1,5)
-                    change_in_r2 = - dist[(route2[j - 1], route2[j])]["tot"] \
-                                   - dist[(route2[j], route2[j + 1])]["tot"] \
-                                   + dist[(route2[j - 1], route1[i])]["tot"] \
-                                   + dist[(route1[i], route2[j + 1])]["tot"]
-
-                    if change_in_r1 + change_in_r2 < -0.000001:
-                        solution[r1_id] = route1[:i] + [route2[j]] + route1[i + 1:]
-                        solution[r2_id] = route2[:j] + [route1[i]] + route2[j + 1:]
+                    change_in_r2 = - d_2[route2[j - 1], route2[j]] \
+                                   - d_2[route2[j], route2[j + 1]] \
+                                   + d_2[route2[j - 1], route1[i]] \
+                                   + d_2[route1[i], route2[j + 1]]
+
+                    if typed:
+                        change = solution.cost_change(r1_id, change_in_r1, kg_1, m3_1) + \
+                            solution.cost_change(r2_id, change_in_r2, kg_2, m3_2)
+                    else:
+                        change = change_in_r1 + change_in_r2
+
+                    if change < -0.000001 and solution.exchange_time_feasible(r1_id, i, r2_id, j):
+                        solution.exchange(r1_id, i, r2_id, j, change_in_r1, change_in_r2)
                         return True, solution
 
+            solution.deactivate("exchange", route1[i])
+
     return False, solution
 
 
-def find_first_improvement_2Opt(solution, dist):
+def improving_move(change, feasible=None, strategy="first"):
     """
-    search for the first improving 2-opt move.
+    selects an improving move among moves evaluated at once. The time windows are only checked for the improving
+    moves, in the order they would be selected.
+    :param change: array with the change in distance of every move, inf for the moves which are not valid
+    :param feasible: optional function flat index -> True if the move respects the time windows
+    :param strategy: "first" selects the first improving move in the order of the array, "best" the best one
+    :return: flat index of the move, None if no feasible move improves
+    """
+    change = change.ravel()
+    if not len(change):
+        return None
+    move = int(np.argmax(change < -0.000001)) if strategy == "first" else int(np.argmin(change))
+    if not change[move] < -0.000001:
+        return None
+    if feasible is None or feasible(move):
+        return move
+
+    # the move violates the time windows, the other improving moves are checked in order
+    improving = np.flatnonzero(change < -0.000001)
+    if strategy == "best":
+        improving = improving[np.argsort(change[improving], kind="stable")]
+    for move in improving[1:]:
+        if feasible(int(move)):
+            return int(move)
+    return None
+
+
+def two_opt_deltas(route, d):
+    """
+    change in distance of every 2-opt move of the route, evaluated in O(1) per move from the four arcs which are
+    removed and added. As the distances are asymmetric, the reversed segment is also charged with the difference
+    between its backward and forward length, taken from prefix sums of the route in both directions.
+
+    Example: reversing route[i..j] of [.., a, r_i, .., r_j, b, ..]
+        delta = d(a, r_j) + d(r_i, b) - d(a, r_i) - d(r_j, b) + backward(r_i..r_j) - forward(r_i..r_j)
+
+    :param route: route as list of nodes, starting and ending at the depot
+    :param d: length of the arcs, e.g. dist.tot
+    :return: (L x L) array, delta[i, j] is the change of reversing route[i..j]; moves which are not valid
+        (i < 1, j <= i or j > L - 2) are set to inf
+    """
+    r = np.asarray(route)
+    length = len(r)
+
+    # forward[k] = length of route[0..k], backward[k] = length of route[0..k] driven in the opposite direction
+    forward = np.zeros(length)
+    backward = np.zeros(length)
+    forward[1:] = np.cumsum(d[r[:-1], r[1:]])
+    backward[1:] = np.cumsum(d[r[1:], r[:-1]])
+
+    i = np.arange(length)[:, None]
+    j = np.arange(length)[None, :]
+    valid = (i >= 1) & (j > i) & (j <= length - 2)
+    i_prev = np.clip(i - 1, 0, length - 1)
+    j_next = np.clip(j + 1, 0, length - 1)
+
+    delta = d[r[i_prev], r[j]] + d[r[i], r[j_next]] - d[r[i_prev], r[i]] - d[r[j], r[j_next]] \
+        + (backward[j] - backward[i]) - (forward[j] - forward[i])
+
+    return np.where(valid, delta, np.inf)
+
+
+def find_improvement_2Opt(solution, dist, strategy="first"):
+    """
+    search for an improving 2-opt move.
     A 2-opt consist of removing two edges and reconnecting the nodes differently but feasible way.
     In other terms, a consecutive subset of visits is reversed.
 
     Example: [0,1,2,3,4,5,0] => [0,1,4,3,2,5,0]
         A 2-opt could be removing edges between 1-2 and 4-5, and connecting 1-4 and 2-5.
 
-    :param solution: list of routes to improve
+    Moves are evaluated with two_opt_deltas, the new route is built only for the move which is applied.
+
+    :param solution: Solution or list of routes to improve
     :param dist: distance between nodes
+    :param strategy: "first" applies the first improving move (routes in order, then i and j ascending),
+        "best" applies the move with the largest improvement over all routes
     :return: (True, S') if an improvement was found alongside the improved solution S'.
         Otherwise (False, S), with the original solution S.
     """
+    if strategy not in ("first", "best"):
+        raise ValueError(f"unknown strategy {strategy}, expected 'first' or 'best'")
 
-    # TODO: apply improvements from the exchange neighborhood here as well
+    best = (-0.000001, None, None, None)
+    best_cost = -0.000001
+    dont_look_bits = isinstance(solution, Solution) and solution.dont_look_bits
+    time_windows = isinstance(solution, Solution) and solution.time_windows is not None
+    scanned = list()
 
     for r_id, route in enumerate(solution):
-        current_distance = compute_distance(route, dist)
-        # [0, 1, 2, .., 9, 0]
-        for i in range(1, len(route) - 2):
-            for j in range(i + 1, len(route) - 1):
-                if i == 1 and j == len(route) - 2:
+        if len(route) < 4:
+            continue
+
+        # routes without active customers did not change since their last unsuccessful scan
+        if dont_look_bits and not any(solution.is_active("2opt", c) for c in route[1:-1]):
+            continue
+
+        # we do not need to check the capacity constraint
+        # as no customer is added = demand does not change
+
+        if isinstance(solution, Solution):
+            # the load does not change, nor the arc lengths of the vehicle type
+            delta = two_opt_deltas(route, solution.matrices[solution.arc_type(solution.kg[r_id], solution.m3[r_id])])
+        else:
+            delta = two_opt_deltas(route, dist.tot)
+        feasible = None
+        if time_windows:
+            feasible = lambda move: solution.reverse_time_feasible(r_id, *np.unravel_index(move, delta.shape))
+
+        move = improving_move(delta, feasible, strategy)
+        if move is not None:
+            i, j = np.unravel_index(move, delta.shape)
+            if strategy == "first":
+                best = (delta[i, j], r_id, i, j)
+                break
+            # the load does not change, the moves of different routes are compared by cost
+            change = delta[i, j] * solution.unit_cost(r_id) if isinstance(solution, Solution) else delta[i, j]
+            if change < best_cost:
+                best_cost = change
+                best = (delta[i, j], r_id, i, j)
+            continue
+
+        scanned.append(route)
+
+    if dont_look_bits:
+        for route in scanned:
+            for c in route[1:-1]:
+                solution.deactivate("2opt", c)
+
+    change, r_id, i, j = best
+    if r_id is None:
+        return False, solution
+
+    if isinstance(solution, Solution):
+        solution.reverse(r_id, i, j, change)
+    else:
+        route = solution[r_id]
+        solution[r_id] = route[:i] + list(reversed(route[i:j + 1])) + route[j + 1:]
+    return True, solution
+
+
+def find_first_improvement_2Opt(solution, dist):
+    """
+    search for the first improving 2-opt move, see find_improvement_2Opt.
+    :return: (True, S') if an improvement was found alongside the improved solution S'.
+        Otherwise (False, S), with the original solution S.
+    """
+    return find_improvement_2Opt(solution, dist, "first")
+
+
+def find_best_improvement_2Opt(solution, dist):
+    """
+    search for the best improving 2-opt move, see find_improvement_2Opt.
+    :return: (True, S') if an improvement was found alongside the improved solution S'.
+        Otherwise (False, S), with the original solution S.
+    """
+    return find_improvement_2Opt(solution, dist, "best")
+
+
+# ######################################## GRANULAR NEIGHBORHOODS ###############################################
+
+# Moves are only generated between a customer u and the customers v of its candidate list, i.e. every move creates
+# an arc between u and one of its nearest neighbours (Toth & Vigo, 2003). Long arcs, which can hardly be part of an
+# improving move, are never evaluated.
+
+
+def granular_neighbors(dist, k=20, threshold=None):
+    """
+    candidate lists of the granular neighborhoods.
+    :param dist: distance between nodes
+    :param k: number of nearest customers (by "tot" distance) kept for every customer
+    :param threshold: sparsification threshold in km, arcs longer than this are dropped from the lists
+    :return: dictionary customer -> list of customers, nearest first
+    """
+    d = dist.tot[1:, 1:].copy()
+    np.fill_diagonal(d, np.inf)
+    k = min(k, len(d) - 1)
+    nearest = np.argsort(d, axis=1, kind="stable")[:, :k]
+
+    neighbors = dict()
+    for a in range(len(d)):
+        if threshold is None:
+            row = nearest[a]
+        else:
+            row = nearest[a][d[a, nearest[a]] <= threshold]
+        neighbors[a + 1] = (row + 1).tolist()
+    return neighbors
+
+
+def find_first_improvement_granular_relocate(solution, dist, nodes, neighbors):
+    """
+    search for the first improving relocate which inserts customer u directly after or before one of its neighbours
+    v of another route.
+    :param solution: Solution to improve
+    :param dist: distance between nodes
+    :param nodes: info about customers
+    :param neighbors: candidate lists, see granular_neighbors
+    :return: (True, S') if an improvement was found alongside the improved solution S'.
+        Otherwise (False, S), with the original solution S.
+    """
+    matrices = solution.matrices
+    position = solution.positions()
+
+    for r1_id, route1 in enumerate(solution):
+        for i in range(1, len(route1) - 1):
+            u = route1[i]
+            if not solution.is_active("relocate", u):
+                continue
+            p, n = route1[i - 1], route1[i + 1]
+            kg_1 = solution.kg[r1_id] - nodes[u]["demand_kg"]
+            m3_1 = solution.m3[r1_id] - nodes[u]["demand_m3"]
+            d = matrices[solution.arc_type(kg_1, m3_1)]
+            change_in_r1 = d[p, n] - d[p, u] - d[u, n]
+            cost_in_r1 = solution.cost_change(r1_id, change_in_r1, kg_1, m3_1)
+
+            for v in neighbors[u]:
+                r2_id, j = position[v]
+                if r2_id == r1_id:
                     continue
 
-                # we do not need to check the capacity constraint
-                # as no customer is added = demand does not change
+                capacity_kg, capacity_m3 = solution.capacity(r2_id)
+                if solution.kg[r2_id] + nodes[u]["demand_kg"] > capacity_kg or \
+                        solution.m3[r2_id] + nodes[u]["demand_m3"] > capacity_m3:
+                    continue
 
-                new_route = route[:i] + list(reversed(route[i:j + 1])) + route[j + 1:]
+                route2 = solution[r2_id]
+                # r2 keeps its vehicle type (its capacity is the one of the type), its cost scales with the distance
+                factor = solution.unit_cost(r2_id)
+                d = matrices[solution.arc_type(solution.kg[r2_id], solution.m3[r2_id])]
 
-                new_distance = compute_distance(new_route, dist)
+                # insert u after v: remove (v,w), add (v,u),(u,w)
+                w = route2[j + 1]
+                change_in_r2 = d[v, u] + d[u, w] - d[v, w]
+                if cost_in_r1 + factor * change_in_r2 < -0.000001 and \
+                        solution.relocate_time_feasible(r1_id, i, r2_id, j + 1):
+                    solution.relocate(r1_id, i, r2_id, j + 1, change_in_r1, change_in_r2)
+                    return True, solution
 
-                if new_distance - current_distance < -0.000001:
-                    solution[r_id] = new_route
+                # insert u before v: remove (w,v), add (w,u),(u,v)
+                w = route2[j - 1]
+                change_in_r2 = d[w, u] + d[u, v] - d[w, v]
+                if cost_in_r1 + factor * change_in_r2 < -0.000001 and \
+                        solution.relocate_time_feasible(r1_id, i, r2_id, j):
+                    solution.relocate(r1_id, i, r2_id, j, change_in_r1, change_in_r2)
                     return True, solution
 
+            solution.deactivate("relocate", u)
+
     return False, solution
+
+
+def find_first_improvement_granular_exchange(solution, dist, nodes, neighbors):
+    """
+    search for the first improving exchange which swaps customer u with the successor or the predecessor of one of
+    its neighbours v of another route, so that u ends up right after or right before v.
+    :param solution: Solution to improve
+    :param dist: distance between nodes
+    :param nodes: info about customers
+    :param neighbors: candidate lists, see granular_neighbors
+    :return: (True, S') if an improvement was found alongside the improved solution S'.
+        Otherwise (False, S), with the original solution S.
+    """
+    typed = solution.typed  # the changes in distance are turned into changes in cost
+    modelled = solution.cost_model is not None  # every route is evaluated with the arcs of its new type
+    d_1 = d_2 = solution.d
+    position = solution.positions()
+
+    for r1_id, route1 in enumerate(solution):
+        capacity_kg_1, capacity_m3_1 = solution.capacity(r1_id)
+
+        for i in range(1, len(route1) - 1):
+            u = route1[i]
+            if not solution.is_active("exchange", u):
+                continue
+
+            for v in neighbors[u]:
+                r2_id, k = position[v]
+                if r2_id == r1_id:
+                    continue
+
+                route2 = solution[r2_id]
+                capacity_kg_2, capacity_m3_2 = solution.capacity(r2_id)
+
+                # swap u with the successor of v, then with the predecessor of v
+                for j in (k + 1, k - 1):
+                    if j == 0 or j == len(route2) - 1:
+                        continue
+                    x = route2[j]
+
+                    kg = nodes[x]["demand_kg"] - nodes[u]["demand_kg"]
+                    m3 = nodes[x]["demand_m3"] - nodes[u]["demand_m3"]
+                    if solution.kg[r1_id] + kg > capacity_kg_1 or solution.m3[r1_id] + m3 > capacity_m3_1 or \
+                            solution.kg[r2_id] - kg > capacity_kg_2 or solution.m3[r2_id] - m3 > capacity_m3_2:
+                        continue
+
+                    if modelled:
+                        d_1 = solution.matrices[solution.arc_type(solution.kg[r1_id] + kg, solution.m3[r1_id] + m3)]
+                        d_2 = solution.matrices[solution.arc_type(solution.kg[r2_id] - kg, solution.m3[r2_id] - m3)]
+
+                    change_in_r1 = d_1[route1[i - 1], x] + d_1[x, route1[i + 1]] \
+                        - d_1[route1[i - 1], u] - d_1[u, route1[i + 1]]
+                    change_in_r2 = d_2[route2[j - 1], u] + d_2[u, route2[j + 1]] \
+                        - d_2[route2[j - 1], x] - d_2[x, route2[j + 1]]
+
+                    if typed:
+                        change = solution.cost_change(r1_id, change_in_r1, solution.kg[r1_id] + kg,
+                                                      solution.m3[r1_id] + m3) + \
+                            solution.cost_change(r2_id, change_in_r2, solution.kg[r2_id] - kg, solution.m3[r2_id] - m3)
+                    else:
+                        change = change_in_r1 + change_in_r2
+
+                    if change < -0.000001 and solution.exchange_time_feasible(r1_id, i, r2_id, j):
+                        solution.exchange(r1_id, i, r2_id, j, change_in_r1, change_in_r2)
+                        return True, solution
+
+            solution.deactivate("exchange", u)
+
+    return False, solution
+
+
+def find_first_improvement_granular_2OptStar(solution, dist, nodes, neighbors):
+    """
+    search for the first improving 2-opt* move, which exchanges the tails of two routes.
+    Example: [[0,1,2,3,0],[0,4,5,6,0]] => [[0,1,5,6,0],[0,4,2,3,0]]
+        the arc (1,5) is created, with 5 a neighbour of 1.
+    Loads and distances of the tails come from prefix sums of the routes, so every move is evaluated in O(1). The
+    tails are measured with the arc lengths of the type of the route which gets them (see Solution.arc_type).
+    :param solution: Solution to improve
+    :param dist: distance between nodes
+    :param nodes: info about customers
+    :param neighbors: candidate lists, see granular_neighbors
+    :return: (True, S') if an improvement was found alongside the improved solution S'.
+        Otherwise (False, S), with the original solution S.
+    """
+    matrices = solution.matrices
+    typed = solution.typed  # the changes in distance are turned into changes in cost
+    position = solution.positions()
+
+    # prefix sums of load, volume and distance (see Route): kg[r][k] is the load of route[0..k-1], distance[r][t] are
+    # the prefix sums with the matrix t
+    routes = [solution.route(r_id) for r_id in range(len(solution))]
+    prefix_kg = [route.kg.tolist() for route in routes]
+    prefix_m3 = [route.m3.tolist() for route in routes]
+    prefix_distance = [route.distance.tolist() for route in routes]
+
+    for r1_id, route1 in enumerate(solution):
+        capacity_kg_1, capacity_m3_1 = solution.capacity(r1_id)
+
+        for i in range(1, len(route1) - 1):
+            u = route1[i]
+            if not solution.is_active("2opt*", u):
+                continue
+
+            for v in neighbors[u]:
+                r2_id, j = position[v]
+                if r2_id == r1_id:
+                    continue
+
+                route2 = solution[r2_id]
+                capacity_kg_2, capacity_m3_2 = solution.capacity(r2_id)
+
+                # new r1 = route1[..i] + route2[j..], new r2 = route2[..j-1] + route1[i+1..]
+                kg_1 = prefix_kg[r1_id][i + 1] + solution.kg[r2_id] - prefix_kg[r2_id][j]
+                m3_1 = prefix_m3[r1_id][i + 1] + solution.m3[r2_id] - prefix_m3[r2_id][j]
+                kg_2 = prefix_kg[r2_id][j] + solution.kg[r1_id] - prefix_kg[r1_id][i + 1]
+                m3_2 = prefix_m3[r2_id][j] + solution.m3[r1_id] - prefix_m3[r1_id][i + 1]
+                if kg_1 > capacity_kg_1 or m3_1 > capacity_m3_1 or kg_2 > capacity_kg_2 or m3_2 > capacity_m3_2:
+                    continue
+
+                # both routes with the arcs of their new type
+                t_1 = solution.arc_type(kg_1, m3_1)
+                t_2 = solution.arc_type(kg_2, m3_2)
+                distance_1 = prefix_distance[r1_id]
+                distance_2 = prefix_distance[r2_id]
+
+                tail_1 = distance_1[t_1][-1] - distance_1[t_1][i + 1]
+                tail_2 = distance_2[t_1][-1] - distance_2[t_1][j]
+                change_in_r1 = matrices[t_1][u, v] + tail_2 - matrices[t_1][u, route1[i + 1]] - tail_1
+                tail_1 = distance_1[t_2][-1] - distance_1[t_2][i + 1]
+                tail_2 = distance_2[t_2][-1] - distance_2[t_2][j]
+                change_in_r2 = matrices[t_2][route2[j - 1], route1[i + 1]] + tail_1 - matrices[t_2][route2[j - 1], v] \
+                    - tail_2
+
+                if typed:
+                    change = solution.cost_change(r1_id, change_in_r1, kg_1, m3_1) + \
+                        solution.cost_change(r2_id, change_in_r2, kg_2, m3_2)
+                else:
+                    change = change_in_r1 + change_in_r2
+
+                if change < -0.000001 and solution.swap_tails_time_feasible(r1_id, i, r2_id, j):
+                    solution.swap_tails(r1_id, i, r2_id, j, change_in_r1, change_in_r2)
+                    return True, solution
+
+            solution.deactivate("2opt*", u)
+
+    return False, solution
+
+
+# ###################################### SEGMENT NEIGHBORHOODS ##################################################
+
+# Or-opt, 2-opt* and CROSS-exchange. All the arcs of the solution are listed once per search with the prefix sums of
+# load and distance of their route, so that a move (which keeps the orientation of the segments it moves) is evaluated
+# in O(1) from its end points: for a given segment or cut point, all the targets are evaluated at once with numpy.
+# The distances are kept for every matrix of the solution (see Solution.arc_type), every route of a move is evaluated
+# with the matrix of the type it has after the move.
+
+SEGMENT_LENGTHS = (1, 2, 3)
+
+
+class RouteArcs:
+    """
+    arcs (a, b) = (route[k], route[k + 1]) of all the routes of a solution, as flat arrays, with
+    kg[arc] / m3[arc]: load and volume of route[0..k], before[t, arc] / after[t, arc]: distance from the depot to a / b
+    with matrix t, and per route load, volume, length[t, route] with matrix t and capacity (of the vehicle type the
+    route is assigned to). The prefix sums are the ones of Solution.route, only the routes changed since the last
+    search are evaluated again
+    """
+
+    def __init__(self, solution):
+        route, position, a, b, kg, m3, before, after = [], [], [], [], [], [], [], []
+        for r_id in range(len(solution)):
+            r = solution.route(r_id)
+            arcs = len(r) - 1
+            route.append(np.full(arcs, r_id))
+            position.append(np.arange(arcs))
+            a.append(r.nodes[:-1])
+            b.append(r.nodes[1:])
+            kg.append(r.kg[1:-1])
+            m3.append(r.m3[1:-1])
+            before.append(r.distance[:, :-1])
+            after.append(r.distance[:, 1:])
+
+        self.route, self.position, self.a, self.b = [np.concatenate(x) for x in (route, position, a, b)]
+        self.kg, self.m3 = [np.concatenate(x) for x in (kg, m3)]
+        self.before, self.after = [np.concatenate(x, axis=1) for x in (before, after)]
+        self.start = np.concatenate(([0], np.cumsum([len(r) - 1 for r in solution])))  # first arc of every route
+
+        self.route_kg = np.array(solution.kg, dtype=float)
+        self.route_m3 = np.array(solution.m3, dtype=float)
+        if solution.lengths is None:
+            self.length = np.array(solution.distance, dtype=float)[None]
+        else:
+            self.length = np.array(solution.lengths, dtype=float).T
+        capacity = np.array([solution.capacity(r_id) for r_id in range(len(solution))], dtype=float)
+        self.capacity_kg = capacity[:, 0]
+        self.capacity_m3 = capacity[:, 1]
+
+    def arc(self, r_id, k):
+        """
+        :return: index of the arc (route[k], route[k + 1]) of route r
+        """
+        return self.start[r_id] + k
+
+
+def typed_values(values, t):
+    """
+    :param values: array with one row for every matrix of the solution and one column for every arc (or segment)
+    :param t: matrix of every column (see Solution.arc_type), or a single matrix for all of them
+    :return: values[t[c], c] for every column c
+    """
+    if np.ndim(t) == 0:
+        return values[t]
+    return values[t, np.arange(values.shape[1])]
+
+
+def find_first_improvement_or_opt(solution, dist, nodes):
+    """
+    search for the first improving Or-opt move: a segment of 1 to 3 consecutive customers is moved, keeping its
+    orientation, to another position of the same route or of another route.
+    Example: [[0,1,2,3,0],[0,4,5,0]] => [[0,3,0],[0,4,1,2,5,0]]
+    Segments are scanned in order, for every segment the best target arc is applied if it improves.
+    :param solution: Solution to improve
+    :param dist: distance between nodes
+    :param nodes: info about customers
+    :return: (True, S') if an improvement was found alongside the improved solution S'.
+        Otherwise (False, S), with the original solution S.
+    """
+    matrices = solution.matrices
+    arcs = RouteArcs(solution)
+    insertion_base = -matrices[:, arcs.a, arcs.b]
+
+    for r1_id, route1 in enumerate(solution):
+        for i in range(1, len(route1) - 1):
+            if not solution.is_active("or-opt", route1[i]):
+                continue
+
+            for k in SEGMENT_LENGTHS:
+                if i + k > len(route1) - 1:
+                    break
+                f, l, p, n = route1[i], route1[i + k - 1], route1[i - 1], route1[i + k]
+                first = arcs.arc(r1_id, i - 1)  # arc (p, f)
+                kg = arcs.kg[first + k] - arcs.kg[first]
+                m3 = arcs.m3[first + k] - arcs.m3[first]
+                inside = arcs.before[:, first + k] - arcs.after[:, first]  # distance inside the segment
+                other = arcs.route != r1_id
+
+                # matrices of r1 without the segment and of every route with it, within r1 its type does not change
+                t_0 = solution.arc_type(arcs.route_kg[r1_id], arcs.route_m3[r1_id])
+                t_1 = solution.arc_type(arcs.route_kg[r1_id] - kg, arcs.route_m3[r1_id] - m3)
+                t_2 = solution.arc_type(arcs.route_kg[arcs.route] + kg, arcs.route_m3[arcs.route] + m3)
+                if np.ndim(t_2):
+                    t_2 = np.where(other, t_2, t_0)
+
+                change_in_r1 = matrices[t_1][p, n] - matrices[t_1][p, f] - matrices[t_1][l, n] - inside[t_1]
+                change_within = change_in_r1 if t_1 == t_0 else \
+                    matrices[t_0][p, n] - matrices[t_0][p, f] - matrices[t_0][l, n] - inside[t_0]
+                change_in_r2 = solution.arc_lengths(t_2, arcs.a, f) + solution.arc_lengths(t_2, l, arcs.b) + \
+                    inside[t_2] + typed_values(insertion_base, t_2)
+
+                feasible = np.where(other, (arcs.route_kg[arcs.route] + kg <= arcs.capacity_kg[arcs.route]) &
+                                    (arcs.route_m3[arcs.route] + m3 <= arcs.capacity_m3[arcs.route]), True)
+                # in the same route, the arcs from (p, f) to (l, n) are removed by the move
+                feasible[first:first + k + 1] = False
+
+                # in cost: r1 loses the segment, the other routes get it, within r1 its type does not change
+                change = np.where(other, solution.cost_change(r1_id, change_in_r1, arcs.route_kg[r1_id] - kg,
+                                                              arcs.route_m3[r1_id] - m3) +
+                                  solution.cost_change(arcs.route, change_in_r2, arcs.route_kg[arcs.route] + kg,
+                                                       arcs.route_m3[arcs.route] + m3),
+                                  solution.unit_cost(r1_id) * (change_within + change_in_r2))
+                change = np.where(feasible, change, np.inf)
+                target = improving_move(change, lambda target: solution.move_segment_time_feasible(
+                    r1_id, i, k, int(arcs.route[target]), int(arcs.position[target]) + 1), "best")
+                if target is not None:
+                    r2_id = int(arcs.route[target])
+                    solution.move_segment(r1_id, i, k, r2_id, int(arcs.position[target]) + 1,
+                                          change_in_r1 if r2_id != r1_id else change_within, change_in_r2[target])
+                    return True, solution
+
+            solution.deactivate("or-opt", route1[i])
+
+    return False, solution
+
+
+def find_first_improvement_2OptStar(solution, dist, nodes):
+    """
+    search for the first improving 2-opt* move over all the pairs of routes: route r1 is cut after position i, route
+    r2 after position k and the tails are swapped.
+    Example: [[0,1,2,3,0],[0,4,5,6,0]] => [[0,1,5,6,0],[0,4,2,3,0]]
+    Cut points of r1 are scanned in order, for every cut point the best cut point of the other routes is applied if it
+    improves. A route can become empty, when it gives its whole tail to the other route.
+    :param solution: Solution to improve
+    :param dist: distance between nodes
+    :param nodes: info about customers
+    :return: (True, S') if an improvement was found alongside the improved solution S'.
+        Otherwise (False, S), with the original solution S.
+    """
+    arcs = RouteArcs(solution)
+    tail = arcs.length[:, arcs.route] - arcs.after  # distance from b to the end of the route
+
+    for r1_id, route1 in enumerate(solution):
+        for i in range(len(route1) - 1):
+            u, x = route1[i], route1[i + 1]
+            if not (solution.is_active("2opt*", u) or solution.is_active("2opt*", x)):
+                continue
+            cut = arcs.arc(r1_id, i)
+
+            # new r1 = r1[..i] + r2[k+1..], new r2 = r2[..k] + r1[i+1..], the pair of routes is evaluated once
+            kg_1 = arcs.kg[cut] + arcs.route_kg[arcs.route] - arcs.kg
+            m3_1 = arcs.m3[cut] + arcs.route_m3[arcs.route] - arcs.m3
+            kg_2 = arcs.kg + arcs.route_kg[r1_id] - arcs.kg[cut]
+            m3_2 = arcs.m3 + arcs.route_m3[r1_id] - arcs.m3[cut]
+            feasible = (arcs.route > r1_id) & (kg_1 <= arcs.capacity_kg[r1_id]) & (m3_1 <= arcs.capacity_m3[r1_id]) & \
+                (kg_2 <= arcs.capacity_kg[arcs.route]) & (m3_2 <= arcs.capacity_m3[arcs.route])
+
+            # both routes with the arcs of their new type
+            t_1 = solution.arc_type(kg_1, m3_1)
+            t_2 = solution.arc_type(kg_2, m3_2)
+            change_in_r1 = solution.arc_lengths(t_1, u, arcs.b) + typed_values(tail, t_1) - \
+                solution.arc_lengths(t_1, u, x) - tail[t_1, cut]
+            change_in_r2 = solution.arc_lengths(t_2, arcs.a, x) + tail[t_2, cut] - \
+                solution.arc_lengths(t_2, arcs.a, arcs.b) - typed_values(tail, t_2)
+
+            change = solution.cost_change(r1_id, change_in_r1, kg_1, m3_1) + \
+                solution.cost_change(arcs.route, change_in_r2, kg_2, m3_2)
+            change = np.where(feasible, change, np.inf)
+            target = improving_move(change, lambda target: solution.swap_tails_time_feasible(
+                r1_id, i, int(arcs.route[target]), int(arcs.position[target]) + 1), "best")
+            if target is not None:
+                solution.swap_tails(r1_id, i, int(arcs.route[target]), int(arcs.position[target]) + 1,
+                                    change_in_r1[target], change_in_r2[target])
+                return True, solution
+
+            # the cut after the depot is scanned again while the first customer is active
+            solution.deactivate("2opt*", u)
+
+    return False, solution
+
+
+def find_first_improvement_cross(solution, dist, nodes):
+    """
+    search for the first improving CROSS-exchange move: a segment of 1 to 3 customers of route r1 is swapped with a
+    segment of 1 to 3 customers of another route r2, both keeping their orientation.
+    Example: [[0,1,2,3,0],[0,4,5,6,0]] => [[0,1,5,6,3,0],[0,4,2,0]]
+    Segments of r1 are scanned in order, for every segment the best segment of the other routes is applied if it
+    improves.
+    :param solution: Solution to improve
+    :param dist: distance between nodes
+    :param nodes: info about customers
+    :return: (True, S') if an improvement was found alongside the improved solution S'.
+        Otherwise (False, S), with the original solution S.
+    """
+    matrices = solution.matrices
+    arcs = RouteArcs(solution)
+
+    # all the segments of all the routes, ordered by route, position and length: arc (p, f) entering the segment and
+    # arc (l, n) leaving it
+    arcs_in_route = np.diff(arcs.start)[arcs.route]
+    enter = np.concatenate([np.flatnonzero(arcs.position + k < arcs_in_route) for k in SEGMENT_LENGTHS])
+    length = np.concatenate([np.full(np.count_nonzero(arcs.position + k < arcs_in_route), k) for k in SEGMENT_LENGTHS])
+    order = np.lexsort((length, enter))
+    enter = enter[order]
+    length = length[order]
+    leave = enter + length
+
+    route = arcs.route[enter]
+    p, f, l, n = arcs.a[enter], arcs.b[enter], arcs.a[leave], arcs.b[leave]
+    kg = arcs.kg[leave] - arcs.kg[enter]
+    m3 = arcs.m3[leave] - arcs.m3[enter]
+    inside = arcs.before[:, leave] - arcs.after[:, enter]  # distance inside the segment
+    removed = matrices[:, p, f] + matrices[:, l, n] + inside
+
+    for s1 in range(len(enter)):
+        r1_id = int(route[s1])
+        if not solution.is_active("cross", f[s1]):
+            continue
+
+        kg_1 = arcs.route_kg[r1_id] - kg[s1] + kg
+        m3_1 = arcs.route_m3[r1_id] - m3[s1] + m3
+        kg_2 = arcs.route_kg[route] - kg + kg[s1]
+        m3_2 = arcs.route_m3[route] - m3 + m3[s1]
+        feasible = (route > r1_id) & (kg_1 <= arcs.capacity_kg[r1_id]) & (m3_1 <= arcs.capacity_m3[r1_id]) & \
+            (kg_2 <= arcs.capacity_kg[route]) & (m3_2 <= arcs.capacity_m3[route])
+
+        # both routes with the arcs of their new type
+        t_1 = solution.arc_type(kg_1, m3_1)
+        t_2 = solution.arc_type(kg_2, m3_2)
+        change_in_r1 = solution.arc_lengths(t_1, p[s1], f) + solution.arc_lengths(t_1, l, n[s1]) + \
+            typed_values(inside, t_1) - removed[t_1, s1]
+        change_in_r2 = solution.arc_lengths(t_2, p, f[s1]) + solution.arc_lengths(t_2, l[s1], n) + inside[t_2, s1] - \
+            typed_values(removed, t_2)
+
+        change = solution.cost_change(r1_id, change_in_r1, kg_1, m3_1) + \
+            solution.cost_change(route, change_in_r2, kg_2, m3_2)
+        change = np.where(feasible, change, np.inf)
+        s2 = improving_move(change, lambda s2: solution.exchange_segments_time_feasible(
+            r1_id, int(arcs.position[enter[s1]]) + 1, int(length[s1]), int(route[s2]), int(arcs.position[enter[s2]]) + 1,
+            int(length[s2])), "best")
+        if s2 is not None:
+            solution.exchange_segments(r1_id, int(arcs.position[enter[s1]]) + 1, int(length[s1]), int(route[s2]),
+                                       int(arcs.position[enter[s2]]) + 1, int(length[s2]), change_in_r1[s2],
+                                       change_in_r2[s2])
+            return True, solution
+
+        if s1 + 1 == len(enter) or enter[s1 + 1] != enter[s1]:
+            solution.deactivate("cross", f[s1])
+
+    return False, solution
+
+
+# ################################### PARALLEL NEIGHBORHOOD EVALUATION ##########################################
+
+# The moves of the relocate and exchange neighborhoods are evaluated in batch, for all the route pairs at once: the
+# customers which can be moved and the insertion positions of all the routes are flattened into arrays (see
+# move_arrays), and a block of customers is evaluated against all the positions (or all the other customers) by one
+# NumPy kernel. The blocks are split among threads, which release the GIL in the array operations, every thread
+# returns the best move of its block and the best of these is applied. The candidates are the ones of the sequential
+# neighborhoods (the last customer of a route is never moved, a customer is never inserted before the final depot).
+# Moves are compared by (change, customer, position), so the result does not depend on the number of threads nor on
+# their scheduling. Every route is evaluated with the arcs of the type it has after the move (see Solution.arc_type).
+
+# largest number of moves evaluated by one kernel call
+BLOCK_SIZE = 1 << 18
+
+
+def move_arrays(solution):
+    """
+    flattened candidates of the relocate and exchange neighborhoods.
+    :return: (customers, positions, capacity): customers is the tuple of arrays (node, route, position, previous
+        node, next node) of the customers which can be moved, positions the tuple (route, position, previous node,
+        node) of the insertion positions (between the previous node and the node), capacity the tuple (kg, m3) of the
+        capacity of every route
+    """
+    routes = [np.asarray(route) for route in solution]
+    customers = [list() for _ in range(5)]
+    positions = [list() for _ in range(4)]
+    for r_id, route in enumerate(routes):
+        k = np.arange(1, len(route) - 2)
+        for values, column in zip(customers, (route[k], np.full(len(k), r_id), k, route[k - 1], route[k + 1])):
+            values.append(column)
+        k = np.arange(1, len(route) - 1)
+        for values, column in zip(positions, (np.full(len(k), r_id), k, route[k - 1], route[k])):
+            values.append(column)
+
+    kg = np.asarray(solution.kg, dtype=float)
+    m3 = np.asarray(solution.m3, dtype=float)
+    types = solution.fleet.route_types(kg, m3)
+    types = np.where(types == -1, solution.fleet.largest_type(), types)
+    capacity = (solution.fleet.capacity_kg[types], solution.fleet.capacity_m3[types])
+
+    def flatten(columns):
+        return tuple(np.concatenate(values).astype(int) if values else np.zeros(0, dtype=int) for values in columns)
+
+    return flatten(customers), flatten(positions), capacity
+
+
+def relocate_kernel(solution, demand_kg, demand_m3, customers, positions, capacity, rows):
+    """
+    evaluates all the moves relocating the customers rows into another route.
+    :return: (change, customer, position, change in r1, change in r2) of the best feasible move, None if there is none
+    """
+    u, r1, _, p, n = (values[rows] for values in customers)
+    r2, _, a, b = positions
+    kg = np.asarray(solution.kg, dtype=float)
+    m3 = np.asarray(solution.m3, dtype=float)
+    kg_1 = kg[r1] - demand_kg[u]
+    m3_1 = m3[r1] - demand_m3[u]
+    kg_2 = kg[r2][None, :] + demand_kg[u][:, None]
+    m3_2 = m3[r2][None, :] + demand_m3[u][:, None]
+
+    t_1 = solution.arc_type(kg_1, m3_1)
+    t_2 = solution.arc_type(kg_2, m3_2)
+    change_in_r1 = solution.arc_lengths(t_1, p, n) - solution.arc_lengths(t_1, p, u) - solution.arc_lengths(t_1, u, n)
+    a = a[None, :]
+    b = b[None, :]
+    change_in_r2 = solution.arc_lengths(t_2, a, u[:, None]) + solution.arc_lengths(t_2, u[:, None], b) - \
+        solution.arc_lengths(t_2, a, b)
+
+    feasible = (r1[:, None] != r2[None, :]) & (kg_2 <= capacity[0][r2]) & (m3_2 <= capacity[1][r2])
+    if not feasible.any():
+        return None
+
+    change = solution.cost_change(r1, change_in_r1, kg_1, m3_1)[:, None] + \
+        solution.cost_change(r2[None, :], change_in_r2, kg_2, m3_2)
+    change = np.where(feasible, change, np.inf)
+    i, j = np.unravel_index(np.argmin(change), change.shape)
+    return change[i, j], int(rows[i]), int(j), change_in_r1[i], change_in_r2[i, j]
+
+
+def exchange_kernel(solution, demand_kg, demand_m3, customers, positions, capacity, rows):
+    """
+    evaluates all the moves swapping the customers rows with a customer of a route with a larger index (exchange is
+    symmetric).
+    :return: (change, customer, other customer, change in r1, change in r2) of the best feasible move, None if there
+        is none
+    """
+    u, r1, _, p, n = (values[rows][:, None] for values in customers)
+    x, r2, _, a, b = (values[None, :] for values in customers)
+    kg = np.asarray(solution.kg, dtype=float)
+    m3 = np.asarray(solution.m3, dtype=float)
+
+    kg_1 = kg[r1] + demand_kg[x] - demand_kg[u]
+    m3_1 = m3[r1] + demand_m3[x] - demand_m3[u]
+    kg_2 = kg[r2] - demand_kg[x] + demand_kg[u]
+    m3_2 = m3[r2] - demand_m3[x] + demand_m3[u]
+
+    t_1 = solution.arc_type(kg_1, m3_1)
+    t_2 = solution.arc_type(kg_2, m3_2)
+    change_in_r1 = solution.arc_lengths(t_1, p, x) + solution.arc_lengths(t_1, x, n) - solution.arc_lengths(t_1, p, u) \
+        - solution.arc_lengths(t_1, u, n)
+    change_in_r2 = solution.arc_lengths(t_2, a, u) + solution.arc_lengths(t_2, u, b) - solution.arc_lengths(t_2, a, x) \
+        - solution.arc_lengths(t_2, x, b)
+    feasible = (r1 < r2) & (kg_1 <= capacity[0][r1]) & (m3_1 <= capacity[1][r1]) & \
+        (kg_2 <= capacity[0][r2]) & (m3_2 <= capacity[1][r2])
+    if not feasible.any():
+        return None
+
+    change = solution.cost_change(r1, change_in_r1, kg_1, m3_1) + solution.cost_change(r2, change_in_r2, kg_2, m3_2)
+    change = np.where(feasible, change, np.inf)
+    i, j = np.unravel_index(np.argmin(change), change.shape)
+    return change[i, j], int(rows[i]), int(j), change_in_r1[i, j], change_in_r2[i, j]
+
+
+KERNELS = {"relocate": relocate_kernel, "exchange": exchange_kernel}
+
+
+def find_best_improvement_parallel(solution, dist, nodes, neighborhood, pool, workers):
+    """
+    search for the best improving move of the relocate or exchange neighborhood, evaluating blocks of customers in
+    parallel.
+    :param solution: Solution to improve
+    :param dist: distance between nodes
+    :param nodes: info about customers
+    :param neighborhood: "relocate" or "exchange"
+    :param pool: ThreadPoolExecutor running the evaluations
+    :param workers: number of threads, the customers are split into at least as many blocks
+    :return: (True, S') if an improvement was found alongside the improved solution S'.
+        Otherwise (False, S), with the original solution S.
+    """
+    kernel = KERNELS[neighborhood]
+    demand_kg, demand_m3 = solution.demand_kg, solution.demand_m3
+    customers, positions, capacity = move_arrays(solution)
+
+    n_rows = len(customers[0])
+    n_columns = len(positions[0]) if neighborhood == "relocate" else n_rows
+    if not n_rows or not n_columns:
+        return False, solution
+    blocks = max(workers, -(-n_rows * n_columns // BLOCK_SIZE))
+
+    def evaluate(rows):
+        return kernel(solution, demand_kg, demand_m3, customers, positions, capacity, rows)
+
+    chunks = [rows for rows in np.array_split(np.arange(n_rows), min(blocks, n_rows)) if len(rows)]
+    results = [best for best in pool.map(evaluate, chunks) if best is not None]
+    if not results:
+        return False, solution
+
+    change, row, column, change_in_r1, change_in_r2 = min(results, key=lambda move: move[:3])
+    if change >= -0.000001:
+        return False, solution
+
+    route, position = customers[1:3]
+    if neighborhood == "relocate":
+        solution.relocate(int(route[row]), int(position[row]), int(positions[0][column]), int(positions[1][column]),
+                          change_in_r1, change_in_r2)
+    else:
+        solution.exchange(int(route[row]), int(position[row]), int(route[column]), int(position[column]),
+                          change_in_r1, change_in_r2)
+    return True, solution
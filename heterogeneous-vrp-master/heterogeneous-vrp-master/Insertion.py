@@ -0,0 +1,133 @@
+# Cache of the best insertion of every customer in every route
+import heapq
+
+import numpy as np
+
+from Route import demand_arrays
+
+
+class InsertionCache:
+    """
+    For every (customer, route) pair, the cheapest position to insert the customer in the route and the change in
+    distance, inf if the route cannot take the customer (capacity of the vehicle it is assigned to, see
+    Solution.capacity) or already visits it.
+
+    Every move of Solution replaces the lists of the routes it changes, so a column is outdated when the route it was
+    computed on is not the current list of the route anymore. refresh() recomputes only these columns, O(changed routes
+    x n x route length) after a move instead of O(n^2) for a computation from scratch.
+
+    cheapest() returns the globally cheapest feasible insertion among a set of customers, e.g. the customers to be
+    inserted by the greedy repair of ALNS. The insertions are kept in a heap, the entries of a route are invalidated
+    lazily when its column is recomputed.
+
+    With upgrade, a route can take a customer as long as the new load fits some vehicle type, and the insertions are
+    ranked by their change in cost (see Solution.cost_change), which includes the change of vehicle type. The
+    insertions are evaluated with the arc lengths of the type the route has after them (see Solution.arc_type).
+    """
+
+    def __init__(self, solution, dist, nodes, customers=None, upgrade=False):
+        """
+        :param solution: Solution, the cache follows its changes
+        :param dist: distance between nodes, the arc lengths are the ones of the solution (Solution.matrices)
+        :param nodes: info about customers
+        :param customers: customers whose insertions are cached, all of them by default
+        :param upgrade: if True the capacity is the one of the largest vehicle type and the cache holds changes in cost
+            instead of changes in distance
+        """
+        self.solution = solution
+        self.upgrade = upgrade
+        self.demand_kg, self.demand_m3 = demand_arrays(nodes)
+        self.customers = np.arange(1, len(nodes)) if customers is None else np.asarray(customers, dtype=int)
+
+        self.delta = np.full((len(nodes), 0), np.inf)  # change in distance (or cost), customer x route
+        self.position = np.zeros((len(nodes), 0), dtype=int)  # position of the customer after the insertion
+        self.routes = list()  # route lists the columns were computed on
+        self.version = list()  # incremented at every recomputation of a column
+        self.heap = list()  # (delta, customer, route, version)
+        self.unpushed = set()  # routes whose current column is not in the heap yet
+
+        self.refresh()
+
+    def column(self, r_id):
+        """
+        computes the best insertion of all the customers in route r
+        """
+        route = np.asarray(self.solution[r_id])
+        kg = self.solution.kg[r_id] + self.demand_kg[self.customers]
+        m3 = self.solution.m3[r_id] + self.demand_m3[self.customers]
+
+        c = self.customers[:, None]
+        a = route[None, :-1]
+        b = route[None, 1:]
+        if self.upgrade and self.solution.cost_model is not None:
+            # every customer is inserted with the arcs of the type the route takes with it
+            t = self.solution.arc_type(kg, m3)[:, None]
+            d = self.solution.matrices
+            delta = d[t, a, c] + d[t, c, b] - d[t, a, b]
+        else:
+            # the route keeps the arcs of its vehicle type
+            d = self.solution.arc_matrix(self.solution.kg[r_id], self.solution.m3[r_id])
+            delta = d[a, c] + d[c, b] - d[a, b]
+        position = np.argmin(delta, axis=1)
+        best = delta[np.arange(len(self.customers)), position]
+
+        visited = np.zeros(len(self.demand_kg), dtype=bool)
+        visited[route] = True
+        if self.upgrade:
+            feasible = self.solution.fleet.fits(kg, m3) & ~visited[self.customers]
+            best = self.solution.cost_change(r_id, best, kg, m3)
+        else:
+            capacity_kg, capacity_m3 = self.solution.capacity(r_id)
+            feasible = (kg <= capacity_kg) & (m3 <= capacity_m3) & ~visited[self.customers]
+
+        self.delta[self.customers, r_id] = np.where(feasible, best, np.inf)
+        self.position[self.customers, r_id] = position + 1
+
+    def refresh(self):
+        """
+        recomputes the columns of the routes changed (or added) since the last refresh
+        :return: list of the recomputed routes
+        """
+        new = len(self.solution) - len(self.routes)
+        if new > 0:
+            self.delta = np.hstack((self.delta, np.full((len(self.delta), new), np.inf)))
+            self.position = np.hstack((self.position, np.zeros((len(self.position), new), dtype=int)))
+            self.routes += [None] * new
+            self.version += [0] * new
+
+        changed = [r_id for r_id in range(len(self.solution)) if self.solution[r_id] is not self.routes[r_id]]
+        for r_id in changed:
+            self.column(r_id)
+            self.routes[r_id] = self.solution[r_id]
+            self.version[r_id] += 1
+            self.unpushed.add(r_id)
+        return changed
+
+    def best(self, u):
+        """
+        :return: (change in distance (or cost), position) of the best insertion of customer u in every route
+        """
+        return self.delta[u], self.position[u]
+
+    def cheapest(self, customers):
+        """
+        :param customers: set of the customers to consider. The entries of the other customers are discarded from the
+            heap, so the set can only shrink between two calls
+        :return: (change in distance (or cost), customer, route, position) of the cheapest feasible insertion, None if
+            no customer can be inserted
+        """
+        self.refresh()
+        for r_id in self.unpushed:
+            delta = self.delta[self.customers, r_id]
+            for a in np.flatnonzero(delta != np.inf).tolist():
+                u = int(self.customers[a])
+                if u in customers:
+                    heapq.heappush(self.heap, (float(delta[a]), u, r_id, self.version[r_id]))
+        self.unpushed.clear()
+
+        while self.heap:
+            delta, u, r_id, version = self.heap[0]
+            if version == self.version[r_id] and u in customers:
+                return delta, u, r_id, int(self.position[u, r_id])
+            heapq.heappop(self.heap)
+        return None
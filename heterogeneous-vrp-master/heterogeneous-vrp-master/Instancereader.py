@@ -1,5 +1,14 @@
+import datetime
+import hashlib
+import os
+import shutil
+import tempfile
+
+import numpy as np
 import pandas as pd
 
+from Distances import DistanceMatrix
+
 
 def read_nodes(filename):
     nodes = dict()
@@ -15,7 +24,7 @@ def read_nodes(filename):
         lat = lo[i][2]
         demand_kg = lo[i][3]
         demand_m3= lo[i][4]
-        duration = lo[i][5]
+        duration = to_seconds(lo[i][5])
         nodes[i] = {"lon": lon, "lat": lat, "demand_kg": demand_kg, "demand_m3": demand_m3, "duration": duration}
         #nodes.append({"id": i, "lon": lon, "lat": lat, "demand_kg": demand_kg, "demand_m3": demand_m3, "duration": duration})
 
@@ -23,23 +32,125 @@ def read_nodes(filename):
 
     return {'c': c, 'nodes': nodes}
 
+def to_seconds(value):
+    """
+    converts a duration read from the workbook (time of the day, timedelta or number of seconds) into seconds
+    """
+    if isinstance(value, datetime.datetime):
+        return (value - datetime.datetime(1899, 12, 30)).total_seconds()
+    if isinstance(value, datetime.time):
+        return value.hour * 3600 + value.minute * 60 + value.second + value.microsecond / 1e6
+    if isinstance(value, datetime.timedelta):
+        return value.total_seconds()
+    if isinstance(value, str):
+        return pd.to_timedelta(value).total_seconds()
+    return float(value)
+
+
 def read_distances(filename, c):
-    distances = dict()
+    """
+    reads the Routes sheet, which lists every arc (from, to) ordered by origin and destination.
+    :param filename: workbook of the instance
+    :param c: number of nodes (customers + depot)
+    :return: DistanceMatrix with the "tot", "inside", "outside" and "duration" matrices
+    """
     dist = pd.read_excel(filename, sheet_name="Routes")
-    d = dist.values.tolist()
-    ii = 0
-    j = 0
 
-    for i in range(len(d)):
+    # row i of the sheet is the arc (i // c, i % c); trailing rows may be missing (e.g. the last loop arc of NYC.xlsx)
+    # and are left at zero
+    matrices = np.zeros((4, c * c))
+    for k in range(3):
+        matrices[k, :len(dist)] = dist.iloc[:, 2 + k].to_numpy(dtype=float)
+    matrices[3, :len(dist)] = [to_seconds(d) for d in dist.iloc[:, 5]]
+    tot, inside, outside, duration = matrices.reshape(4, c, c)
+
+    return DistanceMatrix(tot, inside, outside, duration)
+
+
+# attributes of the nodes and matrices of the distances stored in the binary cache, one .npy file each
+NODE_ATTRIBUTES = ("lon", "lat", "demand_kg", "demand_m3", "duration")
+DISTANCE_METRICS = ("tot", "inside", "outside", "duration")
+
+
+def workbook_hash(filename):
+    """
+    :return: sha1 of the content of the workbook, used as key of the binary cache
+    """
+    h = hashlib.sha1()
+    with open(filename, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def cache_path(filename, cache_dir=None):
+    """
+    :return: directory of the binary cache of the workbook. The directory name contains the hash of the content,
+        so a modified workbook is automatically mapped to a new cache entry.
+    """
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(filename)), ".instance_cache")
+    stem = os.path.splitext(os.path.basename(filename))[0]
+    return os.path.join(cache_dir, f"{stem}-{workbook_hash(filename)[:16]}")
+
+
+def write_cache(path, nodes, dist):
+    """
+    stores node attributes and distance matrices as .npy files in path. Files are written into a temporary
+    directory which is then renamed, so that parallel workers never see a half-written cache.
+    """
+    parent = os.path.dirname(path)
+    os.makedirs(parent, exist_ok=True)
+    tmp = tempfile.mkdtemp(dir=parent)
+    os.chmod(tmp, 0o755)
+    for attribute in NODE_ATTRIBUTES:
+        np.save(os.path.join(tmp, f"node_{attribute}.npy"), np.array([nodes[i][attribute] for i in range(len(nodes))]))
+    for metric in DISTANCE_METRICS:
+        np.save(os.path.join(tmp, f"dist_{metric}.npy"), dist.metric(metric))
+    try:
+        os.rename(tmp, path)
+    except OSError:
+        # another process was faster
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def load_cache(path, mmap=True):
+    """
+    loads an instance stored by write_cache.
+    :param path: directory of the cache entry
+    :param mmap: if True the distance matrices are memory-mapped read-only, so that processes loading the same cache
+        share the pages instead of holding a private copy each
+    :return: same dictionary as read_instance
+    """
+    mode = "r" if mmap else None
+    attributes = {a: np.load(os.path.join(path, f"node_{a}.npy")).tolist() for a in NODE_ATTRIBUTES}
+    nodes = dict()
+    for i in range(len(attributes["lon"])):
+        nodes[i] = {a: attributes[a][i] for a in NODE_ATTRIBUTES}
+    matrices = [np.load(os.path.join(path, f"dist_{m}.npy"), mmap_mode=mode) for m in DISTANCE_METRICS]
+
+    return {'c': len(nodes) - 1, 'nodes': nodes, 'dist': DistanceMatrix(*matrices), 'cache': path}
+
+
+def read_instance(filename, cache=True, cache_dir=None):
+    """
+    reads nodes and distances of an instance. The first time a workbook is read it is parsed with pandas and
+    stored in a binary cache next to it (see cache_path); later calls load the cache, which takes milliseconds.
+    :param filename: workbook of the instance
+    :param cache: if False the workbook is always parsed and no cache is written
+    :param cache_dir: directory of the cache, by default .instance_cache next to the workbook
+    :return: {'c': number of customers, 'nodes': nodes, 'dist': DistanceMatrix, 'cache': cache entry or None}
+    """
+    if cache:
+        path = cache_path(filename, cache_dir)
+        if os.path.isdir(path):
+            return load_cache(path)
 
-        a = i//c
-        b = i%c
+    data = read_nodes(filename)
+    dist = read_distances(filename, data["c"] + 1)
 
-        tot = d[i][2]
-        inside =  d[i][3]
-        outside = d[i][4]
-        duration = d[i][5]
-        distances[(a, b)] = {"tot": tot, "inside": inside, "outside": outside, "duration": duration}
-        #distances.append({"from": a, "to": b, "tot": tot, "inside": inside, "outside": outside, "duration": duration})
+    if not cache:
+        return {'c': data["c"], 'nodes': data["nodes"], 'dist': dist, 'cache': None}
 
-    return distances
+    write_cache(path, data["nodes"], dist)
+    return load_cache(path)
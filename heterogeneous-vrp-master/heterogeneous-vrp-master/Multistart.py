@@ -0,0 +1,120 @@
+# Multi-start driver: several (randomized) constructions, each followed by the VND, run in parallel processes
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import Instancereader
+import Construction
+from Improvement import vnd, granular_neighbors
+from Fleet import Fleet
+from Assignment import assign_vehicles
+from Utils import total_cost, compute_distance
+from Evaluation import Evaluator
+
+
+CONSTRUCTIONS = {"idea_1": Construction.idea_1, "idea_2": Construction.idea_2, "idea_3": Construction.idea_3}
+
+# instance and parameters of the worker process, set once by init_worker
+_worker = dict()
+
+
+def init_worker(cache, models, availability, gas_price, neighbors, dont_look_bits, noise):
+    """
+    initializer of the worker processes. The instance is loaded from the binary cache with the distance matrices
+    memory-mapped read-only, so all the workers share the same pages instead of receiving a pickled copy.
+    """
+    data = Instancereader.load_cache(cache)
+    _worker["nodes"] = data["nodes"]
+    _worker["dist"] = data["dist"]
+    _worker["fleet"] = Fleet(models, availability)
+    _worker["gas_price"] = gas_price
+    _worker["evaluator"] = Evaluator(data["dist"], data["nodes"], _worker["fleet"], gas_price)
+    _worker["neighbors"] = granular_neighbors(data["dist"], neighbors) if neighbors else None
+    _worker["dont_look_bits"] = dont_look_bits
+    _worker["noise"] = noise
+
+
+def run_start(task):
+    """
+    one start: construction followed by the VND.
+    :param task: (index, construction name, seed); seed 0 is the deterministic construction, any other seed
+        randomizes the savings order (and the routes split by idea_2)
+    :return: dictionary with the routes and the statistics of the run
+    """
+    index, construction, seed = task
+    nodes = _worker["nodes"]
+    dist = _worker["dist"]
+
+    rng = np.random.default_rng(seed) if seed else None
+
+    start = time.perf_counter()
+    fleet = _worker["fleet"]
+    routes = CONSTRUCTIONS[construction](fleet, nodes, dist, rng=rng, noise=_worker["noise"] if seed else 0.0)
+    time_construction = time.perf_counter() - start
+    cost_construction = total_cost(routes, dist, nodes, fleet, _worker["gas_price"], evaluator=_worker["evaluator"])
+
+    start = time.perf_counter()
+    routes = vnd(routes, dist, nodes, fleet, _worker["neighbors"], _worker["dont_look_bits"],
+                 gas_price=_worker["gas_price"])
+    time_vnd = time.perf_counter() - start
+
+    # vehicle types chosen at minimum cost within the availability of the fleet
+    assignment = assign_vehicles(routes, dist, nodes, fleet, _worker["gas_price"])
+
+    return {"index": index, "construction": construction, "seed": seed, "routes": routes,
+            "types": assignment["types"], "cost": assignment["cost"], "feasible": assignment["feasible"],
+            "distance": sum(compute_distance(route, dist) for route in routes), "number of routes": len(routes),
+            "cost construction": cost_construction, "time construction": time_construction, "time vnd": time_vnd}
+
+
+def multistart(instance, models, availability, gas_price, constructions=("idea_1", "idea_2", "idea_3"), starts=8,
+               workers=None, neighbors=20, dont_look_bits=True, noise=0.1):
+    """
+    runs starts construction + VND runs for every construction heuristic in a pool of processes.
+    :param instance: workbook of the instance, its binary cache is created if needed and shared by the workers
+    :param models: list of vehicle types
+    :param availability: number of available vehicles of every type
+    :param gas_price: price of the fuel
+    :param constructions: names of the construction heuristics (keys of CONSTRUCTIONS)
+    :param starts: runs per construction, the first one deterministic and the others randomized
+    :param workers: number of processes, all the cores by default
+    :param neighbors: size of the candidate lists of the granular VND, None for the full neighborhoods
+    :param dont_look_bits: whether the VND uses don't-look bits
+    :param noise: relative perturbation of the savings in the randomized runs
+    :return: (best routes, list of the statistics of every run in task order). The best run is the cheapest one
+        among the runs whose routes can be covered by the fleet, if any
+    """
+    cache = Instancereader.read_instance(instance)["cache"]
+
+    tasks = list()
+    for construction in constructions:
+        for seed in range(starts):
+            tasks.append((len(tasks), construction, seed))
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                             initargs=(cache, models, availability, gas_price, neighbors, dont_look_bits,
+                                       noise)) as pool:
+        results = list(pool.map(run_start, tasks))
+
+    # ties are broken by task index, so the result does not depend on the scheduling of the processes
+    best = min(results, key=lambda result: (not result["feasible"], result["cost"], result["index"]))
+    return best["routes"], results
+
+
+if __name__ == "__main__":
+    gas_price = 0.63
+    t1 = {"model": "t1", "vol capacity": 34.80 * 1000, "max load": 2800, "consumption": 0.175}
+    t2 = {"model": "t2", "vol capacity": 5.80 * 1000, "max load": 883, "consumption": 0.08}
+
+    start = time.perf_counter()
+    routes, stats = multistart("NYC.xlsx", [t1, t2], [8, 12], gas_price)
+    elapsed = time.perf_counter() - start
+
+    for s in stats:
+        feasible = "" if s["feasible"] else " infeasible"
+        print(f"{s['construction']:<8} seed {s['seed']:<3} cost {s['cost construction']:8.2f} -> {s['cost']:8.2f}{feasible} "
+              f"routes {s['number of routes']:<3} construction {s['time construction']:.3f}s vnd {s['time vnd']:.3f}s")
+    best = next(s for s in stats if s["routes"] is routes)
+    print("\n best cost", best["cost"], "routes", routes)
+    print(f" {len(stats)} runs in {elapsed:.2f}s")
@@ -0,0 +1,92 @@
+# Array representation of a route with prefix sums of load, volume and distance
+import numpy as np
+
+
+"""
+A route [0, c_1, .., c_n, 0] is stored as an integer array of its nodes plus the prefix sums
+
+    kg[k], m3[k]: load and volume of route[0..k-1] (kg[0] = 0)
+    distance[k]: distance driven from route[0] to route[k]
+
+so the load, the volume and the distance of any segment route[i..j-1] are a difference of two entries, and a route
+obtained by chaining segments of other routes (the result of every move of the local search) is evaluated in O(1) per
+segment, without building it: see Route.segment.
+
+With a stack of arc matrices (one for every vehicle type, see Solution) the distance prefix sums are kept for every
+matrix, distance[k] being the ones driven with matrix k, so a segment moved to a route of another type is evaluated
+with the arcs of that type.
+
+With time windows the route also keeps the time summaries (see TimeWindows) of all its prefixes and suffixes, so the
+duration and the time warp of a chain of segments are evaluated in the same way (see Route.times).
+
+The arrays are built once per route in O(n) with numpy and never changed: a move creates new routes, the routes it
+does not touch keep their arrays.
+"""
+
+
+def demand_arrays(nodes):
+    """
+    :return: (demand_kg, demand_m3) numpy arrays indexed by node
+    """
+    demand_kg = np.array([nodes[i]["demand_kg"] for i in range(len(nodes))], dtype=float)
+    demand_m3 = np.array([nodes[i]["demand_m3"] for i in range(len(nodes))], dtype=float)
+    return demand_kg, demand_m3
+
+
+class Route:
+    """
+    nodes of a route and prefix sums of load, volume and distance. Behaves like a read-only sequence of nodes.
+    """
+
+    def __init__(self, route, d, demand_kg, demand_m3, time_windows=None):
+        """
+        :param route: sequence of nodes, starting and ending at the depot
+        :param d: distance matrix (e.g. dist.tot), or a stack of matrices, then distance[k] are the prefix sums with
+            matrix k
+        :param demand_kg: load of every node, see demand_arrays
+        :param demand_m3: volume of every node, see demand_arrays
+        :param time_windows: optional TimeWindows, the time summaries of the prefixes and suffixes are kept
+        """
+        self.nodes = np.asarray(route, dtype=int)
+        self.kg = np.concatenate(([0.0], np.cumsum(demand_kg[self.nodes])))
+        self.m3 = np.concatenate(([0.0], np.cumsum(demand_m3[self.nodes])))
+        arcs = d[..., self.nodes[:-1], self.nodes[1:]]
+        self.distance = np.concatenate((np.zeros(arcs.shape[:-1] + (1,)), np.cumsum(arcs, axis=-1)), axis=-1)
+
+        self.time_windows = time_windows
+        if time_windows is not None:
+            route = self.nodes.tolist()
+            self.forward = time_windows.prefixes(route)  # forward[k]: summary of route[0..k]
+            self.backward = time_windows.suffixes(route)  # backward[k]: summary of route[k..]
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __getitem__(self, k):
+        return self.nodes[k]
+
+    def __iter__(self):
+        return iter(self.nodes)
+
+    def tolist(self):
+        return self.nodes.tolist()
+
+    def segment(self, i, j):
+        """
+        :return: (kg, m3, distance) of the segment route[i..j-1], the distance is driven from route[i] to route[j-1]
+            (with every matrix of a stack)
+        """
+        return self.kg[j] - self.kg[i], self.m3[j] - self.m3[i], self.distance[..., j - 1] - self.distance[..., i]
+
+    def times(self, i, j, reverse=False):
+        """
+        :return: time summary of the segment route[i..j-1] (visited backwards if reverse), see TimeWindows. Prefixes
+            and suffixes take O(1), inner segments O(j - i)
+        """
+        if reverse:
+            return self.time_windows.sequence(self.nodes[i:j][::-1].tolist())
+        if i == 0:
+            return self.forward[j - 1]
+        if j == len(self.nodes):
+            return self.backward[i]
+        return self.time_windows.sequence(self.nodes[i:j].tolist())
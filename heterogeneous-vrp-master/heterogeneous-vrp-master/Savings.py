@@ -0,0 +1,243 @@
+# Savings computation and data structures shared by the savings based construction heuristics
+import heapq
+
+import numpy as np
+
+
+def nearest_customers(dist, customers, k, block=256):
+    """
+    k nearest customers of every customer, computed on blocks of rows so that no n x n matrix is built.
+    :param dist: DistanceMatrix
+    :param customers: array of customers
+    :param k: number of neighbours
+    :param block: number of rows of the distance matrix read at once
+    :return: n x k array, row a holds the positions in customers of the k nearest customers of customers[a], sorted
+    """
+    d = dist.tot
+    n = len(customers)
+    nearest = np.empty((n, k), dtype=int)
+    for start in range(0, n, block):
+        rows = np.arange(start, min(start + block, n))
+        # the customer itself is excluded by setting its distance to inf
+        c_ij = d[np.ix_(customers[rows], customers)]
+        c_ij[np.arange(len(rows)), rows] = np.inf
+        nearest[rows] = np.sort(np.argpartition(c_ij, k - 1, axis=1)[:, :k], axis=1)
+    return nearest
+
+
+def savings_pairs(dist, customers, k=None):
+    """
+    computes the savings s_ij = c_i0 + c_0j - c_ij of the candidate pairs of customers as one array operation.
+    :param dist: DistanceMatrix
+    :param customers: array of customers
+    :param k: if given, only the pairs (i, j) with j among the k nearest customers of i are computed, so time and
+        memory are O(n k) instead of O(n^2)
+    :return: (a, b, s): the saving of (customers[a[p]], customers[b[p]]) is s[p], the pairs are sorted by a and then b
+    """
+    d = dist.tot
+    n = len(customers)
+    if k is None or k >= n - 1:
+        a, b = np.nonzero(~np.eye(n, dtype=bool))
+    else:
+        a = np.repeat(np.arange(n), k)
+        b = nearest_customers(dist, customers, k).ravel()
+
+    i = customers[a]
+    j = customers[b]
+    return a, b, d[i, 0] + d[0, j] - d[i, j]
+
+
+def savings_keys(s, rng=None, noise=0.0):
+    """
+    :return: (key, tie) the savings are sorted by descending key and then by ascending tie: the saving itself and the
+        order of the pairs without rng, a perturbed saving and a random tie breaker with rng
+    """
+    if rng is None:
+        return s, np.arange(len(s))
+    key = s * (1 + noise * rng.uniform(-1, 1, len(s))) if noise else s
+    return key, rng.random(len(s))
+
+
+def compute_savings(dist, customers=None, k=None, rng=None, noise=0.0, lazy=False):
+    """
+    savings list of the Clark & Wright heuristic, sorted by descending saving. Ties keep the order of the pairs
+    (i ascending, then j ascending), as the former double loop followed by a stable sort did.
+    :param dist: DistanceMatrix
+    :param customers: customers to pair, all the customers by default
+    :param k: optional pruning, only the k nearest neighbours of every customer are paired with it. This reduces the
+        list from n*(n-1) to n*k pairs
+    :param rng: numpy random Generator. If given, ties are broken randomly
+    :param noise: with rng, every saving is multiplied by a random factor in [1 - noise, 1 + noise] before sorting,
+        to obtain different orders in a multi-start (the returned s_ij are not perturbed)
+    :param lazy: if True the savings are streamed by iter_savings instead of being returned as a list
+    :return: list (or iterator if lazy) of (i, j, s_ij)
+    """
+    if customers is None:
+        customers = range(1, dist.n)
+    customers = np.asarray(customers, dtype=int)
+    if lazy:
+        return iter_savings(dist, customers, k, rng, noise)
+
+    a, b, s = savings_pairs(dist, customers, k)
+    key, tie = savings_keys(s, rng, noise)
+    order = np.lexsort((tie, -key))
+
+    return list(zip(customers[a[order]].tolist(), customers[b[order]].tolist(), s[order].tolist()))
+
+
+def iter_savings(dist, customers=None, k=None, rng=None, noise=0.0):
+    """
+    lazy alternative to compute_savings: yields the same (i, j, s_ij) in the same order, merging the rows of the
+    savings with a heap. At first only the best pair of every row is found, in linear time, and a row is sorted when
+    its best pair is consumed, so a heuristic which stops early does not sort the rows it never reaches (the savings
+    of all the candidate pairs are still computed up front).
+    """
+    if customers is None:
+        customers = range(1, dist.n)
+    customers = np.asarray(customers, dtype=int)
+
+    a, b, s = savings_pairs(dist, customers, k)
+    if len(a) == 0:
+        return
+    key, tie = savings_keys(s, rng, noise)
+
+    # the pairs are grouped by row (see savings_pairs): first pair of every row
+    starts = np.flatnonzero(np.concatenate(([True], a[1:] != a[:-1])))
+    ends = np.append(starts[1:], len(a))
+    row = np.repeat(np.arange(len(starts)), ends - starts)
+
+    # best pair of every row: highest key, then lowest tie
+    top = np.flatnonzero(key == np.maximum.reduceat(key, starts)[row])
+    top = top[np.lexsort((tie[top], row[top]))]
+    best = top[np.concatenate(([True], row[top][1:] != row[top][:-1]))]
+
+    # heap entries: (-key, tie, row, rank of the pair in its row)
+    heap = [(-key[p], tie[p], r, 0) for r, p in enumerate(best.tolist())]
+    heapq.heapify(heap)
+    ranked = dict()  # row -> positions of its pairs sorted by descending key, once its best pair is consumed
+
+    while heap:
+        minus_key, t, r, rank = heapq.heappop(heap)
+        if rank == 0:
+            p = best[r]
+            ranked[r] = starts[r] + np.lexsort((tie[starts[r]:ends[r]], -key[starts[r]:ends[r]]))
+        else:
+            p = ranked[r][rank]
+        yield int(customers[a[p]]), int(customers[b[p]]), float(s[p])
+
+        if rank + 1 < len(ranked[r]):
+            q = ranked[r][rank + 1]
+            heapq.heappush(heap, (-key[q], tie[q], r, rank + 1))
+        else:
+            del ranked[r]
+
+
+class SavingsRoutes:
+    """
+    Set of routes built by the Clark & Wright savings heuristic.
+
+    Routes are stored as linked lists of customers (without the depot) and identified by an integer id, the position
+    of their first customer in the initial list. For each route the first and the last customer are indexed, so the
+    route ending with i and the route starting with j are found in O(1). The load and the volume of every route are
+    cached and a merge only links the two lists, therefore it also takes O(1).
+
+    With time windows the time summary of every route (see TimeWindows) is cached as well, so the time windows and
+    the duration limit of a merge are also checked in O(1).
+    """
+
+    def __init__(self, customers, nodes, time_windows=None):
+        """
+        creates one route for every customer
+        :param customers: customers to be routed
+        :param nodes: info about customers
+        :param time_windows: optional TimeWindows the merged routes have to respect
+        """
+        self.succ = dict()      # next customer in the route, None for the last customer
+        self.head = dict()      # route id -> first customer
+        self.tail = dict()      # route id -> last customer
+        self.starting = dict()  # first customer -> route id
+        self.ending = dict()    # last customer -> route id
+        self.kg = dict()        # route id -> load of the route
+        self.m3 = dict()        # route id -> volume of the route
+        self.times = dict()     # route id -> time summary of the customers of the route
+        self.time_windows = time_windows
+
+        for r, c in enumerate(customers):
+            self.succ[c] = None
+            self.head[r] = c
+            self.tail[r] = c
+            self.starting[c] = r
+            self.ending[c] = r
+            self.kg[r] = nodes[c]["demand_kg"]
+            self.m3[r] = nodes[c]["demand_m3"]
+            if time_windows is not None:
+                self.times[r] = time_windows.node(c)
+
+    def __len__(self):
+        return len(self.head)
+
+    def route_ending_with(self, i):
+        """
+        :return: id of the route with i at the end, -1 if there is none
+        """
+        return self.ending.get(i, -1)
+
+    def route_starting_with(self, j):
+        """
+        :return: id of the route with j in the beginning, -1 if there is none
+        """
+        return self.starting.get(j, -1)
+
+    def fits(self, r_i, r_j, capacity_kg, capacity_m3):
+        """
+        :return: True if the merge of r_i and r_j respects the given capacities (and the time windows)
+        """
+        if self.kg[r_i] + self.kg[r_j] > capacity_kg or self.m3[r_i] + self.m3[r_j] > capacity_m3:
+            return False
+        if self.time_windows is None:
+            return True
+        tw = self.time_windows
+        route = tw.concatenate(tw.concatenate(tw.node(0), self.times[r_i]), tw.concatenate(self.times[r_j], tw.node(0)))
+        return tw.feasible(route)
+
+    def merge(self, r_i, r_j):
+        """
+        appends route r_j at the end of route r_i. r_j does not exist anymore afterwards.
+        """
+        i = self.tail[r_i]
+        j = self.head.pop(r_j)
+        tail = self.tail.pop(r_j)
+
+        self.succ[i] = j
+        del self.ending[i]
+        del self.starting[j]
+        self.tail[r_i] = tail
+        self.ending[tail] = r_i
+
+        self.kg[r_i] += self.kg.pop(r_j)
+        self.m3[r_i] += self.m3.pop(r_j)
+        if self.time_windows is not None:
+            self.times[r_i] = self.time_windows.concatenate(self.times[r_i], self.times.pop(r_j))
+
+    def route(self, r):
+        """
+        :return: customers of route r in visiting order (without the depot)
+        """
+        route = list()
+        c = self.head[r]
+        while c is not None:
+            route.append(c)
+            c = self.succ[c]
+        return route
+
+    def ids(self):
+        """
+        :return: ids of the current routes, in the order of the initial list of customers
+        """
+        return sorted(self.head)
+
+    def routes(self):
+        """
+        :return: list of routes (without the depot), in the order of the initial list of customers
+        """
+        return [self.route(r) for r in self.ids()]
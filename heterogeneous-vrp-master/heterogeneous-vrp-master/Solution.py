@@ -0,0 +1,545 @@
+import numpy as np
+
+from Utils import calculate_kg_required, calculate_m3_required
+from Route import Route, demand_arrays
+
+
+class Solution:
+    """
+    Routes of a solution together with the load (kg), the volume (m3) and the distance of every route.
+
+    The aggregates are computed once and then updated in O(1) by the methods applying a move, using the change in
+    distance found while evaluating the move. The object behaves like the list of routes it wraps (len, iteration,
+    indexing), so neighborhoods can enumerate it as before; assigning a route directly recomputes its aggregates.
+
+    Optionally the solution keeps don't-look bits: for every neighborhood the set of active customers. A neighborhood
+    skips inactive customers and deactivates a customer once it has been scanned without finding an improvement.
+    Every applied move activates again, in all the neighborhoods, the customers at the ends of the arcs it changed,
+    so later passes only look at the surroundings of recent changes.
+
+    The routes are lists, which the moves replace instead of changing them. route(r) gives the array representation of
+    route r with its prefix sums (see Route), built at the first access after the route was replaced, and the moves
+    take the load and volume of the segments they transfer from it in O(1).
+
+    With time windows, time_feasible checks the routes a move would build from the time summaries of the prefixes and
+    suffixes of the current routes (see TimeWindows), before the move is applied.
+
+    The length of the arcs is d, the "tot" distance by default. With an arc cost matrix the distance of the routes
+    and the changes evaluated by the neighborhoods are costs, so the local search minimizes the cost.
+
+    With a gas price the vehicle types are priced as well: a route driven by type t costs factor[t] * distance, with
+    factor = consumption * gas_price, i.e. the arc cost matrix of type t is d scaled by factor[t], and t is the smallest
+    type the route fits in. The neighborhoods still evaluate the change in distance of a move with one lookup per
+    arc, cost_change turns it into the change in cost, including the moves after which a route needs another type.
+
+    With a cost model (see CostModel) the arcs of a route driven by type t are priced by the matrix of type t, which
+    is not a multiple of a common matrix. The arc lengths are then a stack of matrices, one for every type: matrices[k]
+    with k = arc_type(kg, m3) for a route with load (kg, m3), while without a cost model the stack only holds d and k is
+    always 0. A move is evaluated with the matrix of the type every route has after the move, distance is the length of
+    every route with the matrix of its own type, and cost_change adds the change of matrix of the routes which change
+    type. The moves recompute the lengths of the routes they change with all the matrices.
+    """
+
+    def __init__(self, routes, dist, nodes, fleet, dont_look_bits=False, time_windows=None, arc_cost=None,
+                 gas_price=None, cost_model=None):
+        """
+        :param routes: list of routes, every route starts and ends at the depot
+        :param dist: distance between nodes
+        :param nodes: info about customers
+        :param fleet: Fleet, every route is assigned to the smallest vehicle type it fits in
+        :param dont_look_bits: if True the active customers of every neighborhood are tracked
+        :param time_windows: optional TimeWindows the routes built by the moves have to respect
+        :param arc_cost: n x n matrix used as length of the arcs instead of dist.tot, the same for all the vehicle
+            types. Raises ValueError together with gas_price or cost_model, which price the types
+        :param gas_price: if given, the moves are evaluated by fuel cost of the vehicle type of every route
+        :param cost_model: optional CostModel, the moves are evaluated by the arc costs of the vehicle type of every
+            route. Replaces the fuel cost, gas_price is ignored
+        """
+        if arc_cost is not None and (gas_price is not None or cost_model is not None):
+            raise ValueError("arc_cost is a single matrix for all the vehicle types, it cannot be priced by gas_price "
+                             "or cost_model: use cost_model alone for costs which depend on the type")
+        if cost_model is not None:
+            gas_price = None
+
+        self.dist = dist
+        self.d = dist.tot if arc_cost is None else arc_cost
+        self.nodes = nodes
+        self.fleet = fleet
+        self.factor = None if gas_price is None else fleet.consumption * gas_price
+        self.factors = None if gas_price is None else self.factor.tolist()
+        self.cost_model = cost_model
+        self.matrices = self.d[None] if cost_model is None else cost_model.matrices  # arc lengths, see arc_type
+        self.typed = gas_price is not None or cost_model is not None  # the vehicle types are priced
+        self.types = dict()  # route id -> (kg, m3, factor, lower kg, lower m3, capacity kg, capacity m3) of its type
+        self.routes = [list(route) for route in routes]
+        self.kg = [calculate_kg_required(route, nodes) for route in self.routes]
+        self.m3 = [calculate_m3_required(route, nodes) for route in self.routes]
+        self.distance = [self.length(route) for route in self.routes]
+        self.lengths = None  # with a cost model, route id -> length of the route with every matrix
+        if cost_model is not None:
+            self.lengths = [None] * len(self.routes)
+            self.measure(*range(len(self.routes)))
+        self.demand_kg, self.demand_m3 = demand_arrays(nodes)
+        self.arrays = dict()  # route id -> (route list, Route built on it)
+        self.time_windows = time_windows
+        self.dont_look_bits = dont_look_bits
+        self.active = dict()  # neighborhood -> set of active customers, created at the first access
+
+    def __len__(self):
+        return len(self.routes)
+
+    def __iter__(self):
+        return iter(self.routes)
+
+    def __getitem__(self, r_id):
+        return self.routes[r_id]
+
+    def __setitem__(self, r_id, route):
+        self.activate(self.routes[r_id] + route)
+        self.routes[r_id] = route
+        self.kg[r_id] = calculate_kg_required(route, self.nodes)
+        self.m3[r_id] = calculate_m3_required(route, self.nodes)
+        self.distance[r_id] = self.length(route)
+        self.measure(r_id)
+
+    def total_distance(self):
+        return sum(self.distance)
+
+    def total_cost(self):
+        """
+        :return: cost of the routes, each one driven by the smallest vehicle type it fits in. The total distance
+            without gas price and cost model
+        """
+        if self.factor is None:
+            # with a cost model the distance of every route is its cost
+            return self.total_distance()
+        return sum(self.factor[self.fleet.route_type(self.kg[r_id], self.m3[r_id])] * self.distance[r_id]
+                   for r_id in range(len(self)))
+
+    def vehicle_type(self, r_id):
+        """
+        :return: (kg, m3, factor, lower kg, lower m3, capacity kg, capacity m3) of the vehicle type of route r: its
+            load, the cost of a unit of distance, the bounds of the loads of the type (see Fleet.lower_bounds) and its
+            capacity. Cached until the load of the route changes
+        """
+        kg = self.kg[r_id]
+        m3 = self.m3[r_id]
+        cached = self.types.get(r_id)
+        if cached is None or cached[0] != kg or cached[1] != m3:
+            t = self.fleet.route_type(kg, m3)
+            cached = (kg, m3, self.factors[t]) + self.fleet.lower_bounds(t) + self.fleet.capacity(t)
+            self.types[r_id] = cached
+        return cached
+
+    def unit_cost(self, r_id):
+        """
+        :return: cost of a unit of distance in route r, 1 without gas price (with a cost model the distance is
+            already a cost)
+        """
+        if self.factor is None:
+            return 1.0
+        return self.vehicle_type(r_id)[2]
+
+    def cost_change(self, r_id, change, kg, m3):
+        """
+        change in cost of route r when a move changes its distance by change and its load to (kg, m3):
+            factor[t'] * (distance + change) - factor[t] * distance
+        with t the vehicle type of the route and t' the one of the new route. With a cost model change is evaluated
+        with the matrix of t' (see arc_type), and the route is charged with the difference between its lengths with
+        the matrices of t' and t. Arrays of moves are evaluated at once (r_id, change, kg and m3 are broadcast
+        together).
+        :return: change in cost, the change in distance itself without gas price and cost model
+        """
+        if self.cost_model is not None:
+            k = self.arc_type(kg, m3)
+            if not isinstance(r_id, np.ndarray) and not isinstance(k, np.ndarray):
+                return change + self.lengths[r_id][k] - self.distance[r_id]
+            return change + np.asarray(self.lengths)[r_id, k] - np.asarray(self.distance)[r_id]
+        if self.factor is None:
+            return change
+        if not isinstance(r_id, np.ndarray) and not isinstance(kg, np.ndarray):
+            _, _, current, lower_kg, lower_m3, capacity_kg, capacity_m3 = self.vehicle_type(r_id)
+            if (kg > lower_kg or m3 > lower_m3) and kg <= capacity_kg and m3 <= capacity_m3:
+                # the new route keeps the type
+                return current * change
+            new = self.factors[self.fleet.route_type(kg, m3)]
+            return new * change + (new - current) * self.distance[r_id]
+
+        if not isinstance(r_id, np.ndarray):
+            # moves of one route: only the ones which change its type are looked up
+            _, _, current, lower_kg, lower_m3, capacity_kg, capacity_m3 = self.vehicle_type(r_id)
+            same = ((kg > lower_kg) | (m3 > lower_m3)) & (kg <= capacity_kg) & (m3 <= capacity_m3)
+            if np.all(same):
+                return current * change
+            distance = self.distance[r_id]
+        else:
+            current = self.factor[self.route_types(np.asarray(self.kg)[r_id], np.asarray(self.m3)[r_id])]
+            distance = np.asarray(self.distance)[r_id]
+
+        new = self.factor[self.route_types(kg, m3)]
+        return new * change + (new - current) * distance
+
+    def length(self, route):
+        """
+        :return: length of a route with the arc lengths d
+        """
+        if len(route) < 2:
+            return 0.0
+        r = np.asarray(route)
+        return float(self.d[r[:-1], r[1:]].sum())
+
+    def arc_type(self, kg, m3):
+        """
+        :return: index in matrices of the arc lengths of a route with load (kg, m3): with a cost model its vehicle
+            type (the largest one if it fits none), 0 otherwise. Arrays of loads are evaluated at once
+        """
+        if self.cost_model is None:
+            return 0
+        if isinstance(kg, np.ndarray) or isinstance(m3, np.ndarray):
+            return self.route_types(kg, m3)
+        return self.fleet.route_type(kg, m3)
+
+    def route_types(self, kg, m3):
+        """
+        :return: vehicle type of routes with loads (kg, m3) (arrays), the largest type for the ones which fit none as
+            in Fleet.route_type
+        """
+        types = self.fleet.route_types(kg, m3)
+        return np.where(types == -1, self.fleet.largest_type(), types)
+
+    def arc_matrix(self, kg, m3):
+        """
+        :return: matrix of the arc lengths of a route with load (kg, m3), d itself without a cost model
+        """
+        if self.cost_model is None:
+            return self.d
+        return self.matrices[self.fleet.route_type(kg, m3)]
+
+    def arc_lengths(self, k, a, b):
+        """
+        :return: lengths of the arcs (a, b) with the matrices k (see arc_type), broadcast together
+        """
+        if np.ndim(k) == 0:
+            return self.matrices[k][a, b]
+        return self.matrices[k, a, b]
+
+    def measure(self, *r_ids):
+        """
+        with a cost model, computes the lengths of the routes with all the matrices and their distance with the matrix
+        of their type
+        """
+        if self.cost_model is None:
+            return
+        for r_id in r_ids:
+            r = np.asarray(self.routes[r_id])
+            self.lengths[r_id] = self.matrices[:, r[:-1], r[1:]].sum(axis=1)
+            self.distance[r_id] = float(self.lengths[r_id][self.arc_type(self.kg[r_id], self.m3[r_id])])
+
+    def route(self, r_id):
+        """
+        :return: Route of route r, with the prefix sums of load, volume and distance (with every matrix)
+        """
+        route, arrays = self.arrays.get(r_id, (None, None))
+        if route is not self.routes[r_id]:
+            arrays = Route(self.routes[r_id], self.matrices, self.demand_kg, self.demand_m3, self.time_windows)
+            self.arrays[r_id] = (self.routes[r_id], arrays)
+        return arrays
+
+    def time_feasible(self, *pieces):
+        """
+        checks the time windows and the duration limit of a route built from pieces of the current routes.
+        Example: relocate of route1[i] in front of route2[j]
+            time_feasible((r2, 0, j), (r1, i, i + 1), (r2, j, len(route2)))
+        :param pieces: (r_id, i, j) for route[i..j-1], or (r_id, i, j, True) for route[i..j-1] visited backwards.
+            Empty pieces are skipped
+        :return: True if the route is feasible, always True without time windows
+        """
+        if self.time_windows is None:
+            return True
+        summary = None
+        for piece in pieces:
+            r_id, i, j = piece[:3]
+            if i == j:
+                continue
+            times = self.route(r_id).times(i, j, reverse=len(piece) > 3 and piece[3])
+            summary = times if summary is None else self.time_windows.concatenate(summary, times)
+        return self.time_windows.feasible(summary)
+
+    def relocate_time_feasible(self, r1_id, i, r2_id, j):
+        """
+        :return: True if the relocate move (see relocate) respects the time windows
+        """
+        if self.time_windows is None:
+            return True
+        length1 = len(self.routes[r1_id])
+        length2 = len(self.routes[r2_id])
+        return self.time_feasible((r1_id, 0, i), (r1_id, i + 1, length1)) and \
+            self.time_feasible((r2_id, 0, j), (r1_id, i, i + 1), (r2_id, j, length2))
+
+    def exchange_time_feasible(self, r1_id, i, r2_id, j):
+        """
+        :return: True if the exchange move (see exchange) respects the time windows
+        """
+        return self.exchange_segments_time_feasible(r1_id, i, 1, r2_id, j, 1)
+
+    def reverse_time_feasible(self, r_id, i, j):
+        """
+        :return: True if the 2-opt move (see reverse) respects the time windows. The reversed segment is evaluated in
+            O(j - i)
+        """
+        if self.time_windows is None:
+            return True
+        return self.time_feasible((r_id, 0, i), (r_id, i, j + 1, True), (r_id, j + 1, len(self.routes[r_id])))
+
+    def swap_tails_time_feasible(self, r1_id, i, r2_id, j):
+        """
+        :return: True if the 2-opt* move (see swap_tails) respects the time windows
+        """
+        if self.time_windows is None:
+            return True
+        length1 = len(self.routes[r1_id])
+        length2 = len(self.routes[r2_id])
+        return self.time_feasible((r1_id, 0, i + 1), (r2_id, j, length2)) and \
+            self.time_feasible((r2_id, 0, j), (r1_id, i + 1, length1))
+
+    def move_segment_time_feasible(self, r1_id, i, k, r2_id, j):
+        """
+        :return: True if the Or-opt move (see move_segment) respects the time windows
+        """
+        if self.time_windows is None:
+            return True
+        length1 = len(self.routes[r1_id])
+        segment = (r1_id, i, i + k)
+        if r1_id == r2_id and j <= i:
+            return self.time_feasible((r1_id, 0, j), segment, (r1_id, j, i), (r1_id, i + k, length1))
+        if r1_id == r2_id:
+            return self.time_feasible((r1_id, 0, i), (r1_id, i + k, j), segment, (r1_id, j, length1))
+        return self.time_feasible((r1_id, 0, i), (r1_id, i + k, length1)) and \
+            self.time_feasible((r2_id, 0, j), segment, (r2_id, j, len(self.routes[r2_id])))
+
+    def exchange_segments_time_feasible(self, r1_id, i, k1, r2_id, j, k2):
+        """
+        :return: True if the CROSS-exchange move (see exchange_segments) respects the time windows
+        """
+        if self.time_windows is None:
+            return True
+        length1 = len(self.routes[r1_id])
+        length2 = len(self.routes[r2_id])
+        return self.time_feasible((r1_id, 0, i), (r2_id, j, j + k2), (r1_id, i + k1, length1)) and \
+            self.time_feasible((r2_id, 0, j), (r1_id, i, i + k1), (r2_id, j + k2, length2))
+
+    def capacity(self, r_id):
+        """
+        :return: (capacity kg, capacity m3) of the vehicle type route r is assigned to
+        """
+        return self.fleet.route_capacity(self.kg[r_id], self.m3[r_id])
+
+    def is_active(self, neighborhood, u):
+        """
+        :return: False if customer u does not need to be scanned in the neighborhood (its don't-look bit is set)
+        """
+        if not self.dont_look_bits:
+            return True
+        if neighborhood not in self.active:
+            self.active[neighborhood] = {c for route in self.routes for c in route if c != 0}
+        return u in self.active[neighborhood]
+
+    def deactivate(self, neighborhood, u):
+        """
+        sets the don't-look bit of customer u in the neighborhood, after it was scanned without improvement
+        """
+        if self.dont_look_bits and neighborhood in self.active:
+            self.active[neighborhood].discard(u)
+
+    def activate(self, customers):
+        """
+        clears the don't-look bits of the customers (the depot is ignored) in all the neighborhoods
+        """
+        for active in self.active.values():
+            active.update(c for c in customers if c != 0)
+
+    def relocate(self, r1_id, i, r2_id, j, change_in_r1, change_in_r2):
+        """
+        moves the customer at position i of route r1 in front of position j of route r2
+        """
+        route1 = self.routes[r1_id]
+        route2 = self.routes[r2_id]
+        u = route1[i]
+        self.activate((route1[i - 1], u, route1[i + 1], route2[j - 1], route2[j]))
+
+        self.routes[r1_id] = route1[:i] + route1[i + 1:]
+        self.routes[r2_id] = route2[:j] + [u] + route2[j:]
+
+        self.kg[r1_id] -= self.nodes[u]["demand_kg"]
+        self.m3[r1_id] -= self.nodes[u]["demand_m3"]
+        self.kg[r2_id] += self.nodes[u]["demand_kg"]
+        self.m3[r2_id] += self.nodes[u]["demand_m3"]
+        self.distance[r1_id] += change_in_r1
+        self.distance[r2_id] += change_in_r2
+        self.measure(r1_id, r2_id)
+
+    def exchange(self, r1_id, i, r2_id, j, change_in_r1, change_in_r2):
+        """
+        swaps the customer at position i of route r1 with the customer at position j of route r2
+        """
+        route1 = self.routes[r1_id]
+        route2 = self.routes[r2_id]
+        u = route1[i]
+        v = route2[j]
+        self.activate((route1[i - 1], u, route1[i + 1], route2[j - 1], v, route2[j + 1]))
+
+        self.routes[r1_id] = route1[:i] + [v] + route1[i + 1:]
+        self.routes[r2_id] = route2[:j] + [u] + route2[j + 1:]
+
+        kg = self.nodes[v]["demand_kg"] - self.nodes[u]["demand_kg"]
+        m3 = self.nodes[v]["demand_m3"] - self.nodes[u]["demand_m3"]
+        self.kg[r1_id] += kg
+        self.m3[r1_id] += m3
+        self.kg[r2_id] -= kg
+        self.m3[r2_id] -= m3
+        self.distance[r1_id] += change_in_r1
+        self.distance[r2_id] += change_in_r2
+        self.measure(r1_id, r2_id)
+
+    def reverse(self, r_id, i, j, change):
+        """
+        reverses the customers at positions i..j of route r (2-opt move)
+        """
+        route = self.routes[r_id]
+        self.activate((route[i - 1], route[i], route[j], route[j + 1]))
+        self.routes[r_id] = route[:i] + list(reversed(route[i:j + 1])) + route[j + 1:]
+        self.distance[r_id] += change
+        self.measure(r_id)
+
+    def swap_tails(self, r1_id, i, r2_id, j, change_in_r1, change_in_r2):
+        """
+        2-opt* move: route r1 keeps its customers up to position i and continues with the customers of route r2 from
+        position j, route r2 keeps its customers before position j and continues with the rest of route r1
+        """
+        route1 = self.routes[r1_id]
+        route2 = self.routes[r2_id]
+        kg1, m31, _ = self.route(r1_id).segment(i + 1, len(route1))
+        kg2, m32, _ = self.route(r2_id).segment(j, len(route2))
+        kg = kg2 - kg1
+        m3 = m32 - m31
+        self.activate((route1[i], route1[i + 1], route2[j - 1], route2[j]))
+
+        self.routes[r1_id] = route1[:i + 1] + route2[j:]
+        self.routes[r2_id] = route2[:j] + route1[i + 1:]
+
+        self.kg[r1_id] += kg
+        self.m3[r1_id] += m3
+        self.kg[r2_id] -= kg
+        self.m3[r2_id] -= m3
+        self.distance[r1_id] += change_in_r1
+        self.distance[r2_id] += change_in_r2
+        self.measure(r1_id, r2_id)
+
+    def move_segment(self, r1_id, i, k, r2_id, j, change_in_r1, change_in_r2):
+        """
+        Or-opt move: moves the k customers from position i of route r1 in front of position j of route r2. Positions
+        refer to the routes before the move, for r1 == r2 position j is outside the segment and the change in
+        distance of the route is change_in_r1 + change_in_r2
+        """
+        route1 = self.routes[r1_id]
+        segment = route1[i:i + k]
+        self.activate((route1[i - 1], segment[0], segment[-1], route1[i + k], self.routes[r2_id][j - 1],
+                       self.routes[r2_id][j]))
+
+        if r1_id == r2_id:
+            rest = route1[:i] + route1[i + k:]
+            j = j - k if j > i else j
+            self.routes[r1_id] = rest[:j] + segment + rest[j:]
+            self.distance[r1_id] += change_in_r1 + change_in_r2
+            self.measure(r1_id)
+            return
+
+        route2 = self.routes[r2_id]
+        kg, m3, _ = self.route(r1_id).segment(i, i + k)
+        self.routes[r1_id] = route1[:i] + route1[i + k:]
+        self.routes[r2_id] = route2[:j] + segment + route2[j:]
+
+        self.kg[r1_id] -= kg
+        self.m3[r1_id] -= m3
+        self.kg[r2_id] += kg
+        self.m3[r2_id] += m3
+        self.distance[r1_id] += change_in_r1
+        self.distance[r2_id] += change_in_r2
+        self.measure(r1_id, r2_id)
+
+    def exchange_segments(self, r1_id, i, k1, r2_id, j, k2, change_in_r1, change_in_r2):
+        """
+        CROSS-exchange move: swaps the k1 customers from position i of route r1 with the k2 customers from position j
+        of route r2
+        """
+        route1 = self.routes[r1_id]
+        route2 = self.routes[r2_id]
+        segment1 = route1[i:i + k1]
+        segment2 = route2[j:j + k2]
+        kg1, m31, _ = self.route(r1_id).segment(i, i + k1)
+        kg2, m32, _ = self.route(r2_id).segment(j, j + k2)
+        kg = kg2 - kg1
+        m3 = m32 - m31
+        self.activate((route1[i - 1], segment1[0], segment1[-1], route1[i + k1],
+                       route2[j - 1], segment2[0], segment2[-1], route2[j + k2]))
+
+        self.routes[r1_id] = route1[:i] + segment2 + route1[i + k1:]
+        self.routes[r2_id] = route2[:j] + segment1 + route2[j + k2:]
+
+        self.kg[r1_id] += kg
+        self.m3[r1_id] += m3
+        self.kg[r2_id] -= kg
+        self.m3[r2_id] -= m3
+        self.distance[r1_id] += change_in_r1
+        self.distance[r2_id] += change_in_r2
+        self.measure(r1_id, r2_id)
+
+    def insert(self, r_id, j, u, change):
+        """
+        inserts customer u in front of position j of route r, change is the change in distance (with the matrix of
+        the new type of the route, see cost_change)
+        """
+        route = self.routes[r_id]
+        self.activate((route[j - 1], u, route[j]))
+        self.routes[r_id] = route[:j] + [u] + route[j:]
+        self.kg[r_id] += self.nodes[u]["demand_kg"]
+        self.m3[r_id] += self.nodes[u]["demand_m3"]
+        self.distance[r_id] += change
+        self.measure(r_id)
+
+    def remove(self, r_id, i, change):
+        """
+        removes the customer at position i of route r, change is the change in distance (with the matrix of the new
+        type of the route, see cost_change)
+        """
+        route = self.routes[r_id]
+        u = route[i]
+        self.activate((route[i - 1], route[i + 1]))
+        self.routes[r_id] = route[:i] + route[i + 1:]
+        self.kg[r_id] -= self.nodes[u]["demand_kg"]
+        self.m3[r_id] -= self.nodes[u]["demand_m3"]
+        self.distance[r_id] += change
+        self.measure(r_id)
+
+    def add_route(self):
+        """
+        appends an empty route [0, 0]
+        :return: id of the new route
+        """
+        self.routes.append([0, 0])
+        self.kg.append(0)
+        self.m3.append(0)
+        self.distance.append(0.0)
+        if self.lengths is not None:
+            self.lengths.append(np.zeros(len(self.matrices)))
+        return len(self.routes) - 1
+
+    def positions(self):
+        """
+        :return: dictionary customer -> (route id, position in the route)
+        """
+        position = dict()
+        for r_id, route in enumerate(self.routes):
+            for i in range(1, len(route) - 1):
+                position[route[i]] = (r_id, i)
+        return position
@@ -0,0 +1,162 @@
+# Split procedure (Prins, 2004): optimal partition of a giga-tour into routes for a heterogeneous, limited fleet
+import numpy as np
+
+
+"""
+The giga-tour visits all the customers without returning to the depot. A split cuts it into consecutive segments,
+each one served by a route 0 -> segment -> 0 with a vehicle able to carry it, at a fuel cost of
+distance * consumption (the gas price is a common factor and is left out). With a cost model (see CostModel) a route
+served by type t costs its length with the arc costs of type t instead, from prefix sums of the tour for every type.
+
+The best split is a shortest path on the auxiliary graph where node i is "the first i customers are served" and the
+arc (i, j) is the route serving customers i+1..j. Its length is bounded by the largest capacity, so with prefix sums
+of the distance and of the demand every node has at most B outgoing arcs, evaluated at once: O(n B) overall.
+
+With time windows (see TimeWindows) the routes starting after customer i are extended one customer at a time by
+concatenation of time summaries, and the arcs (i, j) of the routes which violate the time windows or the duration
+limit are left out.
+
+With a limited fleet the label of node i is the vector of the cheapest cost for every combination of used vehicles,
+(availability[0] + 1) x (availability[1] + 1) x ... values, and an arc served by type t shifts the vector by one along
+axis t. The labels of all the successors of i are updated by one array operation per vehicle type.
+"""
+
+
+def tour_prefix_sums(tour, dist, nodes):
+    """
+    :param tour: giga-tour, list of customers without the depot
+    :return: (kg, m3, distance) prefix sums, e.g. kg[j] - kg[i] is the load of customers i+1..j and
+        distance[j] - distance[i + 1] the distance driven from customer i+1 to customer j
+    """
+    demand_kg = np.array([nodes[c]["demand_kg"] for c in tour], dtype=float)
+    demand_m3 = np.array([nodes[c]["demand_m3"] for c in tour], dtype=float)
+    kg = np.concatenate(([0.0], np.cumsum(demand_kg)))
+    m3 = np.concatenate(([0.0], np.cumsum(demand_m3)))
+    return kg, m3, tour_distances(tour, dist.tot)
+
+
+def tour_distances(tour, d):
+    """
+    :param d: length of the arcs, e.g. dist.tot
+    :return: distance prefix sums, distance[j] - distance[i + 1] is the distance driven from customer i+1 to customer j
+    """
+    t = np.asarray(tour, dtype=int)
+    return np.concatenate(([0.0, 0.0], np.cumsum(d[t[:-1], t[1:]])))
+
+
+def segment_distances(tour, d, distance, i, j_max):
+    """
+    :param d: length of the arcs, distance are the prefix sums of the tour with it (see tour_distances)
+    :return: distance of the routes serving customers i+1..j, for j = i+1..j_max
+    """
+    t = np.asarray(tour[i:j_max], dtype=int)
+    return d[0, tour[i]] + distance[i + 1:j_max + 1] - distance[i + 1] + d[t, 0]
+
+
+def segment_time_feasibility(tour, time_windows, i, j_max):
+    """
+    :return: boolean array, True where the route serving customers i+1..j respects the time windows, for j = i+1..j_max
+    """
+    feasible = np.zeros(j_max - i, dtype=bool)
+    depot = time_windows.node(0)
+    summary = depot
+    for k, c in enumerate(tour[i:j_max]):
+        summary = time_windows.concatenate(summary, time_windows.node(c))
+        if not time_windows.feasible(summary):
+            # time warp and duration never decrease when a customer is added
+            break
+        feasible[k] = time_windows.feasible(time_windows.concatenate(summary, depot))
+    return feasible
+
+
+def split(tour, dist, nodes, fleet, limited=True, time_windows=None, cost_model=None):
+    """
+    optimal split of a giga-tour.
+    :param tour: giga-tour, list of customers without the depot
+    :param dist: distance between nodes
+    :param nodes: info about customers
+    :param fleet: Fleet
+    :param limited: if True at most fleet.availability[t] routes use type t, otherwise the fleet is unlimited and
+        every route uses its cheapest vehicle type
+    :param time_windows: optional TimeWindows the routes have to respect
+    :param cost_model: optional CostModel, the routes cost their arc costs of their vehicle type instead of the fuel
+    :return: (routes, vehicle type of every route, fuel consumption (cost with a cost model)), None if the tour cannot
+        be split within the availability of the fleet (or a customer fits in no vehicle or cannot be served within its
+        time window)
+    """
+    n = len(tour)
+    kg, m3, distance = tour_prefix_sums(tour, dist, nodes)
+    n_types = len(fleet)
+    if cost_model is not None:
+        distances = [tour_distances(tour, cost_model.matrix(t)) for t in range(n_types)]
+
+    # labels: one value for every combination of used vehicles, a single value if the fleet is unlimited
+    shape = tuple(int(a) + 1 for a in fleet.availability) if limited else ()
+    label = np.full((n + 1,) + shape, np.inf)
+    label[(0,) + (0,) * len(shape)] = 0
+    pred = np.full((n + 1,) + shape, -1)
+    pred_type = np.full((n + 1,) + shape, -1)
+
+    max_kg = fleet.capacity_kg.max()
+    max_m3 = fleet.capacity_m3.max()
+
+    for i in range(n):
+        if np.isinf(label[i]).all():
+            continue
+
+        # successors j of i, limited by the largest vehicle
+        j_max = min(np.searchsorted(kg, kg[i] + max_kg, side="right"),
+                    np.searchsorted(m3, m3[i] + max_m3, side="right")) - 1
+        if j_max <= i:
+            continue
+        route_distance = segment_distances(tour, dist.tot, distance, i, j_max)
+        load_kg = kg[i + 1:j_max + 1] - kg[i]
+        load_m3 = m3[i + 1:j_max + 1] - m3[i]
+        fits_time = True if time_windows is None else segment_time_feasibility(tour, time_windows, i, j_max)
+
+        for t in range(n_types):
+            fits = (load_kg <= fleet.capacity_kg[t]) & (load_m3 <= fleet.capacity_m3[t]) & fits_time
+            if not fits.any():
+                continue
+            if cost_model is None:
+                cost = np.where(fits, route_distance * fleet.consumption[t], np.inf)
+            else:
+                cost = np.where(fits, segment_distances(tour, cost_model.matrix(t), distances[t], i, j_max), np.inf)
+
+            if limited:
+                # one more vehicle of type t: shift the labels of i by one along axis t
+                shifted = np.full(shape, np.inf)
+                source = [slice(None)] * len(shape)
+                target = [slice(None)] * len(shape)
+                source[t] = slice(None, -1)
+                target[t] = slice(1, None)
+                shifted[tuple(target)] = label[i][tuple(source)]
+            else:
+                shifted = label[i]
+
+            candidate = shifted[None, ...] + cost.reshape((-1,) + (1,) * len(shape))
+            successors = label[i + 1:j_max + 1]
+            better = candidate < successors - 1e-9
+            label[i + 1:j_max + 1] = np.where(better, candidate, successors)
+            pred[i + 1:j_max + 1] = np.where(better, i, pred[i + 1:j_max + 1])
+            pred_type[i + 1:j_max + 1] = np.where(better, t, pred_type[i + 1:j_max + 1])
+
+    if np.isinf(label[n]).all():
+        return None
+
+    # backtracking from the cheapest label of the last node
+    state = np.unravel_index(np.argmin(label[n]), shape) if limited else ()
+    consumption = float(label[n][state])
+    routes = list()
+    types = list()
+    j = n
+    while j > 0:
+        i = int(pred[(j,) + tuple(state)])
+        t = int(pred_type[(j,) + tuple(state)])
+        routes.append([0] + list(tour[i:j]) + [0])
+        types.append(t)
+        if limited:
+            state = tuple(s - 1 if axis == t else s for axis, s in enumerate(state))
+        j = i
+
+    return routes[::-1], types[::-1], consumption
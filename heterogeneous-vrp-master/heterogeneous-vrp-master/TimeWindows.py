@@ -0,0 +1,110 @@
+# Time windows and route duration limits, evaluated by concatenation of segment summaries (Vidal et al., 2013)
+import numpy as np
+
+
+"""
+Every node has a service time (the "duration" of the Locations sheet) and a time window [earliest, latest] for the
+start of the service, every arc a travel time (the "duration" of the Routes sheet), all in seconds. A vehicle arriving
+before the window waits, a vehicle arriving after it is allowed to "travel back in time" to the latest start: the time
+warp it needs measures the violation, and a route is feasible when it has no time warp and its duration (travel,
+service and waiting) does not exceed the limit.
+
+A segment of consecutive nodes is summarized by
+
+    (first node, last node, duration, time warp, earliest start, latest start)
+
+where earliest/latest start bound the start of the service at the first node for which the segment has the minimum
+duration and time warp. The summary of two chained segments only depends on their summaries and on the travel time
+between them (see concatenate), so with the summaries of every prefix and suffix of a route (see Route) the feasibility
+of a route built by a move, i.e. a prefix, at most a few moved nodes and a suffix, is checked in O(1).
+"""
+
+
+class TimeWindows:
+    """
+    service times, time windows and travel times of an instance, and the route duration limit
+    """
+
+    def __init__(self, nodes, dist, windows=None, max_duration=np.inf):
+        """
+        :param nodes: info about customers, the service time is nodes[i]["duration"]
+        :param dist: distance between nodes, the travel time is dist.duration
+        :param windows: dictionary node -> (earliest, latest) start of the service in seconds, nodes without entry have
+            no window. The window of the depot bounds the departure and the return of every route
+        :param max_duration: maximum duration of a route in seconds
+        """
+        self.travel = dist.duration
+        self.service = np.array([nodes[i]["duration"] for i in range(len(nodes))], dtype=float)
+        self.earliest = np.zeros(len(nodes))
+        self.latest = np.full(len(nodes), np.inf)
+        for i, (earliest, latest) in (windows or dict()).items():
+            if earliest > latest:
+                raise ValueError(f"empty time window of node {i}: [{earliest}, {latest}]")
+            self.earliest[i] = earliest
+            self.latest[i] = latest
+        self.max_duration = max_duration
+
+    def node(self, i):
+        """
+        :return: summary of the segment made of node i
+        """
+        return i, i, self.service[i], 0.0, self.earliest[i], self.latest[i]
+
+    def concatenate(self, a, b):
+        """
+        :return: summary of segment a followed by segment b
+        """
+        first_a, last_a, duration_a, warp_a, earliest_a, latest_a = a
+        first_b, last_b, duration_b, warp_b, earliest_b, latest_b = b
+
+        delta = duration_a - warp_a + self.travel[last_a, first_b]
+        waiting = max(earliest_b - delta - latest_a, 0.0)
+        warp = max(earliest_a + delta - latest_b, 0.0)
+
+        return (first_a, last_b, duration_a + duration_b + self.travel[last_a, first_b] + waiting,
+                warp_a + warp_b + warp, max(earliest_b - delta, earliest_a) - waiting,
+                min(latest_b - delta, latest_a) + warp)
+
+    def sequence(self, nodes):
+        """
+        :return: summary of a sequence of nodes, in O(len(nodes))
+        """
+        summary = self.node(nodes[0])
+        for i in nodes[1:]:
+            summary = self.concatenate(summary, self.node(i))
+        return summary
+
+    def prefixes(self, route):
+        """
+        :return: summaries of route[0..k], for every k
+        """
+        summaries = [self.node(route[0])]
+        for i in route[1:]:
+            summaries.append(self.concatenate(summaries[-1], self.node(i)))
+        return summaries
+
+    def suffixes(self, route):
+        """
+        :return: summaries of route[k..], for every k
+        """
+        summaries = [self.node(route[-1])]
+        for i in reversed(route[:-1]):
+            summaries.append(self.concatenate(self.node(i), summaries[-1]))
+        return summaries[::-1]
+
+    def feasible(self, summary):
+        """
+        :return: True if the route with this summary (from the depot to the depot) has no time warp and respects the
+            duration limit
+        """
+        return summary[3] <= 0.000001 and summary[2] <= self.max_duration + 0.000001
+
+    def route_feasible(self, route):
+        return self.feasible(self.sequence(route))
+
+    def route_duration(self, route):
+        """
+        :return: (duration, time warp) of a route
+        """
+        summary = self.sequence(route)
+        return summary[2], summary[3]
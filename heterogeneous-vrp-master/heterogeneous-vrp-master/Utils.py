@@ -1,5 +1,7 @@
 from typing import Dict, List, Tuple
 
+from Evaluation import Evaluator, RouteBatch
+
 
 
 node = int
@@ -7,48 +9,46 @@ Arc = Tuple[int, int]
 
 
 def create_tour(arcs: Dict[Arc, bool]) -> List[node]:
-    nodes = sorted(set([customer_i for (customer_i, customer_j) in arcs]))
-    #print(nodes)
-
-    successors = [[]]
-    while len(successors) < len(nodes):
-        successors.append([])
-    for (i,j) in arcs.keys():
-        if arcs[i,j] == True:
-            successors[i] += [j]
-    #print("successors: ", successors)
-
-    length_succ = 0
-    for i in successors:
-        length_succ += len(i)
-    #print(length_succ)
-
-    first_node = 0
-    tour = [first_node]
-
-    while len(tour) < length_succ:
-        next_node = successors[first_node].pop(0)
-        tour.append(next_node)
-        first_node = next_node
+    """
+    giant tour following the used arcs of a solution: the routes, each one from the depot back to the depot, one after
+    the other.
+    :param arcs: dictionary arc -> True if the arc is used, e.g. x[i, j].X > 0.5 of the VRP model
+    :return: tour starting and ending at the depot, e.g. [0, 1, 2, 0, 3, 0]
+    """
+    successors = dict()
+    for (i, j), used in arcs.items():
+        if used:
+            successors.setdefault(i, []).append(j)
+
+    tour = [0]
+    visited = set()
+    for first in successors.get(0, []):
+        current = first
+        while current != 0:
+            if current in visited or current not in successors:
+                raise ValueError(f"the used arcs do not form routes from the depot (customer {current})")
+            visited.add(current)
+            tour.append(current)
+            current = successors[current][0]
+        tour.append(0)
     return tour
 
 
 def create_routes(tour: List[int]) -> List[List[int]]:
+    """
+    splits a giant tour at the depot, the tour is not changed
+    :return: list of routes, each one starting and ending at the depot, without empty routes
+    """
     routes = list()
-    routes.append([0])
-    tour.remove(0)
-    #print(routes)
-    #print(tour)
-    while len(tour) != 0:
-        if tour[0] != 0:
-            routes[-1].append(tour[0])
-            tour.pop(0)
-        else:
-            routes[-1].append(0)
-            tour.pop(0)
-            routes.append([0])
-        #print(len(tour))
-    routes[-1].append(0)
+    route = [0]
+    for i in tour:
+        if i != 0:
+            route.append(i)
+        elif len(route) > 1:
+            routes.append(route + [0])
+            route = [0]
+    if len(route) > 1:
+        routes.append(route + [0])
     return routes
 
 
@@ -72,10 +72,7 @@ def solution_cost(routes, dist, vehicle_consumption, gas_price):
 
     sol_distance = list()
     for route in routes:
-        route_distance = 0
-        for i in range(1, len(route)):
-            route_distance += dist[(route[i-1], route[i])]["tot"]
-        sol_distance.append(route_distance)
+        sol_distance.append(dist.route_length(route))
 
     # print(sol_distance)
 
@@ -90,28 +87,50 @@ def solution_cost(routes, dist, vehicle_consumption, gas_price):
 
 def compute_distance(route, dist):
 
-    distance = 0
-
-    for i in range(len(route) - 1):
-
-        distance += dist[(route[i], route[i + 1])]["tot"]
-
-    return distance
-
-
-def divide_routes(routes, nodes):
+    return dist.route_length(route)
 
-    number_t1 = 0
-    number_t2 = 0
 
-    routes_t1 = []
-    routes_t2 = []
+def divide_routes(routes, nodes, fleet):
+    """
+    assigns every route to the smallest vehicle type it fits in (the largest type if it fits in none)
+    :param fleet: Fleet
+    :return: list with the routes of every vehicle type, in the order of the types of the fleet
+    """
+    routes_by_type = [[] for t in range(len(fleet))]
     for i in routes:
-        if calculate_kg_required(i, nodes) > 883 or calculate_m3_required(i, nodes) > 5.80 * 1000:
-            number_t1 += 1
-            routes_t1.append(i)
-        else:
-            number_t2 += 1
-            routes_t2.append(i)
-
-    return routes_t1, routes_t2
\ No newline at end of file
+        t = fleet.route_type(calculate_kg_required(i, nodes), calculate_m3_required(i, nodes))
+        routes_by_type[t].append(i)
+
+    return routes_by_type
+
+
+def total_cost(routes, dist, nodes, fleet, gas_price, cost_model=None, evaluator=None):
+    """
+    fuel cost of the routes, each one driven by the vehicle type it is assigned to (see divide_routes), evaluated in
+    one batch (see Evaluation)
+    :param cost_model: optional CostModel, the cost of the routes is computed with it instead of the fuel cost
+    :param evaluator: optional Evaluator built on the same arguments, reused by callers which evaluate many solutions
+        instead of building a new one at every call
+    """
+    if evaluator is None:
+        evaluator = Evaluator(dist, nodes, fleet, gas_price, cost_model)
+    evaluation = evaluator.evaluate(RouteBatch.from_routes(routes))
+    return float(evaluation["solution cost"][0])
+
+
+def create_vehicles(models, availability):
+    """
+    creation of the vehicle dictionary, one entry for every vehicle (ids start from 1)
+    :param models: list of vehicle types
+    :param availability: number of available vehicles of every type
+    :return: dictionary id -> vehicle
+    """
+    vehicles = dict()
+    id = 1
+
+    for i in range(len(models)):
+        for j in range(availability[i]):
+            vehicles[id] = models[i].copy()
+            id += 1
+
+    return vehicles
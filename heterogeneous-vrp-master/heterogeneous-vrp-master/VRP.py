@@ -1,221 +1,254 @@
 import gurobipy as gp
-from gurobipy import *
+from gurobipy import GRB
+
+from Assignment import assign_vehicles
+from Fleet import Fleet
+from Improvement import granular_neighbors
+from Route import demand_arrays
 from Utils import create_tour, create_routes
 
 
-def solve_VRP(nodes, dist, vehicles, gas_price):
-    m = gp.Model("VRP_Baseline")
+"""
+Mixed integer model of the heterogeneous VRP, with vehicles aggregated by type:
+
+    x[i, j, t] = 1 if a vehicle of type t drives arc (i, j)
+    y[i, j, t] / w[i, j, t]: load (kg) / volume (m3) on board of the vehicle of type t while it drives arc (i, j)
+
+Vehicles of the same type are interchangeable, so one set of variables per type replaces one per vehicle: no
+symmetric solutions, and the number of vehicles of type t is the flow out of the depot, bounded by its availability.
+The load and the volume are single commodity flows: every customer takes its demand from the vehicle that visits it
+and the vehicles return empty, which also eliminates the subtours (of customers with a demand).
+
+Only a pruned set of arcs gets variables: the arcs between every customer and its nearest customers (see
+granular_neighbors, in both directions) and all the arcs to and from the depot, so the model has O(n k |T|)
+variables instead of O(n^2 |V|). The constraints are generated in bulk with addConstrs from the lists of the arcs
+leaving and entering every node, the names of variables and constraints are only created for debugging.
+
+With a time limit the model is an improvement step of bounded latency (see polish): the routes of a heuristic, driven
+by the vehicle types they are assigned to, are the MIP start (their arcs are added to the arc set), and the best
+solution found within the limit is decoded back into routes.
+"""
 
 
+def arc_set(dist, neighbors=10, routes=()):
+    """
+    pruned arc set of the model
+    :param dist: distance between nodes
+    :param neighbors: number of nearest customers of every customer, None for the complete graph
+    :param routes: routes whose arcs are added to the set, e.g. the routes of a MIP start
+    :return: sorted list of arcs (i, j)
+    """
+    n = len(dist)
+    if neighbors is None or neighbors >= n - 2:
+        return [(i, j) for i in range(n) for j in range(n) if i != j]
+
+    arcs = {(0, i) for i in range(1, n)} | {(i, 0) for i in range(1, n)}
+    for i, nearest in granular_neighbors(dist, neighbors).items():
+        for j in nearest:
+            arcs.add((i, j))
+            arcs.add((j, i))
+    for route in routes:
+        arcs.update((int(i), int(j)) for i, j in zip(route[:-1], route[1:]))
+    return sorted(arcs)
+
+
+def build_VRP(nodes, dist, fleet, gas_price, neighbors=10, names=False, cost_model=None, routes=()):
+    """
+    builds the model, see the description of the module.
+    :param nodes: info about customers
+    :param dist: distance between nodes
+    :param fleet: Fleet
+    :param gas_price: price of the fuel
+    :param neighbors: number of nearest customers connected to every customer, None for the complete graph
+    :param names: if True variables and constraints are named after their indices (slower, for debugging)
+    :param cost_model: optional CostModel, replaces the fuel cost of the arcs
+    :param routes: routes whose arcs are part of the model, e.g. the routes of a MIP start
+    :return: (model, x, y, w), x, y and w are tupledicts indexed by (i, j, t)
+    """
+    m = gp.Model("VRP_Baseline")
+    n = len(nodes)
+    types = range(len(fleet))
+    customers = range(1, n)
+    demand_kg, demand_m3 = demand_arrays(nodes)
+
+    arcs = arc_set(dist, neighbors, routes)
+    successors = [[] for i in range(n)]
+    predecessors = [[] for i in range(n)]
+    for i, j in arcs:
+        successors[i].append(j)
+        predecessors[j].append(i)
+    keys = gp.tuplelist((i, j, t) for t in types for i, j in arcs)
+
     ### DECISION VARIABLES
-    # x_ijm: indicates whether arc(i,j) is used by vehicle m
-    # y_ijm: represents the load delivered from vehicle m to customer j coming from customer i
-    # w_ijm: represents the volume delivered from vehicle m to customer j coming from customer i
-    # z_im:  indicates whether customer i is served by vehicle m
-
-    x = dict()
-    for vehicle in vehicles:
-        for node_i in nodes:
-            for node_j in nodes:
-                x[node_i["id"], node_j["id"], vehicle["id"]] = m.addVar(lb=0.0, ub=1.0, vtype=gp.GRB.BINARY, name=f'RD sub-tour{node_i["id"], node_j["id"]} with vehicle {vehicle["id"]}')
-    m.update()
-
-    y = dict()
-    for vehicle in vehicles:
-        for node_i in nodes:
-            for node_j in nodes:
-                y[node_i["id"], node_j["id"], vehicle["id"]] = m.addVar(lb=0.0, vtype=gp.GRB.CONTINUOUS, name=f'Load{node_i["id"], node_j["id"]} vehicle {vehicle["id"]}')
-    m.update()
-
-    w = dict()
-    for vehicle in vehicles:
-        for node_i in nodes:
-            for node_j in nodes:
-                w[node_i["id"], node_j["id"], vehicle["id"]] = m.addVar(lb=0.0, vtype=gp.GRB.CONTINUOUS, name=f'Volume{node_i["id"], node_j["id"]} vehicle {vehicle["id"]}')
-    m.update()
-
-    z = dict()
-    for vehicle in vehicles:
-        for node_i in nodes:
-            if node_i["id"]:
-                z[node_i["id"], vehicle["id"]] = m.addVar(lb=0.0, ub=1.0, vtype=gp.GRB.BINARY, name=f'Vehicle to customer match{node_i["id"], vehicle["id"]}')
-    m.update()
 
+    x = m.addVars(keys, vtype=GRB.BINARY, name="x" if names else "")
+    y = m.addVars(keys, lb=0.0, vtype=GRB.CONTINUOUS, name="y" if names else "")
+    w = m.addVars(keys, lb=0.0, vtype=GRB.CONTINUOUS, name="w" if names else "")
 
     ### 1- OBJECTIVE FUNCTION
 
-    costs = LinExpr()
-    for vehicle in vehicles:
-        for node_i in nodes:
-            for node_j in nodes:
-                index = node_i["id"] * len(nodes) + node_j["id"]
-                costs += x[node_i["id"], node_j["id"], vehicle["id"]] * dist[index]["tot"] * gas_price * vehicle["consumption"]
-
-    m.setObjective(costs, sense=gp.GRB.MINIMIZE)
-    m.update()
+    if cost_model is None:
+        cost = {(i, j, t): dist.tot[i, j] * fleet.consumption[t] * gas_price for i, j, t in keys}
+    else:
+        cost = {(i, j, t): cost_model.matrix(t)[i, j] for i, j, t in keys}
+    m.setObjective(x.prod(cost), GRB.MINIMIZE)
 
     ### CONSTRAINTS
 
-    # 2- Flow Conservation
-
-    # (2.1) flow conservation for all regular customers
-    for vehicle in vehicles:
-        for i in range(1, len(nodes)):
-            x_ijm = LinExpr()
-            x_jim = LinExpr()
-            for node in nodes:
-                x_ijm += x[i, node["id"], vehicle["id"]]
-                x_jim += x[node["id"], i, vehicle["id"]]
-            m.addConstr(lhs=x_ijm, sense=gp.GRB.EQUAL, rhs=z[i, vehicle["id"]])
-            m.addConstr(lhs=x_jim, sense=gp.GRB.EQUAL, rhs=z[i, vehicle["id"]])
-    m.update()
-
-    # (2.2) guarantees that every tour starts and ends at depot
-    for vehicle in vehicles:
-        x_0jm = LinExpr()
-        x_j0m = LinExpr()
-        for node in nodes:
-            x_0jm += x[0, node["id"], vehicle["id"]]
-            x_j0m += x[node["id"], 0, vehicle["id"]]
-        sub = x_0jm - x_j0m
-        m.addConstr(lhs=sub, sense=gp.GRB.EQUAL, rhs=0)
-        m.update()
-
-    # 3- Demand Fulfillment
-
-    # (3.1.1) kg demand fulfillment
-    load_carried = LinExpr()
-    for vehicle in vehicles:
-        for node_i in nodes:
-            if node_i["id"] == 0:
-                continue
-            y_ijm = LinExpr()
-            y_jim = LinExpr()
-            demandkg_im = node_i["demand_kg"] * z[node_i["id"], vehicle["id"]]
-            load_carried += demandkg_im
-            for node_j in nodes:
-                y_ijm += y[node_i["id"], node_j["id"], vehicle["id"]]
-                y_jim += y[node_j["id"], node_i["id"], vehicle["id"]]
-            sub = y_jim - y_ijm
-            m.addConstr(lhs=sub, sense=gp.GRB.EQUAL, rhs=demandkg_im)
-
-    # (3.1.2) total demand of customers is leaving the depot
-    y_ijm = LinExpr()
-    y_jim = LinExpr()
-    load_carried = load_carried * (-1)
-    for vehicle in vehicles:
-        for node in nodes:
-            y_ijm += y[0, node["id"], vehicle["id"]]
-            y_jim += y[node["id"], 0, vehicle["id"]]
-    sub = y_jim - y_ijm
-    m.addConstr(lhs=sub, sense=gp.GRB.EQUAL, rhs=load_carried)
-    m.update()
-
-    # (3.2.1) volume demand fulfillment
-    volume_carried = LinExpr()
-    for vehicle in vehicles:
-        for node_i in nodes:
-            if node_i["id"] == 0:
-                continue
-            w_ijm = LinExpr()
-            w_jim = LinExpr()
-            demandm3_im = node_i["demand_m3"] * z[node_i["id"], vehicle["id"]]
-            volume_carried += demandm3_im
-            for node_j in nodes:
-                w_ijm += w[node_i["id"], node_j["id"], vehicle["id"]]
-                w_jim += w[node_j["id"], node_i["id"], vehicle["id"]]
-            sub = w_jim - w_ijm
-            m.addConstr(lhs=sub, sense=gp.GRB.EQUAL, rhs=demandm3_im)
-
-    # (3.2.2) total demand of customers is leaving the depot
-    w_ijm = LinExpr()
-    w_jim = LinExpr()
-    volume_carried = volume_carried * (-1)
-    for vehicle in vehicles:
-        for node in nodes:
-            w_ijm += w[0, node["id"], vehicle["id"]]
-            w_jim += w[node["id"], 0, vehicle["id"]]
-    sub = w_jim - w_ijm
-    m.addConstr(lhs=sub, sense=gp.GRB.EQUAL, rhs=volume_carried)
-    m.update()
-
-    # 4- Capacity
-
-    # (4.1) load
-    for vehicle in vehicles:
-        load = LinExpr()
-        for node_i in nodes:
-            for node_j in nodes:
-                load += y[node_i["id"], node_j["id"], vehicle["id"]]
-                capacity_kg = vehicle["max load"]
-        m.addConstr(lhs=load, sense=gp.GRB.LESS_EQUAL, rhs=capacity_kg)
-    m.update()
-
-    # (4.2) volume
-    for vehicle in vehicles:
-        volume = LinExpr()
-        for node_i in nodes:
-            for node_j in nodes:
-                volume += w[node_i["id"], node_j["id"], vehicle["id"]]
-                capacity_m3 = vehicle["vol capacity"]
-        m.addConstr(lhs=volume, sense=gp.GRB.LESS_EQUAL, rhs=capacity_m3)
-    m.update()
-
-    # 5- vehicle returns empty to the depot
-
-    # (5.1) load
-
-    for vehicle in vehicles:
-        for node in nodes:
-            final_load = y[node["id"], 0, vehicle["id"]]
-            m.addConstr(lhs=final_load, sense=gp.GRB.EQUAL, rhs=0)
-    m.update()
-
-    # (5.2) volume
-
-    for vehicle in vehicles:
-        for node in nodes:
-            final_volume = w[node["id"], 0, vehicle["id"]]
-            m.addConstr(lhs=final_volume, sense=gp.GRB.EQUAL, rhs=0)
-    m.update()
-
-
-
-    # 6- each customer is served once
-
-    # (6)
-
-    for node in nodes:
-        if node["id"] == 0:
+    # 2- every customer is left once, by one vehicle type, which also enters it (flow conservation, depot included)
+    m.addConstrs((gp.quicksum(x[i, j, t] for j in successors[i] for t in types) == 1 for i in customers),
+                 name="visit" if names else "")
+    m.addConstrs((gp.quicksum(x[i, j, t] for j in successors[i]) == gp.quicksum(x[j, i, t] for j in predecessors[i])
+                  for i in range(n) for t in types), name="flow" if names else "")
+
+    # 3- no more routes of a type than vehicles of the type
+    m.addConstrs((gp.quicksum(x[0, j, t] for j in successors[0]) <= int(fleet.availability[t]) for t in types),
+                 name="fleet" if names else "")
+
+    # 4- demand fulfillment: the vehicle visiting a customer delivers its load and volume
+    m.addConstrs((gp.quicksum(y[j, i, t] for j in predecessors[i]) - gp.quicksum(y[i, j, t] for j in successors[i]) ==
+                  demand_kg[i] * gp.quicksum(x[i, j, t] for j in successors[i]) for i in customers for t in types),
+                 name="load" if names else "")
+    m.addConstrs((gp.quicksum(w[j, i, t] for j in predecessors[i]) - gp.quicksum(w[i, j, t] for j in successors[i]) ==
+                  demand_m3[i] * gp.quicksum(x[i, j, t] for j in successors[i]) for i in customers for t in types),
+                 name="volume" if names else "")
+
+    # 5- capacity: on arc (i, j) the vehicle carries at least the demand of j and at most its capacity without the
+    # demand of i, and it returns empty to the depot
+    def upper(capacity, demand, i, j):
+        return 0.0 if j == 0 else capacity - demand[i]
+
+    m.addConstrs((y[i, j, t] <= upper(fleet.capacity_kg[t], demand_kg, i, j) * x[i, j, t] for i, j, t in keys),
+                 name="capacity_kg" if names else "")
+    m.addConstrs((y[i, j, t] >= demand_kg[j] * x[i, j, t] for i, j, t in keys if j != 0),
+                 name="min_kg" if names else "")
+    m.addConstrs((w[i, j, t] <= upper(fleet.capacity_m3[t], demand_m3, i, j) * x[i, j, t] for i, j, t in keys),
+                 name="capacity_m3" if names else "")
+    m.addConstrs((w[i, j, t] >= demand_m3[j] * x[i, j, t] for i, j, t in keys if j != 0),
+                 name="min_m3" if names else "")
+
+    return m, x, y, w
+
+
+def set_start(x, y, w, nodes, routes, types):
+    """
+    sets the routes as MIP start of the model. If every route has a vehicle type the start is complete (all the
+    other arcs are unused), otherwise only the routes with a type are set and the solver completes the start.
+    :param x, y, w: variables of the model, see build_VRP
+    :param nodes: info about customers
+    :param routes: list of routes, their arcs have to be part of the model
+    :param types: vehicle type of every route, -1 for the routes without vehicle (see assign_vehicles)
+    """
+    complete = all(t != -1 for t in types)
+    if complete:
+        for key in x.keys():
+            x[key].Start = 0.0
+            y[key].Start = 0.0
+            w[key].Start = 0.0
+
+    demand_kg, demand_m3 = demand_arrays(nodes)
+    for route, t in zip(routes, types):
+        if t == -1:
             continue
-        delivery = LinExpr()
-        for vehicle in vehicles:
-            delivery += z[node["id"], vehicle["id"]]
-        m.addConstr(lhs=delivery, sense=gp.GRB.EQUAL, rhs=1)
-    m.update()
+        # load and volume on board decrease by the demand of every customer visited
+        kg = demand_kg[list(route)].sum()
+        m3 = demand_m3[list(route)].sum()
+        for i, j in zip(route[:-1], route[1:]):
+            kg -= demand_kg[i]
+            m3 -= demand_m3[i]
+            key = (int(i), int(j), int(t))
+            x[key].Start = 1.0
+            y[key].Start = max(kg, 0.0)
+            w[key].Start = max(m3, 0.0)
+
+
+def decode(model, x, fleet):
+    """
+    routes of the best solution found
+    :return: (routes, types), the vehicle type of every route
+    """
+    values = model.getAttr("X", x)
+    routes = list()
+    types = list()
+    for t in range(len(fleet)):
+        arcs = {(i, j): value > 0.5 for (i, j, t_arc), value in values.items() if t_arc == t}
+        routes_t = create_routes(create_tour(arcs))
+        routes += routes_t
+        types += [t] * len(routes_t)
+    return routes, types
+
+
+def solve_VRP(nodes, dist, vehicles, gas_price, neighbors=10, names=False, cost_model=None, time_limit=None,
+              mip_gap=None):
+    """
+    builds and solves the model, see build_VRP.
+    :param vehicles: Fleet, or the dictionary with one entry for every vehicle (see Fleet.vehicles)
+    :param time_limit: optional time limit of the solver in seconds
+    :param mip_gap: optional relative gap at which the solver stops
+    :return: objective value of the optimal solution, or a message if the model is infeasible or was not solved to
+        optimality
+    """
+    fleet = vehicles if isinstance(vehicles, Fleet) else Fleet.from_vehicles(vehicles)
+    m, x, y, w = build_VRP(nodes, dist, fleet, gas_price, neighbors, names, cost_model)
+    if time_limit is not None:
+        m.Params.TimeLimit = time_limit
+    if mip_gap is not None:
+        m.Params.MIPGap = mip_gap
 
     m.optimize()
 
-    if m.Status == gp.GRB.OPTIMAL:
-        """arcs_used = dict()
-        for node_i, node_j, vehicle in x:
-            arcs_used[node_i, node_j, vehicle] = (x[node_i, node_j, vehicle].X >= m.params.IntFeasTol)
-        #interim_solution = create_tour(arcs_used)
-        #solution = create_routes(interim_solution)
-
-        used_vehicles = list()
-        for node in nodes:
-            for vehicle in vehicles:
-                if z[node["id"], vehicle["id"]].X >= m.params.IntFeasTol:
-                    used_vehicles.append(vehicle["id"])
-                    continue
-"""
-        return m.ObjVal #, arcs_used, used_vehicles
+    if m.Status == GRB.OPTIMAL:
+        return m.ObjVal
 
-    elif m.Status == gp.GRB.INFEASIBLE:
+    elif m.Status == GRB.INFEASIBLE:
         message_1 = 'Model is infeasible'
         return message_1
 
     else:
         message_2 = 'Model could not be solved to optimality'
-        return message_2
\ No newline at end of file
+        return message_2
+
+
+def polish(nodes, dist, fleet, gas_price, routes, time_limit=60.0, mip_gap=0.01, neighbors=10, cost_model=None):
+    """
+    improves heuristic routes with the model: the routes, assigned to the vehicles at minimum cost, are the MIP start
+    and the best solution found within the time limit is returned.
+    :param nodes: info about customers
+    :param dist: distance between nodes
+    :param fleet: Fleet
+    :param gas_price: price of the fuel
+    :param routes: routes of a heuristic, e.g. Construction.idea_2 followed by vnd
+    :param time_limit: time limit of the solver in seconds
+    :param mip_gap: relative gap at which the solver stops
+    :param neighbors: number of nearest customers connected to every customer, see arc_set
+    :param cost_model: optional CostModel, replaces the fuel cost
+    :return: dictionary with
+        "routes", "types": routes of the best solution and their vehicle types, the given routes if the solver did not
+            find a better one
+        "cost": cost of the routes
+        "bound": lower bound on the cost of the best solution with the pruned arc set, None without a solution
+        "status": status of the solver (GRB.OPTIMAL, GRB.TIME_LIMIT, ...)
+        "improved": True if the routes come from the solver and are cheaper than the given ones
+    """
+    routes = [[int(c) for c in route] for route in routes]
+    assignment = assign_vehicles(routes, dist, nodes, fleet, gas_price, cost_model)
+
+    m, x, y, w = build_VRP(nodes, dist, fleet, gas_price, neighbors, cost_model=cost_model, routes=routes)
+    set_start(x, y, w, nodes, routes, assignment["types"])
+    m.Params.TimeLimit = time_limit
+    m.Params.MIPGap = mip_gap
+
+    m.optimize()
+
+    result = {"routes": routes, "types": list(assignment["types"]), "cost": assignment["cost"], "bound": None,
+              "status": m.Status, "improved": False}
+    if m.SolCount == 0:
+        return result
+    result["bound"] = m.ObjBound
+
+    # an unassigned route is not part of the cost of the assignment, any solution of the model is better
+    if m.ObjVal < assignment["cost"] - 0.000001 or not assignment["feasible"]:
+        result["routes"], result["types"] = decode(m, x, fleet)
+        result["cost"] = m.ObjVal
+        result["improved"] = True
+    return result
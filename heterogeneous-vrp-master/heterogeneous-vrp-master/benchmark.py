@@ -0,0 +1,127 @@
+# Comparison of the full and the granular neighborhoods of the VND, with and without don't-look bits, latency of the
+# parallel neighborhood evaluation, and quality / time trade-off of the hybrid genetic search on the NYC instances
+import os
+import time
+
+import numpy as np
+
+import Instancereader
+import Construction
+from Utils import *
+from Improvement import vnd, granular_neighbors
+from Fleet import Fleet
+from HGS import hgs
+
+
+gas_price = 0.63
+
+t1 = {"model": "t1", "vol capacity": 34.80 * 1000, "max load": 2800, "consumption": 0.175}
+t2 = {"model": "t2", "vol capacity": 5.80 * 1000, "max load": 883, "consumption": 0.08}
+
+models = [t1, t2]
+availability = [8, 12]
+
+fleet = Fleet(models, availability)
+
+
+def evaluate(routes, dist, nodes):
+    """
+    :return: (total distance, fuel cost) of the routes
+    """
+    cost = total_cost(routes, dist, nodes, fleet, gas_price)
+    return sum(compute_distance(route, dist) for route in routes), cost
+
+
+def benchmark_granular(instance, sizes=(10, 20, 30)):
+    data = Instancereader.read_instance(instance)
+    nodes = data["nodes"]
+    dist = data["dist"]
+
+    print(f"\n{instance}: {data['c']} customers")
+    print(f"{'construction':<14}{'neighborhood':<18}{'time [s]':>10}{'distance':>12}{'cost':>10}{'routes':>8}")
+
+    for construction in (Construction.idea_1, Construction.idea_2, Construction.idea_3):
+        routes = construction(fleet, nodes, dist)
+
+        runs = [("full", None)] + [(f"granular {k}", granular_neighbors(dist, k)) for k in sizes]
+        runs = [(name, neighbors, False) for name, neighbors in runs] + \
+            [(name + " dlb", neighbors, True) for name, neighbors in runs]
+        for name, neighbors, dont_look_bits in runs:
+            start = time.perf_counter()
+            improved = vnd([route.copy() for route in routes], dist, nodes, fleet, neighbors, dont_look_bits)
+            elapsed = time.perf_counter() - start
+
+            distance, cost = evaluate(improved, dist, nodes)
+            print(f"{construction.__name__:<14}{name:<18}{elapsed:>10.3f}{distance:>12.2f}{cost:>10.2f}{len(improved):>8}")
+
+
+def benchmark_parallel(instance, workers=(1, 2, 4, 8), repeats=3):
+    """
+    latency of the VND with the relocate and exchange neighborhoods evaluated in batch by threads (best improvement),
+    compared with the sequential VND (first improvement). The time is the best of repeats runs.
+    """
+    data = Instancereader.read_instance(instance)
+    nodes = data["nodes"]
+    dist = data["dist"]
+
+    print(f"\n{instance}: {data['c']} customers, {os.cpu_count()} cores")
+    print(f"{'construction':<14}{'workers':>10}{'time [s]':>10}{'distance':>12}{'cost':>10}")
+
+    for construction in (Construction.idea_1, Construction.idea_2, Construction.idea_3):
+        routes = construction(fleet, nodes, dist)
+        for w in (None,) + tuple(workers):
+            elapsed = float("inf")
+            for _ in range(repeats):
+                start = time.perf_counter()
+                improved = vnd([route.copy() for route in routes], dist, nodes, fleet, workers=w)
+                elapsed = min(elapsed, time.perf_counter() - start)
+
+            distance, cost = evaluate(improved, dist, nodes)
+            name = "serial" if w is None else w
+            print(f"{construction.__name__:<14}{name:>10}{elapsed:>10.3f}{distance:>12.2f}{cost:>10.2f}")
+
+
+def best_at(history, budget, position):
+    """
+    :return: best cost of a run within the budget, history entries are (seconds, iteration, cost)
+    """
+    costs = [entry[2] for entry in history if entry[position] <= budget]
+    return min(costs) if costs else float("inf")
+
+
+def benchmark_hgs(instance, time_limit=30.0, seeds=(0, 1, 2), checkpoints=(1, 2, 5, 10, 20, 30),
+                  iterations=(0, 25, 50, 100, 200, 400)):
+    """
+    quality / time trade-off of the HGS: one run per seed with the full time budget, the best cost at every
+    checkpoint (seconds and iterations) is read from the history of the run. The initial population contains the
+    three construction heuristics.
+    """
+    data = Instancereader.read_instance(instance)
+    nodes = data["nodes"]
+    dist = data["dist"]
+
+    initial_routes = [construction(fleet, nodes, dist)
+                      for construction in (Construction.idea_1, Construction.idea_2, Construction.idea_3)]
+    constructed = min(evaluate(vnd(routes, dist, nodes, fleet), dist, nodes)[1] for routes in initial_routes)
+
+    runs = [hgs(nodes, dist, fleet, gas_price, time_limit, initial_routes=initial_routes, seed=seed)
+            for seed in seeds]
+
+    print(f"\n{instance}: {data['c']} customers, construction + vnd cost {constructed:.2f}")
+    print(f"{'seconds':>10}" + "".join(f"{'seed ' + str(seed):>12}" for seed in seeds) + f"{'mean':>12}")
+    for budget in checkpoints:
+        costs = [best_at(run["history"], budget, 0) for run in runs]
+        print(f"{budget:>10}" + "".join(f"{cost:>12.2f}" for cost in costs) + f"{np.mean(costs):>12.2f}")
+
+    print(f"{'iteration':>10}" + "".join(f"{'seed ' + str(seed):>12}" for seed in seeds) + f"{'mean':>12}")
+    for budget in iterations:
+        costs = [best_at(run["history"], budget, 1) for run in runs]
+        print(f"{budget:>10}" + "".join(f"{cost:>12.2f}" for cost in costs) + f"{np.mean(costs):>12.2f}")
+    print(f"{'total':>10}" + "".join(f"{run['iterations']:>12}" for run in runs))
+
+
+if __name__ == "__main__":
+    for instance in ("NYC1.xlsx", "NYC.xlsx"):
+        benchmark_granular(instance)
+        benchmark_parallel(instance)
+        benchmark_hgs(instance)
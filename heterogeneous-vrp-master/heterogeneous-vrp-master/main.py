@@ -5,6 +5,8 @@ from Plot import draw_routes
 from Improvement import *
 from statistics import *
 import VRP
+from Fleet import Fleet
+from Assignment import assign_vehicles, assignment_report
 
 
 # (1) read instance data
@@ -12,13 +14,15 @@ import VRP
 
 instance = "NYC.xlsx"
 
-data = Instancereader.read_nodes(instance)
+# the workbook is parsed only the first time, afterwards it is loaded from the binary cache in .instance_cache
+
+data = Instancereader.read_instance(instance)
 nodes = data["nodes"]
 C = data["c"]
 
 # print(nodes, "\n")
 
-dist = Instancereader.read_distances(instance, C +1)
+dist = data["dist"]
 # print(dist, "\n")
 
 # (2) vehicles
@@ -35,19 +39,14 @@ t2 = {"model": "t2", "vol capacity": 5.80 * 1000, "max load": 883, "consumption"
 models = [t1, t2]
 availability = [8, 12]
 
-vehicles = dict()
-id = 1
-
-for i in range(len(models)):
-    for j in range(availability[i]):
-        vehicles[id] = models[i].copy()
-        id += 1
+fleet = Fleet(models, availability)
+vehicles = fleet.vehicles()
 
 # print(vehicles, "\n")
 
 # NAIVE SOLUTION - JUST IGNORE
 """
-routes = naive_solution(vehicles, nodes)
+routes = naive_solution(fleet, nodes)
 print(routes)
 
 naive_cost = solution_cost(routes, dist, vehicles, gas_price)
@@ -59,21 +58,20 @@ draw_routes(routes, nodes)
 # CONSTRUCTION HEURISTICS
 # CHOOSE BETWEEN IDEA_1, _2 AND _3
 
-routes = Construction.idea_2(vehicles, nodes, dist, availability)
+routes = Construction.idea_2(fleet, nodes, dist)
 
 print("\n number of routes", len(routes))
 
 # DIVISION OF ROUTES BY VEHICLE
 
-# function to be made scalable, maybe return list of lists and divide later
+# one list of routes for every vehicle type, in the order of models
 
-routes_t1, routes_t2 = divide_routes(routes, nodes)
+routes_by_type = divide_routes(routes, nodes, fleet)
 
-# CALCULATION OF SOLUTION COST - TO BE IMPROVED
-cost_t1 = solution_cost(routes_t1, dist, t1["consumption"], gas_price)
-cost_t2 = solution_cost(routes_t2, dist, t2["consumption"], gas_price)
-print("\n total cost of solution", cost_t1 + cost_t2)
-print("\n routes t1", len(routes_t1), routes_t1, "\n routes t2", len(routes_t2), routes_t2)
+# CALCULATION OF SOLUTION COST
+print("\n total cost of solution", total_cost(routes, dist, nodes, fleet, gas_price))
+for t, routes_t in enumerate(routes_by_type):
+    print("\n routes", fleet.names[t], len(routes_t), routes_t)
 
 
 # RANDOM CAPACITY CHECK - USED FOR TESTING
@@ -95,18 +93,33 @@ else:
 
 # ######################################## IMPROVEMENTS #####################################################
 
-# routes = hillclimbing(routes, dist, nodes)
-routes = vnd(routes, dist, nodes)
+# routes = hillclimbing(routes, dist, nodes, fleet)
+routes = vnd(routes, dist, nodes, fleet)
 
-# DIVISION OF ROUTES BY VEHICLE
+# MULTI-START ALTERNATIVE: idea_1, _2 and _3 plus randomized variants, each followed by vnd, on all the cores
+# (run Multistart.py directly, the process pool needs the __main__ guard)
+# routes, stats = Multistart.multistart(instance, models, availability, gas_price)
+
+# DECOMPOSITION ALTERNATIVE FOR LARGE INSTANCES: clusters of customers solved in parallel, sharing the fleet, then
+# stitched and improved by a last VND (run Decomposition.py directly, the process pool needs the __main__ guard)
+# routes = Decomposition.decompose(instance, models, availability, gas_price, cluster_size=50)["routes"]
+
+# HYBRID GENETIC SEARCH ALTERNATIVE: population of giga-tours decoded by split and educated by vnd, within a time budget
+# routes = HGS.hgs(nodes, dist, fleet, gas_price, time_limit=30, initial_routes=[routes])["routes"]
+
+# ALNS ALTERNATIVE: destroy and repair the routes until the deadline (seconds), the latency is set by time_limit
+# routes = ALNS.alns(nodes, dist, fleet, gas_price, routes, time_limit=30)["routes"]
+
+# MIP POLISHING (needs gurobi): the routes are the start of the VRP model, solved until the time limit or the gap
+# routes = VRP.polish(nodes, dist, fleet, gas_price, routes, time_limit=60, mip_gap=0.01)["routes"]
 
-routes_t1, routes_t2 = divide_routes(routes, nodes)  # function to be made scalable, maybe return list of lists and divide later
+# ASSIGNMENT OF THE ROUTES TO THE VEHICLES: minimum fuel cost within the availability of every vehicle type
 
-# CALCULATION OF SOLUTION COST - TO BE IMPROVED
-cost_t1 = solution_cost(routes_t1, dist, t1["consumption"], gas_price)
-cost_t2 = solution_cost(routes_t2, dist, t2["consumption"], gas_price)
-print("\n total cost of solution", cost_t1 + cost_t2)
-print("\n routes t1", len(routes_t1), routes_t1, "\n routes t2", len(routes_t2), routes_t2)
+assignment = assign_vehicles(routes, dist, nodes, fleet, gas_price)
+print("\n" + assignment_report(assignment, fleet))
+for t in range(len(fleet)):
+    routes_t = [route for route, t_route in zip(routes, assignment["types"]) if t_route == t]
+    print("\n routes", fleet.names[t], len(routes_t), routes_t)
 print("\n number of routes", len(routes))
 
 # PLOTTING SOLUTION
@@ -0,0 +1,29 @@
+# Size of the clusters of the decomposition
+import os
+
+import numpy as np
+import pytest
+
+import Instancereader
+from Decomposition import CLUSTERINGS, size_limit
+
+
+INSTANCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "NYC.xlsx")
+
+
+@pytest.fixture(scope="module")
+def nodes(tmp_path_factory):
+    return Instancereader.read_instance(INSTANCE, cache_dir=str(tmp_path_factory.mktemp("cache")))["nodes"]
+
+
+@pytest.mark.parametrize("clustering", sorted(CLUSTERINGS))
+@pytest.mark.parametrize("cluster_size", [20, 40, 50])
+def test_cluster_size(nodes, clustering, cluster_size):
+    n_customers = len(nodes) - 1
+    n_clusters = int(np.ceil(n_customers / cluster_size))
+    clusters = CLUSTERINGS[clustering](nodes, n_clusters)
+
+    # every customer in exactly one cluster, no cluster above the size limit
+    assert sorted(u for cluster in clusters for u in cluster) == list(range(1, len(nodes)))
+    assert len(clusters) == n_clusters
+    assert max(len(cluster) for cluster in clusters) <= size_limit(n_customers, n_clusters, 0.1)
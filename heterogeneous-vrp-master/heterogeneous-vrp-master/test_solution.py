@@ -0,0 +1,43 @@
+# Change in cost of the moves evaluated by Solution
+import os
+
+import numpy as np
+import pytest
+
+import Instancereader
+from Fleet import Fleet
+from Solution import Solution
+
+
+INSTANCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "NYC1.xlsx")
+
+
+@pytest.fixture(scope="module")
+def data(tmp_path_factory):
+    return Instancereader.read_instance(INSTANCE, cache_dir=str(tmp_path_factory.mktemp("cache")))
+
+
+def test_cost_change_over_capacity_batch(data):
+    t1 = {"model": "t1", "vol capacity": 34.80 * 1000, "max load": 2800, "consumption": 0.175}
+    t2 = {"model": "t2", "vol capacity": 5.80 * 1000, "max load": 883, "consumption": 0.08}
+    fleet = Fleet([t1, t2], [8, 12])
+    nodes = data["nodes"]
+
+    # route 0 visits all the customers and fits no vehicle type, route 1 fits the small type
+    routes = [[0] + list(range(1, len(nodes))) + [0], [0, 1, 0]]
+    solution = Solution(routes, data["dist"], nodes, fleet, gas_price=0.63)
+    assert fleet.route_types(solution.kg[0], solution.m3[0]) == -1
+
+    # moves which keep route 0 over capacity, bring it back within the large type, or move route 1 to another type
+    r_id = np.array([0, 0, 0, 1, 1])
+    change = np.array([-1.0, -5.0, 2.0, 3.0, -0.5])
+    kg = np.array([solution.kg[0] - 100, 2000, 800, 2000, 30000])
+    m3 = np.array([solution.m3[0] - 100, 20000, 5000, 20000, 300000])
+
+    batch = solution.cost_change(r_id, change, kg, m3)
+    single = [solution.cost_change(int(r), float(c), float(w), float(v)) for r, c, w, v in zip(r_id, change, kg, m3)]
+    assert np.allclose(batch, single)
+
+    # an over capacity route is driven by the largest type, as in Fleet.route_type
+    largest = fleet.consumption[fleet.largest_type()] * 0.63
+    assert batch[0] == pytest.approx(largest * change[0])